@@ -0,0 +1,145 @@
+"""
+    Non-interactive entry point of the image augmentation:
+
+        python augment_cli.py --config input_config_1.json --input images --output images_aug --workers 8
+
+    Only the standard library is imported at start up. OpenCV, NumPy and the augmentation
+    modules are imported once there is at least one input file and one config entry to process,
+    so runs with nothing to do (and --help) take little more than the interpreter start
+"""
+import argparse
+import json
+import os
+import sys
+from params_extract_utils import ConfigError
+
+
+def work_shard(value):
+    """
+        'i/N' command line value of --shard, as an (i, N) tuple
+    """
+    try:
+        shard_index, shard_count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must be i/N, for example 0/4, got '{}'".format(value))
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise argparse.ArgumentTypeError('shard must be i/N with 0 <= i < N, got {}'.format(value))
+    return (shard_index, shard_count)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Augment every image of a directory with the transformations of a JSON config file')
+    parser.add_argument('--config', required=True, help='path of the JSON configuration file')
+    parser.add_argument('--input', required=True, help='directory of the images to augment')
+    parser.add_argument('--output', default=None, help="directory of the augmented images, input directory + '_aug' by default")
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes (default: 1)')
+    parser.add_argument('--seed', type=int, default=None, help='global seed of the random methods (default: a random seed)')
+    parser.add_argument('--intermediate-memory-mb', type=int, default=512,
+                        help='memory for intermediate results shared between entries, per worker (default: 512)')
+    parser.add_argument('--buffer-pool-mb', type=int, default=256,
+                        help='memory for image buffers the transforms write into and reuse from image to image, per worker, '
+                             '0 allocates new arrays for every step (default: 256)')
+    parser.add_argument('--shard', type=work_shard, default=None, metavar='I/N',
+                        help='augment only the (input file, config entry) pairs of shard I of N, assigned by a stable hash, '
+                             'and record them in a manifest of the shard; run shards 0 to N-1 with the same --seed and '
+                             '--output, then --merge-shards N (default: no sharding)')
+    parser.add_argument('--merge-shards', type=int, default=None, metavar='N',
+                        help='instead of augmenting, check that the N shard manifests of the output directory record every '
+                             'output exactly once and merge them into the manifest of the output directory')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='augment every image again, even the outputs the manifest of the output directory records as done')
+    parser.add_argument('--prune', action='store_true',
+                        help='delete the outputs of input images and config entries that are no longer part of the run')
+    parser.add_argument('--target-size', type=int, default=None, metavar='PIXELS',
+                        help='downscale the input images once, right after decoding, to this shorter side and run the '
+                             'transforms at that size; large JPEGs are decoded directly at a reduced size (default: full resolution)')
+    parser.add_argument('--shard-size-mb', type=int, default=None,
+                        help='append the augmented images to shard files of this size with an index of their samples, '
+                             'instead of writing one file per image (default: one file per image)')
+    parser.add_argument('--raw-shards', action='store_true',
+                        help='store the images in the shards as raw uint8 arrays instead of encoding them')
+    parser.add_argument('--stats', default=None,
+                        help='record the time of every stage (read, each op, each entry, write) and write a JSON summary to this file')
+    parser.add_argument('--progress', type=float, default=None, metavar='SECONDS',
+                        help='print a progress line on stderr at most every SECONDS seconds')
+    parser.add_argument('--io-threads', type=int, default=2,
+                        help='threads decoding the input images and threads encoding the outputs, per worker (default: 2)')
+    parser.add_argument('--queue-size', type=int, default=8,
+                        help='maximum number of images waiting to be transformed and to be encoded, per worker (default: 8)')
+    parser.add_argument('--format', default='auto', choices=('auto', 'jpg', 'png', 'webp'),
+                        help='output format, auto keeps lossless inputs (PNG, BMP, TIFF) as PNG and stores the others as JPEG (default: auto)')
+    parser.add_argument('--jpeg-quality', type=int, default=95, help='JPEG quality in [0,100] (default: 95)')
+    parser.add_argument('--png-compression', type=int, default=3, help='PNG compression level in [0,9] (default: 3)')
+    parser.add_argument('--webp-quality', type=int, default=90, help='WebP quality in [1,100] (default: 90)')
+    parser.add_argument('--lossless', action='store_true', help='lossless outputs only (PNG, or lossless WebP with --format webp)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.merge_shards is not None and args.merge_shards < 1:
+        print('--merge-shards must be a positive number of shards, got {}'.format(args.merge_shards), file=sys.stderr)
+        return 2
+    if (args.shard is not None or args.merge_shards is not None) and args.seed is None:
+        print('sharded runs need a --seed, so that every shard draws the same random values', file=sys.stderr)
+        return 2
+    try:
+        with open(args.config, 'r', encoding='utf8') as json_file:
+            aug_config_dict = json.load(json_file)
+    except OSError as error:
+        print('can not read config {}: {}'.format(args.config, error.strerror or error), file=sys.stderr)
+        return 2
+    except json.JSONDecodeError as error:
+        print('invalid config {}: not valid JSON: {}'.format(args.config, error), file=sys.stderr)
+        return 2
+    try:
+        has_input_files = any(entry.is_file() for entry in os.scandir(args.input))
+    except OSError as error:
+        print('can not read input directory {}: {}'.format(args.input, error.strerror or error), file=sys.stderr)
+        return 2
+    if not aug_config_dict or not has_input_files:
+        print('nothing to augment')
+        return 0
+    # heavy imports (OpenCV, NumPy) only once there is work to do
+    from main import DataAugmentation, OutputNameCollisionError
+    from image_io import OutputCodec
+    try:
+        output_codec = OutputCodec(args.format, jpeg_quality=args.jpeg_quality, png_compression=args.png_compression,
+                                   webp_quality=args.webp_quality, lossless=args.lossless)
+    except ValueError as error:
+        print('invalid output options: {}'.format(error), file=sys.stderr)
+        return 2
+    try:
+        data_augmentation = DataAugmentation(args.config, input_images_dir_path=args.input, output_dir_path=args.output,
+                                             workers=args.workers, seed=args.seed,
+                                             intermediate_memory_limit=args.intermediate_memory_mb * 1024 * 1024,
+                                             output_codec=output_codec, io_threads=args.io_threads, queue_size=args.queue_size,
+                                             resume=not args.no_resume, prune=args.prune,
+                                             shard_size=None if args.shard_size_mb is None else args.shard_size_mb * 1024 * 1024,
+                                             raw_shards=args.raw_shards, stats_file_path=args.stats, progress_interval=args.progress,
+                                             target_size=args.target_size, buffer_pool_limit=args.buffer_pool_mb * 1024 * 1024,
+                                             work_shard=args.shard)
+    except ConfigError as error:
+        print('invalid config {}: {}'.format(args.config, error), file=sys.stderr)
+        return 2
+    except ValueError as error: # target size, work shard
+        print('invalid options: {}'.format(error), file=sys.stderr)
+        return 2
+    if args.merge_shards is not None:
+        problems = data_augmentation.merge_shard_manifests(args.merge_shards)
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        if problems:
+            print('shards not merged: {} problems'.format(len(problems)), file=sys.stderr)
+            return 1
+        return 0
+    try:
+        data_augmentation.augment_images()
+    except OutputNameCollisionError as error:
+        print(error, file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
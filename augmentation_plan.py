@@ -0,0 +1,590 @@
+"""
+    Compile-once execution plan of a configuration file.
+
+    The JSON config is parsed and validated once into an immutable AugmentationPlan: one
+    AugmentationEntry per config entry, holding the ops of the entry with their parameters
+    already extracted and type checked. Invalid configs raise ConfigError before any image
+    is processed. Methods are looked up in OP_REGISTRY, so new methods can be added without
+    touching the plan or DataAugmentation:
+
+        @register_op('invert')
+        @dataclass(frozen=True)
+        class InvertOp(AugmentationOp):
+            @classmethod
+            def from_config(cls, method_params_dict):
+                cls.params_extract.check_param_names('invert', method_params_dict, ())
+                return cls()
+
+            def apply(self, image, rng=None):
+                return 255 - image
+
+    An entry can also produce several samples per image ("samples": K) and draw its ops from a
+    RandAugment style policy ("rand_augment": pick num_ops of the given ops, with magnitudes drawn
+    from ranges), see RandAugmentPolicy
+"""
+import hashlib
+from dataclasses import dataclass, replace
+import numpy as np
+from cv2 import cv2
+from image_augmentation import ImageAugmentation
+from params_extract_utils import ParamsExtractUtils, ConfigError
+from geometric_chain import GeometricChainCompiler
+from photometric_lut import PhotometricLutCompiler
+
+OP_REGISTRY = {} # config method name -> AugmentationOp subclass
+SAMPLES_KEY = 'samples' # entry key of the number of samples per image
+POLICY_KEY = 'rand_augment' # entry key of a RandAugmentPolicy
+
+
+def register_op(method_name):
+    """
+        Class decorator registering an AugmentationOp subclass under the method name used in config files
+    """
+    def decorator(op_class):
+        if method_name in (SAMPLES_KEY, POLICY_KEY):
+            raise ValueError("'{}' is a reserved entry key, not a method name".format(method_name))
+        if method_name in OP_REGISTRY:
+            raise ValueError("method '{}' is already registered by {}".format(method_name, OP_REGISTRY[method_name].__name__))
+        op_class.method_name = method_name
+        OP_REGISTRY[method_name] = op_class
+        return op_class
+    return decorator
+
+
+def image_rng(seed, source_id, config_key, epoch=0):
+    """
+        Random generator of one (input image, config entry sample) pair, seeded from the global seed,
+        the source id of the image (its file name) and the config key, so that the random methods get
+        the same values no matter which worker handles the image or in which order the images are
+        processed. Later epochs of a stream mix in the epoch number and draw new values
+    """
+    digest = hashlib.sha256('{}\0{}'.format(source_id, config_key).encode('utf8')).digest()
+    # epoch 0 keeps the entropy of the runs written to disk, which have no epochs
+    return np.random.default_rng([seed, int.from_bytes(digest[:16], 'little')] + ([epoch] if epoch else []))
+
+
+class AugmentationOp:
+    """
+        Base class of the ops of a plan. Subclasses are frozen dataclasses whose fields are the
+        parsed parameters of the method, so ops are immutable, hashable and cheap to send to
+        worker processes
+    """
+    method_name = None # set by register_op
+    # ops without a fusion kind are always applied on their own
+    fusion_kind = None
+    # random ops draw from the generator of their entry, their results can't be shared between entries
+    is_random = False
+    # number of config methods the op applies
+    op_count = 1
+    # parameter a RandAugmentPolicy can draw from a range of magnitudes, None when it can't
+    magnitude_param = None
+    # ops whose apply takes an out buffer of the shape and dtype of the input image (see BufferPool)
+    writes_out = False
+    img_augmentator = ImageAugmentation()
+    params_extract = ParamsExtractUtils()
+
+    @property
+    def name(self):
+        # name of the op in timings and logs
+        return self.method_name
+
+    @classmethod
+    def from_config(cls, method_params_dict):
+        """
+            Build the op from the parameters of the method in the config file, raising ConfigError
+            when they are not valid
+        """
+        raise NotImplementedError
+
+    def apply(self, image, rng=None):
+        """
+            Apply the op to the given image, in OpenCV's BGR channel order (as decoded by cv2.imread).
+            rng is the np.random.Generator of the (image, config entry) pair, random ops draw their
+            values from it. Ops with writes_out also take an out keyword: a buffer, never the input
+            image, the result is written into
+        """
+        raise NotImplementedError
+
+
+@register_op('rotation')
+@dataclass(frozen=True)
+class RotationOp(AugmentationOp):
+    angle: float
+    fusion_kind = 'geometric'
+    magnitude_param = 'angle'
+    writes_out = True
+
+    @classmethod
+    def from_config(cls, method_params_dict):
+        return cls(cls.params_extract.extract_rotation_params(method_params_dict))
+
+    def matrix(self, image_shape):
+        # same center as ImageAugmentation.rotate_image
+        height, width = image_shape[:2]
+        matrix = np.eye(3)
+        matrix[:2] = cv2.getRotationMatrix2D((width / 2, height / 2), self.angle, 1.0)
+        return matrix
+
+    def apply(self, image, rng=None, out=None):
+        return self.img_augmentator.rotate_image(image, angle=self.angle, out=out)
+
+
+@register_op('flip')
+@dataclass(frozen=True)
+class FlipOp(AugmentationOp):
+    flip_code: int
+    fusion_kind = 'geometric'
+    writes_out = True
+
+    @classmethod
+    def from_config(cls, method_params_dict):
+        return cls(cls.params_extract.extract_flip_params(method_params_dict))
+
+    def matrix(self, image_shape):
+        height, width = image_shape[:2]
+        matrix = np.eye(3)
+        if self.flip_code <= 0: # flip around the x-axis
+            matrix[1, 1], matrix[1, 2] = -1, height - 1
+        if self.flip_code != 0: # flip around the y-axis
+            matrix[0, 0], matrix[0, 2] = -1, width - 1
+        return matrix
+
+    def apply(self, image, rng=None, out=None):
+        return self.img_augmentator.flip_image(image, flip_code=self.flip_code, out=out)
+
+
+@register_op('shift')
+@dataclass(frozen=True)
+class ShiftOp(AugmentationOp):
+    axis: tuple
+    shift_range: tuple
+    fill_mode: str = 'constant'
+    magnitude_param = 'shift_range'
+    writes_out = True
+
+    @classmethod
+    def from_config(cls, method_params_dict):
+        return cls(*cls.params_extract.extract_shift_params(method_params_dict))
+
+    @property
+    def fusion_kind(self):
+        # only a blank (constant) border can be carried through a fused chain
+        return 'geometric' if self.fill_mode == 'constant' else None
+
+    def matrix(self, image_shape):
+        matrix = np.eye(3)
+        for axis, shift_range in zip(self.axis, self.shift_range):
+            # axis 0 moves the rows (y translation), axis 1 moves the columns (x translation)
+            matrix[1 - axis, 2] = -ImageAugmentation.shift_in_pixels(image_shape[axis], shift_range)
+        return matrix
+
+    def apply(self, image, rng=None, out=None):
+        return self.img_augmentator.shift_image(image, axis=self.axis, shift_range=self.shift_range, fill_mode=self.fill_mode, out=out)
+
+
+@register_op('shear')
+@dataclass(frozen=True)
+class ShearOp(AugmentationOp):
+    shear_angle: float
+    fill_mode: str = 'constant'
+    magnitude_param = 'shear_angle'
+    writes_out = True
+
+    @classmethod
+    def from_config(cls, method_params_dict):
+        return cls(*cls.params_extract.extract_shear_params(method_params_dict))
+
+    @property
+    def fusion_kind(self):
+        return 'geometric' if self.fill_mode == 'constant' else None
+
+    def matrix(self, image_shape):
+        # ImageAugmentation.shear_image uses this matrix as the destination -> source map
+        matrix = np.eye(3)
+        matrix[:2] = ImageAugmentation.shear_matrix(self.shear_angle)
+        return np.linalg.inv(matrix)
+
+    def apply(self, image, rng=None, out=None):
+        return self.img_augmentator.shear_image(image, shear_angle=self.shear_angle, fill_mode=self.fill_mode, out=out)
+
+
+@register_op('zoom')
+@dataclass(frozen=True)
+class ZoomOp(AugmentationOp):
+    zoom_factor: float
+    fusion_kind = 'geometric'
+    magnitude_param = 'zoom_factor'
+    writes_out = True
+
+    @classmethod
+    def from_config(cls, method_params_dict):
+        return cls(cls.params_extract.extract_zoom_params(method_params_dict))
+
+    def matrix(self, image_shape):
+        height, width = image_shape[:2]
+        matrix = np.eye(3)
+        matrix[0, 0], matrix[0, 2] = GeometricChainCompiler.zoom_axis_mapping(width, self.zoom_factor)
+        matrix[1, 1], matrix[1, 2] = GeometricChainCompiler.zoom_axis_mapping(height, self.zoom_factor)
+        return matrix
+
+    def apply(self, image, rng=None, out=None):
+        return self.img_augmentator.clipped_zoom_image(image, zoom_factor=self.zoom_factor, out=out)
+
+
+@register_op('random_crop')
+@dataclass(frozen=True)
+class RandomCropOp(AugmentationOp):
+    height_range: float
+    width_range: float
+    is_random = True
+
+    @classmethod
+    def from_config(cls, method_params_dict):
+        return cls(*cls.params_extract.extract_random_crop_params(method_params_dict))
+
+    def apply(self, image, rng=None):
+        return self.img_augmentator.random_crop_image(image, height_range=self.height_range, width_range=self.width_range, rng=rng)
+
+
+@register_op('random_brightness')
+@dataclass(frozen=True)
+class RandomBrightnessOp(AugmentationOp):
+    brightness_range: tuple
+    is_random = True
+    fusion_kind = 'photometric'
+    writes_out = True
+
+    @classmethod
+    def from_config(cls, method_params_dict):
+        return cls(cls.params_extract.extract_random_brightness_params(random_bright_dict=method_params_dict))
+
+    def table(self):
+        # depends on the max channel of each pixel, not a per value table
+        return None
+
+    def apply(self, image, rng=None, out=None):
+        return self.img_augmentator.random_bright_image(image, brightness_range=self.brightness_range, rng=rng, channel_order='BGR', out=out)
+
+
+@register_op('adjust_gamma')
+@dataclass(frozen=True)
+class GammaOp(AugmentationOp):
+    gamma: float
+    fusion_kind = 'photometric'
+    magnitude_param = 'gamma'
+    writes_out = True
+
+    @classmethod
+    def from_config(cls, method_params_dict):
+        return cls(cls.params_extract.extract_gamma_correction_params(gamma_dict=method_params_dict))
+
+    def table(self):
+        return ImageAugmentation.gamma_table(self.gamma)
+
+    def apply(self, image, rng=None, out=None):
+        return self.img_augmentator.adjust_gamma(image, gamma=self.gamma, out=out)
+
+
+@register_op('gaussian_blur')
+@dataclass(frozen=True)
+class GaussianBlurOp(AugmentationOp):
+    kernel: tuple
+    writes_out = True
+
+    @classmethod
+    def from_config(cls, method_params_dict):
+        return cls(cls.params_extract.extract_gaussian_blur_params(blur_dict=method_params_dict))
+
+    def apply(self, image, rng=None, out=None):
+        return self.img_augmentator.gaussian_blur(image, kernel=self.kernel, out=out)
+
+
+@register_op('contrast')
+@dataclass(frozen=True)
+class ContrastOp(AugmentationOp):
+    contrast_factor: float
+    fusion_kind = 'photometric'
+    magnitude_param = 'contrast_factor'
+    writes_out = True
+
+    @classmethod
+    def from_config(cls, method_params_dict):
+        return cls(cls.params_extract.extract_contrast_params(contrast_dict=method_params_dict))
+
+    def table(self):
+        return ImageAugmentation.contrast_table(self.contrast_factor)
+
+    def apply(self, image, rng=None, out=None):
+        return self.img_augmentator.contrast_image(image, contrast_factor=self.contrast_factor, out=out)
+
+
+@dataclass(frozen=True)
+class GeometricChainOp(AugmentationOp):
+    """
+        Consecutive geometric ops of an entry applied with a single warpAffine resample
+    """
+    ops: tuple
+    compiler = GeometricChainCompiler() # per process cache of the compiled matrices
+    writes_out = True
+
+    @property
+    def op_count(self):
+        return len(self.ops)
+
+    @property
+    def name(self):
+        return '+'.join(op.method_name for op in self.ops)
+
+    def apply(self, image, rng=None, out=None):
+        return self.compiler.apply_chain(image, self.ops, out=out)
+
+
+@dataclass(frozen=True)
+class PhotometricChainOp(AugmentationOp):
+    """
+        Consecutive photometric ops of an entry collapsed into as few lookup table passes as possible
+    """
+    ops: tuple
+    compiler = PhotometricLutCompiler()
+    writes_out = True
+
+    @property
+    def is_random(self):
+        return any(op.is_random for op in self.ops)
+
+    @property
+    def op_count(self):
+        return len(self.ops)
+
+    @property
+    def name(self):
+        return '+'.join(op.method_name for op in self.ops)
+
+    def apply(self, image, rng=None, out=None):
+        return self.compiler.apply_chain(image, self.ops, rng=rng, out=out)
+
+
+# op applying a whole run of consecutive ops of the same fusion kind
+CHAIN_OPS = {'geometric': GeometricChainOp, 'photometric': PhotometricChainOp}
+
+
+@dataclass(frozen=True)
+class PolicyOp:
+    """
+        One op of a RandAugmentPolicy: a fixed op, or an op whose magnitude parameter is drawn from a range
+    """
+    method_name: str
+    params: tuple # (name, value) pairs of the other parameters
+    op: AugmentationOp = None # the op itself when it has no magnitude range
+    magnitude_range: tuple = None # (low, high) of the magnitude parameter
+
+    @classmethod
+    def from_config(cls, method_name, method_params_dict):
+        """
+            A parameter given as [low, high] is a magnitude range when the op has a magnitude
+            parameter and accepts both bounds as values; both bounds are validated like fixed values
+        """
+        if method_name not in OP_REGISTRY:
+            raise ConfigError("unknown method '{}' in '{}', expected one of {}".format(method_name, POLICY_KEY, ', '.join(OP_REGISTRY)))
+        op_class = OP_REGISTRY[method_name]
+        magnitude = method_params_dict.get(op_class.magnitude_param) if type(method_params_dict) is dict else None
+        if(type(magnitude) is list and len(magnitude) == 2 and all(type(value) in (int, float) for value in magnitude)):
+            try:
+                for value in magnitude:
+                    op_class.from_config(dict(method_params_dict, **{op_class.magnitude_param: value}))
+            except ConfigError:
+                pass # a list valued parameter (for example one shift range per axis), not a range
+            else:
+                if magnitude[0] > magnitude[1]:
+                    raise ConfigError("range of '{}' of '{}' must be [low, high] with low <= high, got {!r}".format(
+                        op_class.magnitude_param, method_name, magnitude))
+                params = tuple((name, value) for name, value in method_params_dict.items() if name != op_class.magnitude_param)
+                return cls(method_name, params, magnitude_range=(float(magnitude[0]), float(magnitude[1])))
+        return cls(method_name, (), op=op_class.from_config(method_params_dict))
+
+    def make(self, magnitude):
+        if self.magnitude_range is None:
+            return self.op
+        op_class = OP_REGISTRY[self.method_name]
+        return op_class.from_config(dict(self.params, **{op_class.magnitude_param: float(magnitude)}))
+
+
+@dataclass(frozen=True)
+class RandAugmentPolicy:
+    """
+        RandAugment style policy of an entry: every sample applies num_ops distinct ops picked at
+        random among ops, in a random order, each with a magnitude drawn uniformly from its range:
+
+            "p1": {"samples": 20,
+                   "rand_augment": {"num_ops": 2,
+                                    "ops": {"rotation": {"angle": [-30, 30]},
+                                            "adjust_gamma": {"gamma": [0.5, 1.5]},
+                                            "flip": {"flip_code": 1}}}}
+    """
+    num_ops: int
+    ops: tuple # PolicyOp
+
+    @classmethod
+    def from_config(cls, policy_dict):
+        if(type(policy_dict) is not dict or set(policy_dict) != {'num_ops', 'ops'}):
+            raise ConfigError("'{}' must be an object with 'num_ops' and 'ops', got {!r}".format(POLICY_KEY, policy_dict))
+        ops_dict = policy_dict['ops']
+        if(type(ops_dict) is not dict or not ops_dict):
+            raise ConfigError("'ops' of '{}' must be a non empty object of methods, got {!r}".format(POLICY_KEY, ops_dict))
+        ops = tuple(PolicyOp.from_config(method_name, method_params_dict) for method_name, method_params_dict in ops_dict.items())
+        num_ops = policy_dict['num_ops']
+        if(type(num_ops) is not int or not 1 <= num_ops <= len(ops)):
+            raise ConfigError("'num_ops' of '{}' must be an integer in [1,{}], got {!r}".format(POLICY_KEY, len(ops), num_ops))
+        return cls(num_ops, ops)
+
+    def draw(self, rng, sample_count):
+        """
+            Draw the ops of every sample at once
+            Parameters
+            ----------
+                rng : np.random.Generator
+                    generator of the (image, config entry) pair
+                sample_count : int
+                    number of samples to draw
+            Returns
+            -------
+                list of tuples of AugmentationOp, one per sample
+        """
+        # num_ops distinct ops per sample in a random order: the first columns of a random permutation
+        picked = rng.random((sample_count, len(self.ops))).argsort(axis=1)[:, :self.num_ops]
+        low = np.array([op.magnitude_range[0] if op.magnitude_range else 0.0 for op in self.ops])
+        high = np.array([op.magnitude_range[1] if op.magnitude_range else 0.0 for op in self.ops])
+        magnitudes = low + (high - low) * rng.random((sample_count, len(self.ops)))
+        return [tuple(self.ops[op_index].make(magnitudes[sample, op_index]) for op_index in picked[sample])
+                for sample in range(sample_count)]
+
+
+@dataclass(frozen=True)
+class AugmentationEntry:
+    """
+        One entry of the config file: its key, the ops in their order of appearance and the
+        steps actually executed, where runs of consecutive ops of the same fusion kind are
+        compiled into a single chain op.
+
+        Entries with samples or a policy are expanded into one concrete entry per sample for every
+        image by sample_entries; the ops drawn by the policy are inserted at policy_index
+    """
+    key: str
+    ops: tuple
+    steps: tuple
+    samples: int = 1
+    policy: RandAugmentPolicy = None
+    policy_index: int = 0
+    sample: int = None # index of the sample of a concrete entry, None when the entry has a single sample
+
+    @property
+    def method_names(self):
+        return [op.method_name for op in self.ops]
+
+    @property
+    def is_random(self):
+        return self.policy is not None or any(op.is_random for op in self.ops)
+
+    @property
+    def sample_key(self):
+        """
+            Key of a concrete sample, unique within the expanded entries of an image and used to seed its random ops
+        """
+        return self.key if self.sample is None else '{}#{}'.format(self.key, self.sample)
+
+    def sample_entries(self, rng_factory=None):
+        """
+            Concrete entries of the samples of this entry. The ops of a policy are drawn for all the samples
+            at once; plain samples keep the ops of the entry and draw their random values one sample at a
+            time, from the generator of their sample_key, while they are applied
+            Parameters
+            ----------
+                rng_factory : callable
+                    key -> np.random.Generator of the image, needed for the entries with a policy
+            Returns
+            -------
+                tuple of AugmentationEntry without samples nor policy
+        """
+        sample_numbers = range(self.samples) if self.samples > 1 else [None]
+        if self.policy is None:
+            return tuple(replace(self, sample=sample) for sample in sample_numbers) if self.samples > 1 else (self,)
+        drawn_ops = self.policy.draw(rng_factory('{}#{}'.format(self.key, POLICY_KEY)), self.samples)
+        entries = []
+        for sample, sample_ops in zip(sample_numbers, drawn_ops):
+            ops = self.ops[:self.policy_index] + sample_ops + self.ops[self.policy_index:]
+            entries.append(AugmentationEntry(self.key, ops, self.compile_steps(ops), self.samples, sample=sample))
+        return tuple(entries)
+
+    @staticmethod
+    def compile_steps(ops):
+        runs = []
+        for op in ops:
+            if op.fusion_kind is not None and runs and runs[-1][0] == op.fusion_kind:
+                runs[-1][1].append(op)
+            else:
+                runs.append((op.fusion_kind, [op]))
+        return tuple(CHAIN_OPS[kind](tuple(run_ops)) if len(run_ops) > 1 else run_ops[0]
+                     for kind, run_ops in runs)
+
+    def apply(self, image, rng=None):
+        for step in self.steps:
+            image = step.apply(image, rng=rng)
+        return image
+
+
+@dataclass(frozen=True)
+class AugmentationPlan:
+    entries: tuple
+
+    def select(self, entry_keys):
+        """
+            Plan made of the entries with the given keys only, in their order in this plan
+        """
+        return AugmentationPlan(tuple(entry for entry in self.entries if entry.key in entry_keys))
+
+    @property
+    def has_policies(self):
+        return any(entry.policy is not None for entry in self.entries)
+
+    def sample_entries(self, rng_factory=None):
+        """
+            Concrete entries applied to one image: one per sample of every entry, with the ops of the
+            policies drawn from rng_factory. Plans without policies expand the same way for every image
+        """
+        return tuple(sample_entry for entry in self.entries for sample_entry in entry.sample_entries(rng_factory))
+
+    @classmethod
+    def from_config(cls, aug_config_dict):
+        """
+            Parse and validate a config file (as loaded by json) into a plan
+            Raises
+            ------
+                ConfigError with the entry and method at fault when the config is not valid
+        """
+        if(type(aug_config_dict) is not dict):
+            raise ConfigError('config must be an object of entries, got {!r}'.format(aug_config_dict))
+        entries = []
+        for config_key, aug_method_dict in aug_config_dict.items():
+            if(type(aug_method_dict) is not dict or not aug_method_dict):
+                raise ConfigError("entry '{}': must be a non empty object of methods, got {!r}".format(config_key, aug_method_dict))
+            ops = []
+            samples, policy, policy_index = 1, None, 0
+            for method_name, method_params_dict in aug_method_dict.items():
+                if method_name not in OP_REGISTRY and method_name not in (SAMPLES_KEY, POLICY_KEY):
+                    raise ConfigError("entry '{}': unknown method '{}', expected one of {}".format(
+                        config_key, method_name, ', '.join(tuple(OP_REGISTRY) + (SAMPLES_KEY, POLICY_KEY))))
+                try:
+                    if method_name == SAMPLES_KEY:
+                        samples = method_params_dict
+                        if(type(samples) is not int or samples < 1):
+                            raise ConfigError("'{}' must be a positive integer, got {!r}".format(SAMPLES_KEY, samples))
+                    elif method_name == POLICY_KEY:
+                        policy, policy_index = RandAugmentPolicy.from_config(method_params_dict), len(ops)
+                    else:
+                        ops.append(OP_REGISTRY[method_name].from_config(method_params_dict))
+                except ConfigError as error:
+                    raise ConfigError("entry '{}': {}".format(config_key, error)) from None
+            if not ops and policy is None:
+                raise ConfigError("entry '{}': needs at least one method or a '{}' policy".format(config_key, POLICY_KEY))
+            entries.append(AugmentationEntry(config_key, tuple(ops), AugmentationEntry.compile_steps(ops), samples, policy, policy_index))
+        return cls(tuple(entries))
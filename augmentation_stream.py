@@ -0,0 +1,176 @@
+"""
+    Streaming, in-memory augmentation: the augmented images of a config are yielded to the caller
+    (for example a training loop) instead of being encoded and written to disk.
+
+        stream = AugmentationStream('input_config_1.json', glob.glob('images/*.jpg'), seed=0,
+                                    epochs=None, shuffle=True)
+        for source_id, config_key, image in stream:
+            ...
+
+    Sources are image file paths, decoded arrays (BGR or grayscale uint8) or (source id, path or
+    array) pairs. The source id of a path is its file name, as in the runs written to disk, and
+    the one of an array is its position in the sources. Inputs are decoded ahead of the consumer
+    on prefetch threads, with at most queue_size decoded images waiting, and the augmented images
+    of one input are yielded before the next input is transformed, so memory stays bounded
+    whatever the number of sources or epochs. Nothing imports tkinter.
+
+    With the same seed, the first epoch yields the same images as DataAugmentation writes for the
+    same file names. Every later epoch draws new random values, and with shuffle the sources are
+    visited in a new order every epoch
+"""
+import json
+import os
+import sys
+import numpy as np
+from augmentation_plan import AugmentationPlan, image_rng
+from transform_dag import TransformDag
+from image_io import ImagePipeline, ImageDecoder
+from run_stats import DISABLED_STATS
+from buffer_pool import BufferPool
+
+
+class AugmentationStream:
+
+    def __init__(self, config, sources, seed=None, epochs=1, shuffle=False, prefetch=2, queue_size=8,
+                 target_size=None, intermediate_memory_limit=512 * 1024 * 1024, stats=DISABLED_STATS,
+                 buffer_pool_limit=256 * 1024 * 1024):
+        """
+            Parameters
+            ----------
+                config : str, dict or AugmentationPlan
+                    path of the JSON configuration file, the loaded config or its compiled plan
+                sources : iterable
+                    image file paths, uint8 np.arrays or (source id, path or array) pairs. Iterated
+                    lazily for a single epoch without shuffle, kept as a list otherwise
+                seed : int
+                    global seed of the random methods, a random one is drawn when not given
+                epochs : int
+                    number of passes over the sources (at least 1), None for an endless stream. The
+                    stream stops after an epoch where no source could be decoded
+                shuffle : bool
+                    visit the sources in a new random order (drawn from the seed) every epoch
+                prefetch : int
+                    threads decoding the next inputs while the current one is transformed, 0 decodes
+                    in the consuming thread
+                queue_size : int
+                    maximum number of decoded inputs waiting to be transformed
+                target_size : int
+                    when given, inputs are downscaled right after decoding so that their shorter side
+                    is target_size pixels (see ImageDecoder)
+                intermediate_memory_limit : int
+                    bytes of intermediate results shared between entries kept per input
+                stats : RunStats
+                    records the 'read' and 'image' stages and the ops of the stream
+                buffer_pool_limit : int
+                    bytes of image buffers the transforms write into (see BufferPool), 0 or None allocates
+                    a new array for every step. A yielded image is never overwritten while the consumer
+                    keeps a reference to it
+        """
+        if isinstance(config, AugmentationPlan):
+            self.plan = config
+        else:
+            if not isinstance(config, dict):
+                with open(config, 'r', encoding='utf8') as json_file:
+                    config = json.load(json_file)
+            self.plan = AugmentationPlan.from_config(config)
+        if epochs is not None and epochs < 1:
+            raise ValueError('epochs must be a positive number or None for an endless stream, got {}'.format(epochs))
+        self.seed = seed if seed is not None else np.random.SeedSequence().entropy
+        self.epochs = epochs
+        self.shuffle = shuffle
+        # a single lazy pass needs no list, every other mode iterates the sources again
+        self.sources = sources if epochs == 1 and not shuffle else list(sources)
+        self.prefetch = prefetch
+        self.queue_size = queue_size
+        self.decoder = ImageDecoder(target_size)
+        self.intermediate_memory_limit = intermediate_memory_limit
+        self.stats = stats
+        self.buffers = BufferPool(buffer_pool_limit) if buffer_pool_limit else None
+        # prefix tree of the plan, shares the common steps of the entries (None when ops are drawn per image)
+        self.dag = None if self.plan.has_policies else TransformDag(AugmentationPlan(self.plan.sample_entries()),
+                                                                    memory_limit=intermediate_memory_limit)
+
+    @staticmethod
+    def source_item(position, source):
+        """
+            (source id, path or array) of a source
+        """
+        if isinstance(source, tuple):
+            return source
+        if isinstance(source, np.ndarray):
+            return (position, source)
+        return (os.path.basename(source), source)
+
+    def epoch_items(self):
+        """
+            (epoch, source id, path or array) of every source of every epoch, lazily
+        """
+        epoch = 0
+        while self.epochs is None or epoch < self.epochs:
+            if self.shuffle:
+                order = np.random.default_rng([self.seed, epoch]).permutation(len(self.sources))
+                sources = ((position, self.sources[position]) for position in order)
+            else:
+                sources = enumerate(self.sources)
+            source_count = 0
+            for position, source in sources:
+                source_count += 1
+                yield (epoch,) + self.source_item(position, source)
+            if source_count == 0: # an endless stream of nothing would never yield
+                return
+            epoch += 1
+
+    def decode(self, item):
+        """
+            Decoded image of an item of epoch_items, None when it can't be read as an image
+        """
+        start = self.stats.start()
+        source = item[2]
+        if isinstance(source, np.ndarray):
+            if source.dtype != np.uint8 or source.ndim not in (2, 3):
+                raise ValueError('source {!r}: arrays must be 2 or 3 dimensional uint8 images, got {} {}'.format(
+                    item[1], source.dtype, source.shape))
+            image = source if self.decoder.target_size is None else self.decoder.resize(source)
+        else:
+            image = self.decoder.read(os.fspath(source))
+        self.stats.stop('read', start)
+        return image
+
+    def augment(self, image, source_id, epoch=0):
+        """
+            Augmented images of one decoded image
+            Returns
+            -------
+                list of (config key, image) tuples, the config keys of entries with several samples
+                end with '#<sample>'
+        """
+        rng_factory = lambda sample_key: image_rng(self.seed, source_id, sample_key, epoch)
+        if self.dag is not None:
+            dag = self.dag
+        else: # policies draw the ops of the samples of every image
+            dag = TransformDag(AugmentationPlan(self.plan.sample_entries(rng_factory)), memory_limit=self.intermediate_memory_limit)
+        results = []
+        start = self.stats.start()
+        dag.run(image, rng_factory, lambda entry, transformed_image: results.append((entry.sample_key, transformed_image)),
+                self.stats, self.buffers)
+        self.stats.stop('image', start)
+        return results
+
+    def __iter__(self):
+        """
+            Lazily yields (source id, config key, augmented image) tuples, input by input
+        """
+        current_epoch, decoded_count = 0, 0 # images decoded in the current epoch
+        with ImagePipeline(self.prefetch, 0, self.queue_size) as pipeline:
+            for (epoch, source_id, _), image in pipeline.decoded(self.epoch_items(), self.decode):
+                if epoch != current_epoch:
+                    if decoded_count == 0: # the next epochs would skip the same sources, endlessly with epochs=None
+                        print('no source of epoch {} can be read as an image, stream stopped'.format(current_epoch), file=sys.stderr)
+                        return
+                    current_epoch, decoded_count = epoch, 0
+                if image is None:
+                    print(source_id, '--- skipped, can not be read as an image', file=sys.stderr)
+                    continue
+                decoded_count += 1
+                for config_key, augmented_image in self.augment(image, source_id, epoch):
+                    yield (source_id, config_key, augmented_image)
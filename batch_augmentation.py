@@ -0,0 +1,356 @@
+"""
+    Batch versions of the ImageAugmentation methods, for in-memory training loops working on
+    uint8 batches of shape (N, H, W, C) (C = 1 for grayscale, 3 for BGR). Every method takes its
+    parameters per sample, as an array of N values (a single value is used for the whole batch),
+    and returns a new batch; the random methods draw the values of all the samples at once.
+
+    Per sample values (tables, shifts, matrices) are computed for the whole batch with NumPy and
+    every op writes straight into one preallocated result batch. The pixels are moved by whatever
+    is fastest for a whole batch, as measured by benchmark.py --batch-size:
+
+        crop                    one gather from a strided NumPy view of the batch
+        brightness              one HSV conversion of the batch seen as a single tall image each way
+        flip, shift, gamma,     one OpenCV call per sample, writing into its slice of the result.
+        contrast, rotation,     NumPy gathers over the whole batch (reversed strides, fancy indexing
+        shear, zoom             of per sample gamma tables) measured 2 to 10 times slower than these
+                                calls, whose Python overhead is a few microseconds per sample
+
+    Rotation, shear and zoom also have per sample 3x3 matrices that compose() chains, so that
+    warp_batch applies a whole chain of geometric ops with a single resample per sample.
+
+    Results are the same as the ImageAugmentation method applied to every sample
+"""
+import numpy as np
+from cv2 import cv2
+from numpy.lib.stride_tricks import sliding_window_view
+from image_augmentation import ImageAugmentation
+
+
+class BatchAugmentation:
+    img_augmentator = ImageAugmentation()
+
+    @staticmethod
+    def check_batch(batch):
+        if not isinstance(batch, np.ndarray) or batch.ndim != 4 or batch.dtype != np.uint8:
+            raise ValueError('batch must be a uint8 np.array of shape (N, H, W, C), got {}'.format(
+                '{} {}'.format(batch.dtype, batch.shape) if isinstance(batch, np.ndarray) else type(batch).__name__))
+        return batch
+
+    @staticmethod
+    def sample_values(values, batch_size, dtype=np.float64):
+        """
+            Parameters of every sample: values given per sample, or a single value for the whole batch
+            Returns
+            -------
+                np.array of shape (batch_size,) + shape of one value
+        """
+        values = np.asarray(values, dtype=dtype)
+        if values.ndim == 0 or (values.ndim >= 1 and values.shape[0] != batch_size):
+            values = np.broadcast_to(values, (batch_size,) + values.shape)
+        return values
+
+    @staticmethod
+    def compose(*matrices):
+        """
+            Forward matrices of applying the given per sample forward matrices one after the other
+            Parameters
+            ----------
+                matrices : (N, 3, 3) np.arrays
+                    as returned by rotation_matrices, shear_matrices, zoom_matrices, in the order they have to be applied
+            Returns
+            -------
+                (N, 3, 3) np.array, to be applied by warp_batch with a single resample per sample
+        """
+        result = matrices[0]
+        for matrix in matrices[1:]:
+            # applying A then B to an image means the matrix B @ A
+            result = matrix @ result
+        return result
+
+    def rotation_matrices(self, batch_shape, angles):
+        """
+            Forward matrices of ImageAugmentation.rotate_image for every sample
+            Parameters
+            ----------
+                batch_shape : tuple
+                    shape of the batch
+                angles : float or array of floats
+                    counter-clockwise angles of rotation as degrees
+        """
+        batch_size, height, width = batch_shape[:3]
+        radians = np.deg2rad(self.sample_values(angles, batch_size))
+        alpha, beta = np.cos(radians), np.sin(radians)
+        center_x, center_y = width / 2, height / 2 # same center and formula as cv2.getRotationMatrix2D
+        matrices = np.zeros((batch_size, 3, 3))
+        matrices[:, 0, 0], matrices[:, 0, 1] = alpha, beta
+        matrices[:, 0, 2] = (1 - alpha) * center_x - beta * center_y
+        matrices[:, 1, 0], matrices[:, 1, 1] = -beta, alpha
+        matrices[:, 1, 2] = beta * center_x + (1 - alpha) * center_y
+        matrices[:, 2, 2] = 1
+        return matrices
+
+    def shear_matrices(self, batch_shape, shear_angles):
+        """
+            Forward matrices of ImageAugmentation.shear_image for every sample
+            Parameters
+            ----------
+                shear_angles : float or array of floats
+                    shear angles in counter-clockwise direction as radians
+        """
+        shear_angles = self.sample_values(shear_angles, batch_shape[0])
+        # inverse of ImageAugmentation.shear_matrix, which maps the destination pixels to their source
+        matrices = np.zeros((batch_shape[0], 3, 3))
+        matrices[:, 0, 0] = 1
+        matrices[:, 0, 1] = np.tan(shear_angles)
+        matrices[:, 1, 1] = 1 / np.cos(shear_angles)
+        matrices[:, 2, 2] = 1
+        return matrices
+
+    def zoom_matrices(self, batch_shape, zoom_factors):
+        """
+            Forward matrices of ImageAugmentation.clipped_zoom_image for every sample, with the
+            crop/resize/pad arithmetic of GeometricChainCompiler.zoom_axis_mapping
+            Parameters
+            ----------
+                zoom_factors : float or array of floats
+                    amounts of zoom as ratios (0 to Inf)
+        """
+        zoom_factors = self.sample_values(zoom_factors, batch_shape[0])
+        matrices = np.zeros((batch_shape[0], 3, 3))
+        for row, size in ((0, batch_shape[2]), (1, batch_shape[1])):
+            new_sizes = np.maximum(np.floor(size * zoom_factors), 1)
+            starts = np.maximum(new_sizes - size, 0) // 2
+            crop_starts = np.floor(starts / zoom_factors)
+            crop_ends = np.maximum(np.minimum(np.floor((starts + size) / zoom_factors), size), crop_starts + 1)
+            resizes = np.minimum(new_sizes, size)
+            scales = resizes / (crop_ends - crop_starts)
+            matrices[:, row, row] = scales
+            matrices[:, row, 2] = (size - resizes) // 2 + (0.5 - crop_starts) * scales - 0.5
+        matrices[:, 2, 2] = 1
+        return matrices
+
+    def warp_batch(self, batch, matrices, fill_mode='constant', fill_value=0, inverse=False):
+        """
+            Resample every sample with its own affine matrix
+            Parameters
+            ----------
+                batch : (N, H, W, C) np.array
+                    batch to be transformed
+                matrices : (N, 3, 3) or (N, 2, 3) np.array
+                    forward (source -> destination) matrices, destination -> source ones when inverse is set
+                fill_mode : str
+                    how the pixels outside of the samples are filled, one of ImageAugmentation.FILL_MODES
+                fill_value : int
+                    value of the outside pixels for the 'constant' fill mode
+            Returns
+            -------
+                transformed batch as np.array
+        """
+        batch = self.check_batch(batch)
+        flags = cv2.INTER_LINEAR | (cv2.WARP_INVERSE_MAP if inverse else 0)
+        border_mode = ImageAugmentation.FILL_MODES[fill_mode]
+        fill_values = (fill_value,) * 4
+        # a single 2x3 float64 array of all the samples, sliced without any copy in the loop
+        matrices = np.ascontiguousarray(np.asarray(matrices, dtype=np.float64)[:, :2])
+        result = np.empty_like(batch)
+        size = batch.shape[2:0:-1]
+        for sample, (image, matrix) in enumerate(zip(batch, matrices)):
+            cv2.warpAffine(image, matrix, size, dst=result[sample], flags=flags, borderMode=border_mode, borderValue=fill_values)
+        return result
+
+    def rotate_batch(self, batch, angles):
+        """
+            Rotates every sample by its angle (degrees) in the counter-clockwise direction
+        """
+        return self.warp_batch(batch, self.rotation_matrices(batch.shape, angles))
+
+    def shear_batch(self, batch, shear_angles, fill_mode='constant', fill_value=0):
+        """
+            Shears every sample by its angle (radians) in the counter-clockwise direction
+        """
+        shear_angles = self.sample_values(shear_angles, batch.shape[0])
+        # the same destination -> source matrices as ImageAugmentation.shear_image
+        matrices = np.zeros((batch.shape[0], 2, 3))
+        matrices[:, 0, 0] = 1
+        matrices[:, 0, 1] = -np.sin(shear_angles)
+        matrices[:, 1, 1] = np.cos(shear_angles)
+        return self.warp_batch(batch, matrices, fill_mode, fill_value, inverse=True)
+
+    def zoom_batch(self, batch, zoom_factors):
+        """
+            Center zooms every sample in/out by its zoom factor without changing its dimensions.
+            Samples are resized like ImageAugmentation.clipped_zoom_image, which is faster than a warp
+        """
+        batch = self.check_batch(batch)
+        zoom_factors = self.sample_values(zoom_factors, batch.shape[0])
+        result = np.empty_like(batch)
+        for sample, zoom_factor in enumerate(zoom_factors):
+            image = batch[sample] if batch.shape[3] > 1 else batch[sample, ..., 0] # cv2.resize drops single channels
+            result[sample] = self.img_augmentator.clipped_zoom_image(image, zoom_factor).reshape(batch.shape[1:])
+        return result
+
+    def flip_batch(self, batch, flip_codes):
+        """
+            Flips every sample by its flip code: 0 around the x-axis, positive around the y-axis,
+            negative around both axes
+        """
+        batch = self.check_batch(batch)
+        flip_codes = self.sample_values(flip_codes, batch.shape[0], np.int64)
+        result = np.empty_like(batch)
+        for sample, flip_code in enumerate(flip_codes):
+            cv2.flip(batch[sample], int(flip_code), dst=result[sample])
+        return result
+
+    def window_batch(self, batch, ys, xs, height, width):
+        """
+            Windows of height x width pixels of every sample, at its own (y, x) top left corner,
+            copied with a single gather from a strided view of the batch
+        """
+        windows = sliding_window_view(batch, (height, width), axis=(1, 2)) # (N, H-h+1, W-w+1, C, h, w) view
+        return np.ascontiguousarray(np.moveaxis(windows[np.arange(batch.shape[0]), ys, xs], 1, -1))
+
+    def shift_batch(self, batch, axis, shift_ranges, fill_mode='constant', fill_value=0):
+        """
+            Shifts every sample by its shift range, like ImageAugmentation.shift_image
+            Parameters
+            ----------
+                batch : (N, H, W, C) np.array
+                    batch to be shifted.
+                axis : int or tuple of ints
+                    Axis (0 or 1) of the samples along which their pixels are shifted
+                shift_ranges : float or tuple of floats, (N,) or (N, len(axis)) array
+                    shift range in [-1,1] (one per axis) of the whole batch or of every sample
+                fill_mode : str
+                    how the vacated pixels are filled, one of ImageAugmentation.FILL_MODES
+                fill_value : int
+                    value of the vacated pixels for the 'constant' fill mode
+            Returns
+            -------
+                shifted batch as np.array
+        """
+        batch = self.check_batch(batch)
+        axes = (axis,) if isinstance(axis, int) else tuple(axis)
+        shift_ranges = np.asarray(shift_ranges, dtype=np.float64)
+        if shift_ranges.ndim == 1 and len(axes) == 1: # one range per sample
+            shift_ranges = shift_ranges[:, None]
+        shift_ranges = np.broadcast_to(shift_ranges, (batch.shape[0], len(axes)))
+        shifts = np.zeros((batch.shape[0], 2), dtype=np.int64) # (rows, columns) shift of every sample in pixels
+        for index, current_axis in enumerate(axes):
+            # vectorized ImageAugmentation.shift_in_pixels
+            pixel_shifts = np.maximum((np.abs(shift_ranges[:, index]) * batch.shape[1 + current_axis]).astype(np.int64) - 1, 0)
+            shifts[:, current_axis] = np.where(shift_ranges[:, index] >= 0, pixel_shifts, -pixel_shifts)
+        result = np.empty_like(batch)
+        height, width = batch.shape[1:3]
+        for sample, (shift_y, shift_x) in enumerate(shifts.tolist()):
+            if fill_mode == 'wrap':
+                result[sample] = np.roll(batch[sample], (-shift_y, -shift_x), axis=(0, 1))
+                continue
+            # same slicing and border as shift_image, written into the result batch
+            kept = batch[sample, max(shift_y, 0):height + min(shift_y, 0), max(shift_x, 0):width + min(shift_x, 0)]
+            cv2.copyMakeBorder(kept, max(-shift_y, 0), max(shift_y, 0), max(-shift_x, 0), max(shift_x, 0),
+                               ImageAugmentation.FILL_MODES[fill_mode], dst=result[sample], value=(fill_value,) * 4)
+        return result
+
+    def random_crop_batch(self, batch, height_range, width_range, rng=None):
+        """
+            Crops every sample at its own random position, all to the same size
+            Parameters
+            ----------
+                height_range : float
+                    height of the crops as a fraction of the sample height
+                width_range : float
+                    width of the crops as a fraction of the sample width
+                rng : np.random.Generator
+                    generator the positions of all the samples are drawn from, a fresh unseeded one when not given
+            Returns
+            -------
+                cropped batch as np.array of shape (N, int(H * height_range), int(W * width_range), C)
+        """
+        batch = self.check_batch(batch)
+        height, width = max(int(batch.shape[1] * height_range), 1), max(int(batch.shape[2] * width_range), 1)
+        assert batch.shape[1] >= height
+        assert batch.shape[2] >= width
+        if rng is None:
+            rng = np.random.default_rng()
+        xs = rng.integers(0, batch.shape[2] - width, size=batch.shape[0], endpoint=True)
+        ys = rng.integers(0, batch.shape[1] - height, size=batch.shape[0], endpoint=True)
+        return self.window_batch(batch, ys, xs, height, width)
+
+    def bright_batch(self, batch, brightness_values, channel_order='BGR'):
+        """
+            Adds its brightness value to the V channel (HSV) of every sample, like
+            ImageAugmentation.random_bright_image with the given values
+            Parameters
+            ----------
+                brightness_values : int or array of ints
+                    brightness value of every sample, samples with 0 are copied unchanged
+                channel_order : str
+                    'BGR' (OpenCV's native order) or 'RGB'
+        """
+        batch = self.check_batch(batch)
+        batch_size, height, width, channels = batch.shape
+        brightness_values = self.sample_values(brightness_values, batch_size, np.int64).tolist()
+        if channels == 1: # the value of a grayscale pixel is the pixel itself
+            result = np.empty_like(batch)
+            for sample, brightness_value in enumerate(brightness_values):
+                cv2.add(batch[sample], brightness_value, dst=result[sample])
+            return result
+        to_hsv, from_hsv = (cv2.COLOR_BGR2HSV, cv2.COLOR_HSV2BGR) if channel_order == 'BGR' else (cv2.COLOR_RGB2HSV, cv2.COLOR_HSV2RGB)
+        # color conversions are per pixel, the batch is converted as one tall image each way
+        tall_result = cv2.cvtColor(batch.reshape(batch_size * height, width, channels), to_hsv)
+        result = tall_result.reshape(batch.shape)
+        for sample, brightness_value in enumerate(brightness_values):
+            cv2.add(result[sample], (0, 0, brightness_value, 0), dst=result[sample])
+        cv2.cvtColor(tall_result, from_hsv, dst=tall_result)
+        unchanged = [sample for sample, brightness_value in enumerate(brightness_values) if brightness_value == 0]
+        result[unchanged] = batch[unchanged] # skips the lossy HSV round trip, as random_bright_image does
+        return result
+
+    def random_bright_batch(self, batch, brightness_range, rng=None, channel_order='BGR'):
+        """
+            Randomly brightens every sample, with brightness values drawn from brightness_range
+            (inclusive) for all the samples at once
+        """
+        start_range, end_range = brightness_range
+        if rng is None:
+            rng = np.random.default_rng()
+        brightness_values = rng.integers(start_range, end_range, size=batch.shape[0], endpoint=True)
+        return self.bright_batch(batch, brightness_values, channel_order)
+
+    def lut_batch(self, batch, tables):
+        """
+            Maps the pixel values of every sample through its own lookup table
+            Parameters
+            ----------
+                tables : (N, 256) uint8 np.array
+        """
+        batch = self.check_batch(batch)
+        result = np.empty_like(batch)
+        for sample, (image, table) in enumerate(zip(batch, tables)):
+            cv2.LUT(image, table, dst=result[sample])
+        return result
+
+    def gamma_tables(self, batch_size, gammas):
+        """
+            Tables of ImageAugmentation.gamma_table for every sample, computed at once
+        """
+        gammas = self.sample_values(gammas, batch_size)
+        return (((np.arange(0, 256) / 255.0) ** (1.0 / gammas[:, None])) * 255).astype(np.uint8)
+
+    def adjust_gamma_batch(self, batch, gammas):
+        """
+            Gamma correction of every sample with its own gamma
+        """
+        return self.lut_batch(batch, self.gamma_tables(batch.shape[0], gammas))
+
+    def contrast_batch(self, batch, contrast_factors):
+        """
+            Adjusts the contrast of every sample by its own contrast factor
+        """
+        batch = self.check_batch(batch)
+        contrast_factors = self.sample_values(contrast_factors, batch.shape[0]).tolist()
+        result = np.empty_like(batch)
+        for sample, contrast_factor in enumerate(contrast_factors):
+            # the scaling is vectorized by cv2, faster than a lookup table
+            cv2.convertScaleAbs(batch[sample], dst=result[sample], alpha=contrast_factor, beta=0)
+        return result
@@ -0,0 +1,315 @@
+"""
+    Benchmarks of every ImageAugmentation op on synthetic images (grayscale and RGB, from 256px
+    up to 8K), of the BatchAugmentation ops on (N, H, W, C) batches against the single image op
+    called in a loop and stacked into a batch, and of full augment_images runs over the sample
+    images directory with each input_config_*.json file.
+
+        python benchmark.py --output baseline.json
+        python benchmark.py --compare baseline.json --threshold 0.1
+
+    Results are saved as JSON: per case the median time, the throughput (megapixels/s for the ops
+    and batches, augmented images/s for the runs) and the peak memory (memory traced during one op call, peak
+    resident memory of the process for the runs, which are run in a fresh process each). The
+    compare mode flags the cases whose throughput dropped or whose peak memory grew by more than
+    the threshold, and exits with status 1 when there is any
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+from cv2 import cv2
+from image_augmentation import ImageAugmentation
+from batch_augmentation import BatchAugmentation
+
+# name -> (height, width) of the synthetic images
+SIZES = {'256': (256, 256), '1024': (1024, 1024), '1080p': (1080, 1920), '4K': (2160, 3840), '8K': (4320, 7680)}
+DEFAULT_SIZES = ('256', '1024', '4K', '8K')
+DEFAULT_BATCH_IMAGE_SIZES = ('256', '1024')
+
+img_augmentator = ImageAugmentation()
+# op name -> call of the op on an image with typical config parameters
+OPS = {
+    'rotate_image': lambda image, rng: img_augmentator.rotate_image(image, angle=30),
+    'flip_image': lambda image, rng: img_augmentator.flip_image(image, flip_code=1),
+    'shift_image': lambda image, rng: img_augmentator.shift_image(image, axis=0, shift_range=0.2),
+    'shear_image': lambda image, rng: img_augmentator.shear_image(image, shear_angle=0.3),
+    'clipped_zoom_image': lambda image, rng: img_augmentator.clipped_zoom_image(image, zoom_factor=1.5),
+    'random_crop_image': lambda image, rng: img_augmentator.random_crop_image(image, height_range=0.8, width_range=0.8, rng=rng),
+    'random_bright_image': lambda image, rng: img_augmentator.random_bright_image(image, brightness_range=(10, 50), rng=rng,
+                                                                                   channel_order='BGR'),
+    'adjust_gamma': lambda image, rng: img_augmentator.adjust_gamma(image, gamma=1.5),
+    'gaussian_blur': lambda image, rng: img_augmentator.gaussian_blur(image, kernel=(5, 5)),
+    'contrast_image': lambda image, rng: img_augmentator.contrast_image(image, contrast_factor=1.3),
+}
+
+batch_augmentator = BatchAugmentation()
+# op name -> (call of the batch op with per sample parameters, call of the single image op with the parameters of one sample)
+BATCH_OPS = {
+    'rotate': (lambda batch, rng: batch_augmentator.rotate_batch(batch, rng.uniform(-30, 30, len(batch))),
+               lambda image, rng: img_augmentator.rotate_image(image, angle=rng.uniform(-30, 30))),
+    'flip': (lambda batch, rng: batch_augmentator.flip_batch(batch, rng.integers(-1, 1, len(batch), endpoint=True)),
+             lambda image, rng: img_augmentator.flip_image(image, flip_code=int(rng.integers(-1, 1, endpoint=True)))),
+    'shift': (lambda batch, rng: batch_augmentator.shift_batch(batch, 0, rng.uniform(-0.2, 0.2, len(batch))),
+              lambda image, rng: img_augmentator.shift_image(image, axis=0, shift_range=rng.uniform(-0.2, 0.2))),
+    'shear': (lambda batch, rng: batch_augmentator.shear_batch(batch, rng.uniform(-0.3, 0.3, len(batch))),
+              lambda image, rng: img_augmentator.shear_image(image, shear_angle=rng.uniform(-0.3, 0.3))),
+    'zoom': (lambda batch, rng: batch_augmentator.zoom_batch(batch, rng.uniform(0.8, 1.5, len(batch))),
+             lambda image, rng: img_augmentator.clipped_zoom_image(image, zoom_factor=rng.uniform(0.8, 1.5))),
+    'random_crop': (lambda batch, rng: batch_augmentator.random_crop_batch(batch, 0.8, 0.8, rng=rng),
+                    # a crop of a single image is a view, the copy happens when stacking the batch
+                    lambda image, rng: img_augmentator.random_crop_image(image, height_range=0.8, width_range=0.8, rng=rng)),
+    'random_bright': (lambda batch, rng: batch_augmentator.random_bright_batch(batch, (10, 50), rng=rng),
+                      lambda image, rng: img_augmentator.random_bright_image(image, brightness_range=(10, 50), rng=rng, channel_order='BGR')),
+    'adjust_gamma': (lambda batch, rng: batch_augmentator.adjust_gamma_batch(batch, rng.uniform(0.5, 1.5, len(batch))),
+                     lambda image, rng: img_augmentator.adjust_gamma(image, gamma=rng.uniform(0.5, 1.5))),
+    'contrast': (lambda batch, rng: batch_augmentator.contrast_batch(batch, rng.uniform(0.7, 1.3, len(batch))),
+                 lambda image, rng: img_augmentator.contrast_image(image, contrast_factor=rng.uniform(0.7, 1.3))),
+    # rotation, shear and zoom of every sample with a single resample, against the three single image ops
+    'geometric_chain': (lambda batch, rng: batch_augmentator.warp_batch(batch, batch_augmentator.compose(
+                            batch_augmentator.rotation_matrices(batch.shape, rng.uniform(-30, 30, len(batch))),
+                            batch_augmentator.shear_matrices(batch.shape, rng.uniform(-0.3, 0.3, len(batch))),
+                            batch_augmentator.zoom_matrices(batch.shape, rng.uniform(0.8, 1.5, len(batch))))),
+                        lambda image, rng: img_augmentator.clipped_zoom_image(img_augmentator.shear_image(
+                            img_augmentator.rotate_image(image, angle=rng.uniform(-30, 30)), shear_angle=rng.uniform(-0.3, 0.3)),
+                            zoom_factor=rng.uniform(0.8, 1.5))),
+}
+
+
+def synthetic_image(size_name, channels):
+    """
+        Smooth gradients with noise, so that the encoders and the ops don't hit trivial cases
+    """
+    height, width = SIZES[size_name]
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    image = ((x * 255 // max(width - 1, 1) + y * 255 // max(height - 1, 1)) // 2).astype(np.uint8)
+    image = cv2.add(image, rng.integers(0, 32, size=(height, width), dtype=np.uint8))
+    if channels == 1:
+        return image
+    return np.dstack([image, cv2.flip(image, 1), cv2.flip(image, 0)])
+
+
+def median_time(function, min_time=0.2, min_repeats=3, max_repeats=50):
+    """
+        Median wall time of function() in seconds, repeated until min_time is spent
+    """
+    function() # warm up: lookup tables, OpenCV dispatch and page faults of the first call
+    times = []
+    started = time.perf_counter()
+    while len(times) < max_repeats and (len(times) < min_repeats or time.perf_counter() - started < min_time):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def traced_peak_memory(function):
+    """
+        Peak bytes allocated through Python and NumPy (OpenCV outputs are NumPy arrays) during one call
+    """
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_ops(size_names, op_names):
+    results = {}
+    for size_name in size_names:
+        for channels, color_name in ((1, 'gray'), (3, 'rgb')):
+            image = synthetic_image(size_name, channels)
+            megapixels = image.shape[0] * image.shape[1] / 1e6
+            for op_name in op_names:
+                rng = np.random.default_rng(0)
+                function = lambda: OPS[op_name](image, rng)
+                seconds = median_time(function)
+                results['op/{}/{}/{}'.format(op_name, size_name, color_name)] = {
+                    'seconds': seconds, 'throughput': megapixels / seconds, 'unit': 'MP/s',
+                    'peak_memory': traced_peak_memory(function)}
+                print('op/{}/{}/{}: {:.3f} ms'.format(op_name, size_name, color_name, seconds * 1000))
+    return results
+
+
+def benchmark_batches(size_names, op_names, batch_size):
+    """
+        Every batch op against its single image op called on every sample and stacked into a batch,
+        cases 'batch/<op>/<size>/<color>/n<batch size>' and 'batch_loop/...'
+    """
+    results = {}
+    for size_name in size_names:
+        for channels, color_name in ((1, 'gray'), (3, 'rgb')):
+            image = synthetic_image(size_name, channels)
+            batch = np.stack([image] * batch_size).reshape((batch_size,) + image.shape[:2] + (channels,))
+            images = batch if channels == 3 else batch[..., 0] # the single image ops take grayscale images as 2-dim arrays
+            megapixels = batch_size * image.shape[0] * image.shape[1] / 1e6
+            for op_name in op_names:
+                batch_op, image_op = BATCH_OPS[op_name]
+                rng = np.random.default_rng(0)
+                functions = {'batch': lambda: batch_op(batch, rng),
+                             'batch_loop': lambda: np.stack([image_op(sample, rng) for sample in images])}
+                case_seconds = {}
+                for kind, function in functions.items():
+                    case_seconds[kind] = median_time(function)
+                    results['{}/{}/{}/{}/n{}'.format(kind, op_name, size_name, color_name, batch_size)] = {
+                        'seconds': case_seconds[kind], 'throughput': megapixels / case_seconds[kind], 'unit': 'MP/s',
+                        'peak_memory': traced_peak_memory(function)}
+                print('batch/{}/{}/{}/n{}: {:.3f} ms, loop {:.3f} ms ({:.2f}x)'.format(
+                    op_name, size_name, color_name, batch_size, case_seconds['batch'] * 1000, case_seconds['batch_loop'] * 1000,
+                    case_seconds['batch_loop'] / case_seconds['batch']))
+    return results
+
+
+def run_augment_images(config_file_path, input_dir_path, workers):
+    """
+        One full augment_images run, in the fresh process it is called in
+        Returns
+        -------
+            (seconds, number of augmented images, peak resident memory in bytes or None) tuple
+    """
+    from main import DataAugmentation
+    output_dir_path = tempfile.mkdtemp(prefix='augment_benchmark_')
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            data_augmentation = DataAugmentation(config_file_path, input_images_dir_path=input_dir_path,
+                                                 output_dir_path=output_dir_path, workers=workers, seed=0)
+            start = time.perf_counter()
+            data_augmentation.augment_images()
+            seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_dir_path, ignore_errors=True)
+    try:
+        import resource
+    except ImportError: # not available on Windows
+        return (seconds, data_augmentation.img_count - 1, None)
+    peak_memory = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # kilobytes on Linux, bytes on macOS
+    return (seconds, data_augmentation.img_count - 1, peak_memory if sys.platform == 'darwin' else peak_memory * 1024)
+
+
+def benchmark_runs(config_file_paths, input_dir_path, workers, repeats=3):
+    results = {}
+    for config_file_path in config_file_paths:
+        runs = []
+        for _ in range(repeats):
+            # a fresh process per run: no warm caches and a peak memory of this run only
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                runs.append(executor.submit(run_augment_images, config_file_path, input_dir_path, workers).result())
+        seconds = float(np.median([run[0] for run in runs]))
+        peak_memories = [run[2] for run in runs if run[2] is not None]
+        case_name = 'run/{}/workers{}'.format(os.path.splitext(os.path.basename(config_file_path))[0], workers)
+        results[case_name] = {'seconds': seconds, 'throughput': runs[0][1] / seconds, 'unit': 'images/s',
+                              'peak_memory': max(peak_memories) if peak_memories else None}
+        print('{}: {:.3f} s'.format(case_name, seconds))
+    return results
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+            'platform': platform.platform(), 'machine': platform.machine(), 'cpu_count': os.cpu_count()}
+
+
+def compare(baseline, current, threshold, memory_threshold):
+    """
+        Cases of both result sets whose throughput dropped by more than threshold or whose peak memory
+        grew by more than memory_threshold (both as fractions of the baseline)
+        Returns
+        -------
+            list of regression descriptions
+    """
+    regressions = []
+    for case_name, baseline_result in baseline['results'].items():
+        current_result = current['results'].get(case_name)
+        if current_result is None:
+            continue
+        throughput_ratio = current_result['throughput'] / baseline_result['throughput']
+        if throughput_ratio < 1 - threshold:
+            regressions.append('{}: throughput {:.4g} -> {:.4g} {} ({:+.1%})'.format(
+                case_name, baseline_result['throughput'], current_result['throughput'], current_result['unit'], throughput_ratio - 1))
+        if baseline_result['peak_memory'] and current_result['peak_memory'] is not None:
+            memory_ratio = current_result['peak_memory'] / baseline_result['peak_memory']
+            if memory_ratio > 1 + memory_threshold:
+                regressions.append('{}: peak memory {:.1f} -> {:.1f} MB ({:+.1%})'.format(
+                    case_name, baseline_result['peak_memory'] / 2**20, current_result['peak_memory'] / 2**20, memory_ratio - 1))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the augmentation ops and full runs, save or compare baselines')
+    parser.add_argument('--output', default=None, help='JSON file the results are saved to')
+    parser.add_argument('--compare', default=None, help='baseline JSON file to compare the results with')
+    parser.add_argument('--current', default=None, help='compare this results JSON file instead of running the benchmarks')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed throughput drop, as a fraction (default: 0.1)')
+    parser.add_argument('--memory-threshold', type=float, default=0.1, help='allowed peak memory growth, as a fraction (default: 0.1)')
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES),
+                        help='comma separated synthetic image sizes among {} (default: {})'.format(', '.join(SIZES), ','.join(DEFAULT_SIZES)))
+    parser.add_argument('--ops', default=','.join(OPS), help='comma separated ops to benchmark (default: all)')
+    parser.add_argument('--batch-size', type=int, default=32, help='samples of the batches of the batch ops (default: 32)')
+    parser.add_argument('--batch-image-sizes', default=','.join(DEFAULT_BATCH_IMAGE_SIZES),
+                        help='comma separated synthetic image sizes of the batches (default: {})'.format(','.join(DEFAULT_BATCH_IMAGE_SIZES)))
+    parser.add_argument('--batch-ops', default=','.join(BATCH_OPS), help='comma separated batch ops to benchmark (default: all)')
+    parser.add_argument('--input', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images'),
+                        help='images of the full runs (default: the sample images directory)')
+    parser.add_argument('--configs', default=None, help='comma separated config files of the full runs (default: input_config_*.json)')
+    parser.add_argument('--workers', type=int, default=1, help='workers of the full runs (default: 1)')
+    parser.add_argument('--skip-ops', action='store_true', help='do not benchmark the single image ops')
+    parser.add_argument('--skip-batches', action='store_true', help='do not benchmark the batch ops')
+    parser.add_argument('--skip-runs', action='store_true', help='do not benchmark the full runs')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.current is not None:
+        with open(args.current, 'r', encoding='utf8') as results_file:
+            current = json.load(results_file)
+    else:
+        size_names = args.sizes.split(',')
+        op_names = args.ops.split(',')
+        batch_size_names = args.batch_image_sizes.split(',')
+        batch_op_names = args.batch_ops.split(',')
+        unknown_names = ([name for name in size_names + batch_size_names if name not in SIZES] + [name for name in op_names if name not in OPS] +
+                         [name for name in batch_op_names if name not in BATCH_OPS])
+        if unknown_names:
+            print('unknown size(s) or op(s): {}'.format(', '.join(unknown_names)), file=sys.stderr)
+            return 2
+        current = {'environment': environment(), 'results': {}}
+        if not args.skip_ops:
+            current['results'].update(benchmark_ops(size_names, op_names))
+        if not args.skip_batches:
+            current['results'].update(benchmark_batches(batch_size_names, batch_op_names, args.batch_size))
+        if not args.skip_runs:
+            if args.configs is not None:
+                config_file_paths = args.configs.split(',')
+            else:
+                config_file_paths = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input_config_*.json')))
+            current['results'].update(benchmark_runs(config_file_paths, args.input, args.workers))
+        if args.output is not None:
+            with open(args.output, 'w', encoding='utf8') as results_file:
+                json.dump(current, results_file, indent=2)
+    if args.compare is None:
+        return 0
+    with open(args.compare, 'r', encoding='utf8') as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare(baseline, current, args.threshold, args.memory_threshold)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    print('{} regression(s) in {} compared cases'.format(len(regressions), len(set(baseline['results']) & set(current['results']))))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import sys
+import numpy as np
+
+
+class BufferPool:
+    """
+        Per worker pool of image buffers keyed by shape and dtype, handed to the ops as their out
+        buffer so that the steps of the images of a run reuse the same arrays instead of allocating
+        full size images for every step.
+
+        Buffers are never given back explicitly: a pooled buffer is free again once nothing but the
+        pool references it, so a result still being encoded by a writer thread, kept as a shared
+        intermediate, yielded to a consumer or viewed by a crop (a view references its base array)
+        is never overwritten. Buffers are handed out by the transforming thread only
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+            Parameters
+            ----------
+                max_bytes : int
+                    bytes of pooled buffers, past it buffers are allocated without being pooled
+        """
+        self.max_bytes = max_bytes
+        self.buffers = {} # (shape, dtype) -> list of buffers, the oldest keys first
+        self.pooled_bytes = 0
+        self.reused_count = 0
+        self.allocated_count = 0
+        # reference count of a buffer referenced by its pool list only, as seen by refcount()
+        self.free_refcount = self.refcount([np.empty(0)], 0)
+
+    @staticmethod
+    def refcount(buffers, index):
+        return sys.getrefcount(buffers[index])
+
+    def acquire(self, shape, dtype=np.uint8):
+        """
+            A free buffer of the given shape and dtype, with undefined content
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        buffers = self.buffers.get(key)
+        if buffers is not None:
+            for index in range(len(buffers)):
+                if self.refcount(buffers, index) == self.free_refcount:
+                    self.reused_count += 1
+                    return buffers[index]
+        buffer = np.empty(shape, dtype)
+        self.allocated_count += 1
+        if self.pooled_bytes + buffer.nbytes > self.max_bytes:
+            self.evict(buffer.nbytes)
+        if self.pooled_bytes + buffer.nbytes <= self.max_bytes:
+            self.buffers.setdefault(key, []).append(buffer)
+            self.pooled_bytes += buffer.nbytes
+        return buffer
+
+    def evict(self, byte_count):
+        """
+            Drop free buffers, of the oldest shapes first, until byte_count more bytes fit in the pool
+        """
+        for key in list(self.buffers):
+            buffers = self.buffers[key]
+            index = 0
+            while index < len(buffers) and self.pooled_bytes + byte_count > self.max_bytes:
+                if self.refcount(buffers, index) == self.free_refcount:
+                    self.pooled_bytes -= buffers.pop(index).nbytes
+                else:
+                    index += 1
+            if not buffers:
+                del self.buffers[key]
+            if self.pooled_bytes + byte_count <= self.max_bytes:
+                return
@@ -0,0 +1,143 @@
+import numpy as np
+from cv2 import cv2
+
+
+class GeometricChainCompiler:
+    """
+        Compiles consecutive geometric ops of a config entry into a single affine matrix
+        so that the whole run is resampled by one cv2.warpAffine call instead of one
+        full-image resample per op. Ops provide their own 3x3 forward (source -> destination)
+        matrix through op.matrix(image_shape)
+    """
+
+    # bytes of blank masks kept in the cache: policies draw new chains for every image, the oldest ones are dropped
+    CACHE_BYTES = 64 * 1024 * 1024
+
+    def __init__(self):
+        self.compiled_chains = {} # (ops, image shape) -> (compiled 2x3 matrix, blank mask)
+        self.cached_bytes = 0
+
+    @staticmethod
+    def zoom_axis_mapping(size, zoom_factor):
+        """
+            Scale and offset of ImageAugmentation.clipped_zoom_image along one axis, using
+            the same crop/resize/pad arithmetic so that a fused zoom lands on the same pixels
+            Returns
+            -------
+                (scale, offset) tuple, destination = scale * source + offset
+        """
+        new_size = max(int(size * zoom_factor), 1)
+        start = max(0, new_size - size) // 2
+        crop_start = int(start / zoom_factor)
+        crop_end = max(min(int((start + size) / zoom_factor), size), crop_start + 1)
+        resize = min(new_size, size)
+        pad = (size - resize) // 2
+        # cv2.resize maps pixel centers: destination + 0.5 = (source + 0.5) * scale
+        scale = resize / (crop_end - crop_start)
+        return scale, pad + (0.5 - crop_start) * scale - 0.5
+
+    def blank_mask(self, op_matrices, image_shape, region=None):
+        """
+            Pixels of the fused result that one of the intermediate images of the chain
+            would have left blank (moved outside of the image frame), since a single warp
+            would otherwise keep them
+            Parameters
+            ----------
+                op_matrices : list of 3x3 np.array
+                    forward matrices of the chain, in the order they have to be applied
+                image_shape : tuple
+                    shape of the image the chain is applied to
+                region : tuple
+                    (y0, y1, x0, x1) tile of the result the mask is computed for, the whole result when not given
+            Returns
+            -------
+                boolean np.array of shape image_shape[:2] (or of the region) or None if nothing has to be blanked
+        """
+        height, width = image_shape[:2]
+        y0, y1, x0, x1 = region if region is not None else (0, height, 0, width)
+        # frame corners as pixel edges, transposed into homogeneous column vectors
+        corners = np.array([[-0.5, -0.5, 1], [width - 0.5, -0.5, 1],
+                            [width - 0.5, height - 0.5, 1], [-0.5, height - 0.5, 1]]).T
+        keep_mask = np.full((y1 - y0, x1 - x0), 255, dtype=np.uint8)
+        frame_mask = np.empty_like(keep_mask)
+        remaining_matrix = np.eye(3)
+        # frame of the intermediate image after op i, mapped through the ops i+1..n-1
+        for matrix in reversed(op_matrices[1:]):
+            remaining_matrix = remaining_matrix @ matrix
+            frame = (remaining_matrix @ corners)[:2].T - (x0, y0) # relative to the region
+            frame_mask[:] = 0
+            # fixed point coordinates with 4 fractional bits
+            cv2.fillConvexPoly(frame_mask, np.round(frame * 16).astype(np.int32), 255, shift=4)
+            cv2.bitwise_and(keep_mask, frame_mask, dst=keep_mask)
+        blank_mask = keep_mask == 0
+        return blank_mask if blank_mask.any() else None
+
+    def compile_chain(self, ops, image_shape):
+        """
+            Combine a run of geometric ops into a single 2x3 affine matrix.
+            Compiled chains are cached per run and image shape, so every config entry
+            is compiled only once for all the images of the same size (within CACHE_BYTES)
+            Parameters
+            ----------
+                ops : tuple of geometric AugmentationOp
+                    ops in the order they have to be applied
+                image_shape : tuple
+                    shape of the image the run is applied to
+            Returns
+            -------
+                (2x3 affine matrix as np.array, blank mask as returned by blank_mask) tuple
+        """
+        chain_key = (ops, tuple(image_shape[:2]))
+        if chain_key not in self.compiled_chains:
+            op_matrices = [op.matrix(image_shape) for op in ops]
+            compiled_chain = (self.chain_matrix(op_matrices)[:2], self.blank_mask(op_matrices, image_shape))
+            self.cache_chain(chain_key, compiled_chain)
+            return compiled_chain
+        return self.compiled_chains[chain_key]
+
+    @staticmethod
+    def chain_matrix(op_matrices):
+        """
+            3x3 forward matrix of the ops of a chain, given their matrices in the order they have to be applied
+        """
+        matrix = np.eye(3)
+        for op_matrix in op_matrices:
+            # applying A then B to the image means the matrix B @ A
+            matrix = op_matrix @ matrix
+        return matrix
+
+    @staticmethod
+    def chain_bytes(compiled_chain):
+        matrix, blank_mask = compiled_chain
+        return matrix.nbytes + (blank_mask.nbytes if blank_mask is not None else 0)
+
+    def cache_chain(self, chain_key, compiled_chain):
+        chain_bytes = self.chain_bytes(compiled_chain)
+        # dicts keep their insertion order, the first chain is the oldest
+        while self.compiled_chains and self.cached_bytes + chain_bytes > self.CACHE_BYTES:
+            self.cached_bytes -= self.chain_bytes(self.compiled_chains.pop(next(iter(self.compiled_chains))))
+        if chain_bytes <= self.CACHE_BYTES:
+            self.compiled_chains[chain_key] = compiled_chain
+            self.cached_bytes += chain_bytes
+
+    def apply_chain(self, image, ops, out=None):
+        """
+            Apply a run of geometric ops to the given image with a single resample
+            Parameters
+            ----------
+                image : ndim np.array
+                    image to be transformed
+                ops : tuple of geometric AugmentationOp
+                    ops in the order they have to be applied
+                out : ndim np.array
+                    buffer of the shape and dtype of the image the result is written into
+            Returns
+            -------
+                transformed image as np.array, same shape and dtype as the input image
+        """
+        matrix, blank_mask = self.compile_chain(ops, image.shape)
+        result = cv2.warpAffine(image, matrix, image.shape[1::-1], dst=out, flags=cv2.INTER_LINEAR,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        if blank_mask is not None:
+            result[blank_mask] = 0
+        return result
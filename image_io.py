@@ -0,0 +1,257 @@
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from cv2 import cv2
+
+
+class ImageDecoder:
+    """
+        Decodes the input images in OpenCV's native BGR order, optionally at a working resolution:
+        with a target size, images are downscaled once, right after decoding, so that their shorter
+        side is target_size pixels (smaller images are kept as they are). JPEGs large enough are
+        decoded directly at 1/2, 1/4 or 1/8 of their size by libjpeg (cv2.IMREAD_REDUCED_COLOR_*),
+        so the decode cost follows the working size instead of the input size
+    """
+    # largest reduction first
+    REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+    def __init__(self, target_size=None):
+        """
+            Parameters
+            ----------
+                target_size : int
+                    shorter side of the working images in pixels, None to work at full resolution
+        """
+        if target_size is not None and target_size < 1:
+            raise ValueError('target size must be a positive number of pixels, got {}'.format(target_size))
+        self.target_size = target_size
+
+    def read(self, file_path):
+        """
+            Decoded image of the given file, None when it can't be read as an image (as cv2.imread,
+            also for directories and files that can't be opened)
+        """
+        if self.target_size is None:
+            return cv2.imread(file_path)
+        try:
+            with open(file_path, 'rb') as image_file:
+                data = image_file.read()
+        except OSError:
+            return None
+        return self.decode(data)
+
+    def decode(self, data):
+        """
+            Decoded image of the given file bytes, None when they can't be decoded as an image
+        """
+        decode_flag = cv2.IMREAD_COLOR
+        if self.target_size is not None:
+            jpeg_size = self.jpeg_size(data)
+            if jpeg_size is not None:
+                for factor, reduced_flag in self.REDUCED_DECODE_FLAGS:
+                    if -(-min(jpeg_size) // factor) >= self.target_size: # libjpeg rounds the reduced size up
+                        decode_flag = reduced_flag
+                        break
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), decode_flag)
+        if image is None or self.target_size is None:
+            return image
+        return self.resize(image)
+
+    def resize(self, image):
+        height, width = image.shape[:2]
+        scale = self.target_size / min(height, width)
+        if scale >= 1:
+            return image
+        return cv2.resize(image, (max(round(width * scale), 1), max(round(height * scale), 1)), interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def jpeg_size(data):
+        """
+            (height, width) of a JPEG read from its frame header, None when data is not a JPEG
+        """
+        if data[:2] != b'\xff\xd8':
+            return None
+        index = 2
+        while index + 4 <= len(data):
+            if data[index] != 0xff:
+                return None
+            marker = data[index + 1]
+            if marker == 0xff: # fill byte
+                index += 1
+                continue
+            if marker == 0x01 or 0xd0 <= marker <= 0xd7: # markers without a segment
+                index += 2
+                continue
+            # start of frame markers, except DHT (c4), JPG (c8) and DAC (cc)
+            if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                if index + 9 > len(data):
+                    return None
+                return (int.from_bytes(data[index + 5:index + 7], 'big'), int.from_bytes(data[index + 7:index + 9], 'big'))
+            index += 2 + int.from_bytes(data[index + 2:index + 4], 'big')
+        return None
+
+
+class OutputCodec:
+    """
+        Output image format and encoding parameters of the augmented images
+    """
+    FORMATS = ('auto', 'jpg', 'png', 'webp')
+    # inputs that 'auto' keeps lossless (as PNG), every other input is stored as JPEG
+    LOSSLESS_INPUT_EXTENSIONS = ('.png', '.bmp', '.tif', '.tiff', '.ppm', '.pgm')
+
+    def __init__(self, format='auto', jpeg_quality=95, png_compression=3, webp_quality=90, lossless=False):
+        """
+            Parameters
+            ----------
+                format : str
+                    one of FORMATS. 'auto' stores lossless inputs (PNG, BMP, TIFF...) as PNG and
+                    every other input as JPEG
+                jpeg_quality : int
+                    JPEG quality in [0,100]
+                png_compression : int
+                    PNG compression level in [0,9], higher is smaller but slower to encode
+                webp_quality : int
+                    WebP quality in [1,100]
+                lossless : bool
+                    lossless output only: PNG for 'auto', lossless WebP for 'webp'. Not available for 'jpg'
+        """
+        if format not in self.FORMATS:
+            raise ValueError("output format must be one of {}, got {!r}".format(', '.join(self.FORMATS), format))
+        if lossless and format == 'jpg':
+            raise ValueError('JPEG output can not be lossless, use the png or webp format')
+        if not 0 <= jpeg_quality <= 100:
+            raise ValueError('JPEG quality must be in [0,100], got {}'.format(jpeg_quality))
+        if not 0 <= png_compression <= 9:
+            raise ValueError('PNG compression must be in [0,9], got {}'.format(png_compression))
+        if not 1 <= webp_quality <= 100:
+            raise ValueError('WebP quality must be in [1,100], got {}'.format(webp_quality))
+        self.format = format
+        self.lossless = lossless
+        self.encode_params = {
+            '.jpg': [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality],
+            '.png': [cv2.IMWRITE_PNG_COMPRESSION, png_compression],
+            # OpenCV encodes lossless WebP for a quality above 100
+            '.webp': [cv2.IMWRITE_WEBP_QUALITY, 101 if lossless else webp_quality]
+        }
+
+    @property
+    def settings(self):
+        """
+            Everything that changes the encoded files, the outputs of other settings are not reused
+        """
+        return (self.format, self.lossless, tuple(sorted((extension, tuple(params)) for extension, params in self.encode_params.items())))
+
+    def extension(self, input_file_name):
+        """
+            Extension (with the dot) of the augmented images of the given input file
+        """
+        if self.format != 'auto':
+            return '.' + self.format
+        if self.lossless or os.path.splitext(input_file_name)[1].lower() in self.LOSSLESS_INPUT_EXTENSIONS:
+            return '.png'
+        return '.jpg'
+
+    def encode(self, image, extension):
+        """
+            Encode a BGR image into the bytes of an image file with the given extension
+            Returns
+            -------
+                encoded image as 1-dim uint8 np.array
+        """
+        is_encoded, buffer = cv2.imencode(extension, image, self.encode_params[extension])
+        if not is_encoded:
+            raise IOError('could not encode image as {}'.format(extension))
+        return buffer
+
+
+class ImagePipeline:
+    """
+        Overlaps the decoding of the next input images and the encoding of the augmented images
+        with the transformations, on thread pools (OpenCV releases the GIL while decoding and
+        encoding). Both sides are bounded to queue_size images in flight, which caps the memory
+        of a run to about 2 * queue_size images on top of the ones being transformed.
+        With 0 threads everything runs in the calling thread
+    """
+
+    def __init__(self, decode_threads=2, encode_threads=2, queue_size=8):
+        self.queue_size = max(queue_size, 1)
+        self.decode_executor = ThreadPoolExecutor(decode_threads) if decode_threads > 0 else None
+        self.encode_executor = ThreadPoolExecutor(encode_threads) if encode_threads > 0 else None
+        self.pending_writes = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(wait_writes=exc_type is None)
+
+    def decoded(self, items, decode):
+        """
+            Decode the given items ahead of their consumer, keeping their order
+            Parameters
+            ----------
+                items : iterable
+                    items to decode, for example image file paths
+                decode : callable
+                    item -> decoded image (or None when the item is not an image), or any value holding it
+            Returns
+            -------
+                generator of (item, decoded value) tuples
+        """
+        if self.decode_executor is None:
+            for item in items:
+                yield item, decode(item)
+            return
+        pending_decodes = deque()
+        for item in items:
+            pending_decodes.append((item, self.decode_executor.submit(decode, item)))
+            if len(pending_decodes) >= self.queue_size:
+                item, future = pending_decodes.popleft()
+                yield item, future.result()
+        while pending_decodes:
+            item, future = pending_decodes.popleft()
+            yield item, future.result()
+
+    def submit_write(self, write, *args):
+        """
+            Call write(*args) in the background when the pipeline has encode threads, blocking while
+            queue_size writes are already in flight
+            Returns
+            -------
+                concurrent.futures.Future of the result of write, already done without encode threads
+        """
+        if self.encode_executor is None:
+            future = Future()
+            future.set_result(write(*args))
+            return future
+        while len(self.pending_writes) >= self.queue_size:
+            self.pending_writes.popleft().result() # raises the errors of the background writes
+        future = self.encode_executor.submit(write, *args)
+        self.pending_writes.append(future)
+        return future
+
+    @staticmethod
+    def write_image(image, file_path, codec, extension):
+        """
+            Encode the image with the codec and write it to file_path
+        """
+        buffer = codec.encode(image, extension)
+        with open(file_path, 'wb') as image_file:
+            image_file.write(buffer)
+        return buffer.nbytes
+
+    def close(self, wait_writes=True):
+        """
+            Wait for the pending writes (raising their errors with wait_writes) and stop the threads.
+            The submitted writes are finished either way (at most queue_size of them), so that the
+            images already transformed when an error stops a run are not lost; pending decodes are cancelled
+        """
+        try:
+            while wait_writes and self.pending_writes:
+                self.pending_writes.popleft().result()
+        finally:
+            if self.decode_executor is not None:
+                self.decode_executor.shutdown(wait=True, cancel_futures=True)
+            if self.encode_executor is not None:
+                self.encode_executor.shutdown(wait=True)
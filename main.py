@@ -3,15 +3,91 @@ import numpy as np
 from cv2 import cv2
 import json
 import os
-from tkinter import filedialog, Tk
-from image_augmentation import ImageAugmentation
-from params_extract_utils import ParamsExtractUtils
+import hashlib
+from augmentation_plan import AugmentationPlan, image_rng
+from transform_dag import TransformDag
+from image_io import OutputCodec, ImagePipeline, ImageDecoder
+from output_manifest import OutputManifest
+from packed_dataset import PackedDatasetWriter
+from run_stats import RunStats, ProgressLine
+from buffer_pool import BufferPool
+import time
+from collections import deque
 import random
 
 
+class OutputNameCollisionError(ValueError):
+    """
+        Several input files would write their augmented images under the same output names
+    """
+
+
 class DataAugmentation:
 
-    def __init__(self,config_file_path):
+    def __init__(self,config_file_path,input_images_dir_path=None,output_dir_path=None,workers=1,seed=None,
+                 intermediate_memory_limit=512*1024*1024,output_codec=None,io_threads=2,queue_size=8,
+                 resume=True,prune=False,shard_size=None,raw_shards=False,stats_file_path=None,progress_interval=None,
+                 target_size=None,buffer_pool_limit=256*1024*1024,work_shard=None):
+        """
+            Parameters
+            ----------
+                config_file_path : str
+                    path of the JSON configuration file
+                input_images_dir_path : str
+                    directory of the images to augment. When not given, the config file (if it doesn't
+                    exist) and the input directory are picked with tkinter file dialogs
+                output_dir_path : str
+                    directory the augmented images are stored in, input_images_dir_path + '_aug' by default
+                workers : int
+                    number of processes the input images are spread across
+                seed : int
+                    global seed of the random methods, a random one is drawn (and printed) when not given
+                intermediate_memory_limit : int
+                    bytes of intermediate results shared between entries kept per image and worker
+                output_codec : OutputCodec
+                    format and encoding parameters of the augmented images, OutputCodec() by default
+                    (PNG for lossless inputs, JPEG otherwise)
+                io_threads : int
+                    threads decoding the input images and threads encoding the augmented images, per worker.
+                    0 decodes and encodes in the transforming thread
+                queue_size : int
+                    maximum number of decoded images waiting to be transformed, and of augmented
+                    images waiting to be encoded, per worker
+                resume : bool
+                    skip the (image, entry) pairs the manifest of the output directory records as done
+                    for the same image content, entry and seed. Outputs are recorded either way
+                prune : bool
+                    delete the recorded outputs of the input images and config entries that are no
+                    longer part of the run
+                shard_size : int
+                    when given, the augmented images are appended to shard files of at most shard_size
+                    bytes with an index of their samples (see packed_dataset.py) instead of being
+                    written one file per image
+                raw_shards : bool
+                    store the images in the shards as raw uint8 arrays instead of encoding them
+                stats_file_path : str
+                    when given, the time of every stage of the run (read, each op, each entry, write)
+                    is recorded and a JSON summary is written to this file at the end of the run
+                progress_interval : float
+                    when given, a progress line is printed on stderr at most every progress_interval seconds
+                target_size : int
+                    when given, the input images are downscaled right after decoding so that their shorter
+                    side is target_size pixels, and every transform runs at that working resolution. Large
+                    JPEGs are decoded directly at a reduced size
+                buffer_pool_limit : int
+                    bytes of image buffers the transforms of a worker write into and reuse from image to
+                    image (see buffer_pool.py), 0 or None allocates a new array for every step
+                work_shard : tuple
+                    (shard index, shard count) of a run spread over several processes or machines: only the
+                    (input file, config entry) work units assigned to this shard by unit_shard are augmented,
+                    and they are recorded in a manifest of the shard, see merge_shard_manifests. Needs a seed
+        """
+        if work_shard is not None:
+            shard_index,shard_count = work_shard
+            if(shard_count < 1 or not 0 <= shard_index < shard_count):
+                raise ValueError('work shard must be i/N with 0 <= i < N, got {}/{}'.format(shard_index,shard_count))
+            if(seed is None):
+                raise ValueError('sharded runs need a seed, so that every shard draws the same random values')
         self.aug_config_dict = {}
         self.input_images_dir_path = r'.\test'
         self.config_file_path = config_file_path
@@ -19,126 +95,474 @@ class DataAugmentation:
         # self.config_file_path =''
         self.output_dir_path = ''
         self.img_count = 1
-        self.img_augmentator = ImageAugmentation()
-        self.params_extract = ParamsExtractUtils()
+        self.workers = workers
+        self.seed = seed if seed is not None else np.random.SeedSequence().entropy
+        self.work_shard = work_shard
+        self.intermediate_memory_limit = intermediate_memory_limit
+        self.output_codec = output_codec if output_codec is not None else OutputCodec()
+        self.decoder = ImageDecoder(target_size)
+        self.buffer_pool_limit = buffer_pool_limit
+        self.buffers = None # buffer pool of the running worker, created by augment_image_files
+        self.io_threads = io_threads
+        self.queue_size = queue_size
+        self.resume = resume
+        self.prune = prune
+        self.manifest = None # record of the done outputs, in the output directory
+        self.entry_hashes = {} # config key -> hash of the entry and output settings
+        self.entry_output_keys = {} # config key -> manifest keys of the outputs of its samples
+        self.entry_seeds = {} # output key -> seed of the entry, None for entries without random methods
+        self.entry_dags = {} # dags of the entries left to do on partially augmented images
+        self.shard_size = shard_size
+        self.raw_shards = raw_shards
+        self.dataset_writer = None # shard writer of the running worker when the output is packed
+        self.stats_file_path = stats_file_path
+        self.stats = RunStats(enabled=stats_file_path is not None) # stages of the running augment_image_files call
+        self.progress_interval = progress_interval
+        self.progress = None # progress line of a single process run
+        self.plan = None # compiled from the config file by load_config_file
+        self.dag = None # prefix tree of the plan, shares the common steps of the entries (None when ops are drawn per image)
+        self.ops_saved = 0
+        self.root = None
+        if input_images_dir_path is None: # interactive mode
+            self.create_tk_root()
+        self.load_config_file()
+        if input_images_dir_path is None:
+            self.choose_input_dir()
+        else:
+            self.input_images_dir_path = input_images_dir_path
+            self.create_output_dir(output_dir_path)
+
+    def create_tk_root(self):
+        # tkinter is only imported for the interactive mode, batch runs never need a display
+        from tkinter import Tk
         # Configure tkinter library
         self.root = Tk() # create Tkinter object
         self.root.attributes("-topmost", True) # place the file explorer as the top most window
         # root.lift()
         self.root.withdraw() #withdraw the vindow since it is not necessary
-        self.load_config_file()
-        self.choose_input_dir()
 
     def load_config_file(self):
         if not os.path.exists(self.config_file_path):
+            if self.root is None:
+                raise FileNotFoundError('config file {} does not exist'.format(self.config_file_path))
+            from tkinter import filedialog
             self.config_file_path = filedialog.askopenfilename(parent=self.root)    
         with open(self.config_file_path,"r",encoding='utf8') as json_file:
             self.aug_config_dict = json.load(json_file)
+        # parse and validate the whole config once, invalid configs fail before any image is processed
+        self.plan = AugmentationPlan.from_config(self.aug_config_dict)
+        if not self.plan.has_policies:
+            self.dag = TransformDag(AugmentationPlan(self.plan.sample_entries()),memory_limit=self.intermediate_memory_limit)
+        for entry in self.plan.entries:
+            # the outputs of full resolution runs keep the hashes they had before target sizes
+            output_settings = self.output_codec.settings if self.decoder.target_size is None else (self.output_codec.settings,self.decoder.target_size)
+            entry_hash = OutputManifest.entry_hash(entry,output_settings)
+            self.entry_hashes[entry.key] = entry_hash
+            samples = range(entry.samples) if entry.samples > 1 else [None]
+            self.entry_output_keys[entry.key] = tuple(OutputManifest.sample_output_key(entry_hash,sample) for sample in samples)
+            for output_key in self.entry_output_keys[entry.key]:
+                self.entry_seeds[output_key] = self.seed if entry.is_random else None
     
     def choose_input_dir(self):
+        from tkinter import filedialog
         self.input_images_dir_path = filedialog.askdirectory(parent=self.root)
         self.create_output_dir()
 
-    def create_output_dir(self):
+    def create_output_dir(self,output_dir_path=None):
         """
-            Create an output directory to store the augmented images and then 
-            change the current directory to this newly created directory in order for
-            cv2.imwrite() to store the images in this directory
+            Create an output directory to store the augmented images
 
             Name of this directory will be input_dir name + '_aug' suffix and will be created
-            in the same parent directory as the input directory
+            in the same parent directory as the input directory, unless output_dir_path is given
         """
-        self.output_dir_path = self.input_images_dir_path+'_aug'
-        if not os.path.exists(self.output_dir_path):
-            os.mkdir(self.output_dir_path)
+        # absolute paths, the worker processes don't depend on the current directory
+        self.input_images_dir_path = os.path.abspath(self.input_images_dir_path)
+        if output_dir_path is None:
+            output_dir_path = self.input_images_dir_path+'_aug'
+        self.output_dir_path = os.path.abspath(output_dir_path)
+        os.makedirs(self.output_dir_path,exist_ok=True)
+        self.manifest = OutputManifest(self.output_dir_path,self.manifest_file_name())
         print(self.output_dir_path) 
-        os.chdir(self.output_dir_path)
-
-    def save_img(self,image,name_content_list):
-        name_content_list = [str(value) for value in name_content_list]
-        img_file_name = '_'.join(name_content_list)+'.jpg'
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        cv2.imwrite(img_file_name, image)
-        self.img_count+=1
-
-    def apply_transform(self,current_img,method_name,method_params_dict):
-        if(method_name == 'rotation'):
-            in_angle = self.params_extract.extract_rotation_params(method_params_dict)
-            rotated_img = self.img_augmentator.rotate_image(current_img,angle=in_angle)
-            return rotated_img
-
-        if(method_name == 'flip'):
-            in_flip_code = self.params_extract.extract_flip_params(method_params_dict)
-            fliped_img = self.img_augmentator.flip_image(current_img,flip_code=in_flip_code)
-            return fliped_img
-
-        if(method_name == 'shift'):
-            in_axis,in_shift_range = self.params_extract.extract_shift_params(method_params_dict,current_img.ndim)
-            shifted_img = self.img_augmentator.shift_image(current_img,axis=in_axis,shift_range=in_shift_range)
-            return shifted_img
-            
-        if(method_name == 'shear'):
-            in_shear_angle = self.params_extract.extract_shear_params(method_params_dict)
-            sheared_img = self.img_augmentator.shear_image(current_img,shear_angle=in_shear_angle)
-            return sheared_img
-        
-        if(method_name == 'zoom'):
-            in_zoom_factor = self.params_extract.extract_zoom_params(method_params_dict)
-            zoomed_img = self.img_augmentator.clipped_zoom_image(current_img,zoom_factor=in_zoom_factor)
-            return zoomed_img
-
-        if(method_name == 'random_crop'):
-            (in_height_range,in_width_range) = self.params_extract.extract_random_crop_params(method_params_dict)
-            rand_croped_img = self.img_augmentator.random_crop_image(current_img,height_range=in_height_range,width_range=in_width_range)
-            return rand_croped_img
-
-        if(method_name == 'random_brightness'):
-            (start_of_range,end_of_range) = self.params_extract.extract_random_brightness_params(random_bright_dict=method_params_dict)
-            rand_brightened_img = self.img_augmentator.random_bright_image(current_img,brightness_range=(start_of_range,end_of_range))
-            return rand_brightened_img
-
-        if(method_name =='adjust_gamma'):
-            gamma = self.params_extract.extract_gamma_correction_params(gamma_dict=method_params_dict)
-            gamma_cor_img = self.img_augmentator.adjust_gamma(current_img,gamma=gamma)
-            return gamma_cor_img
-
-        if(method_name =='gaussian_blur'):
-            kernel = self.params_extract.extract_gaussian_blur_params(blur_dict=method_params_dict)
-            gauss_blur_img = self.img_augmentator.gaussian_blur(current_img,kernel=kernel)
-            return gauss_blur_img
-        
-        if(method_name =='contrast'):
-            contrast_factor = self.params_extract.extract_contrast_params(contrast_dict=method_params_dict)
-            contrasted_img = self.img_augmentator.contrast_image(current_img,contrast_factor=contrast_factor)
-            return contrasted_img
-        
+
+    def manifest_file_name(self):
+        # every shard of a sharded run records its outputs in a manifest of its own
+        return OutputManifest.FILE_NAME if self.work_shard is None else OutputManifest.shard_file_name(*self.work_shard)
+
+    def __getstate__(self):
+        # the tkinter root can't be sent to the worker processes and they don't need it
+        state = self.__dict__.copy()
+        state.pop('root', None)
+        state['progress'] = None # printed by the parent process
+        state['buffers'] = None # every worker pools its own buffers
+        return state
+
+    def image_rng(self,img_file_name,config_key):
+        """
+            Random generator of one (input image, config entry) pair, seeded from the global seed,
+            the image file name and the config key. The random methods get the same values no matter
+            which worker process handles the image or in which order the images are processed
+        """
+        return image_rng(self.seed,img_file_name,config_key)
+
+    def save_img(self,image,img_file_name,pipeline=None,metadata=None):
+        """
+            Encode a (BGR) image with the output codec and write it to the output directory, or
+            append it to the current shard when the output is packed, in the background when a
+            pipeline is given
+            Returns
+            -------
+                concurrent.futures.Future of the reference of the output: its file name, or
+                '<shard name>#<sample number>' for packed outputs
+        """
+        if pipeline is None:
+            pipeline = ImagePipeline(0,0)
+        extension = os.path.splitext(img_file_name)[1]
+        if self.dataset_writer is not None:
+            return pipeline.submit_write(self.dataset_writer.add,image,metadata,extension)
+        return pipeline.submit_write(self.write_img_file,image,img_file_name,extension)
+
+    def write_img_file(self,image,img_file_name,extension):
+        start = self.stats.start()
+        byte_count = ImagePipeline.write_image(image,os.path.join(self.output_dir_path,img_file_name),self.output_codec,extension)
+        self.stats.stop('write',start,byte_count)
+        return img_file_name
+
+    def read_img(self,img_file_name):
+        """
+            Decode an input image in OpenCV's native BGR order (no color conversion), at the working
+            resolution when there is a target size. None when the file can't be read as an image
+        """
+        return self.decoder.read(os.path.join(self.input_images_dir_path,img_file_name))
+
+    def read_input(self,img_file_name):
+        """
+            Find the entries still to apply to an input image and decode it when there is any
+            Returns
+            -------
+                (decoded image or None, entries to apply, (os.stat_result, content hash) of the input or None) tuple
+        """
+        start = self.stats.start()
+        input_data = self.load_input(img_file_name)
+        if self.stats.enabled:
+            input_record = input_data[2]
+            img_file_path = os.path.join(self.input_images_dir_path,img_file_name)
+            byte_count = input_record[0].st_size if input_record is not None else os.path.getsize(img_file_path) if os.path.isfile(img_file_path) else 0
+            self.stats.stop('read',start,byte_count)
+        return input_data
+
+    @staticmethod
+    def unit_shard(img_file_name,config_key,shard_count):
+        """
+            Shard of the (input file, config entry) work unit, from a hash of the file name and the config
+            key only: the split is the same whatever the order of the files and balanced on average
+        """
+        digest = hashlib.sha256('{}\0{}'.format(img_file_name,config_key).encode('utf8')).digest()
+        return int.from_bytes(digest[:8],'little') % shard_count
+
+    def assigned_entries(self,img_file_name):
+        """
+            Config entries this run applies to the given input file: all of them, or those of the work units of its shard
+        """
+        if self.work_shard is None:
+            return self.plan.entries
+        shard_index,shard_count = self.work_shard
+        return tuple(entry for entry in self.plan.entries if self.unit_shard(img_file_name,entry.key,shard_count) == shard_index)
+
+    def load_input(self,img_file_name):
+        img_file_path = os.path.join(self.input_images_dir_path,img_file_name)
+        entries = self.assigned_entries(img_file_name)
+        if not entries: # every unit of the file belongs to other shards, it isn't even read
+            return (None,entries,None)
+        if self.manifest is None or not os.path.isfile(img_file_path):
+            return (self.read_img(img_file_name),entries,None)
+        stat,content_hash,data = self.manifest.read_input(img_file_path)
+        if self.resume:
+            done_entry_hashes = self.manifest.done_entry_hashes(img_file_name,content_hash,self.entry_seeds)
+            entries = tuple(entry for entry in entries
+                            if any(output_key not in done_entry_hashes for output_key in self.entry_output_keys[entry.key]))
+        if not entries:
+            return (None,entries,(stat,content_hash))
+        if data is None:
+            current_img = self.read_img(img_file_name)
+        else: # the file was just read to hash it, decode the same bytes
+            current_img = self.decoder.decode(data)
+        return (current_img,entries,(stat,content_hash))
+
+    def entry_dag(self,entries,rng_factory):
+        """
+            Prefix tree of the samples of the given config entries for one image. It is built once
+            and reused, unless policies draw the ops of the samples for every image
+        """
+        plan = self.plan if len(entries) == len(self.plan.entries) else self.plan.select(tuple(entry.key for entry in entries))
+        if plan.has_policies:
+            return TransformDag(AugmentationPlan(plan.sample_entries(rng_factory)),memory_limit=self.intermediate_memory_limit)
+        if plan is self.plan:
+            return self.dag
+        entry_keys = tuple(entry.key for entry in entries)
+        if entry_keys not in self.entry_dags:
+            self.entry_dags[entry_keys] = TransformDag(AugmentationPlan(plan.sample_entries()),memory_limit=self.intermediate_memory_limit)
+        return self.entry_dags[entry_keys]
+
+    def output_count(self,entries):
+        return sum(len(self.entry_output_keys[entry.key]) for entry in entries)
+
+    @staticmethod
+    def output_name_stem(img_file_name):
+        # the whole name without its extension, 'a.v1.jpg' and 'a.v2.jpg' get different output names
+        return os.path.splitext(img_file_name)[0]
+
+    def check_output_names(self,img_file_names):
+        """
+            Raise OutputNameCollisionError when several image files of the list would write their outputs
+            under the same names, for example 'b.jpg' and 'b.jfif' both augmented as JPEG. Checked before
+            any image is augmented, so that no output (and no manifest row) is silently overwritten.
+            Packed outputs are referenced by shard and sample number, their names never collide
+        """
+        if self.shard_size is not None:
+            return
+        name_groups = {}
+        for img_file_name in img_file_names:
+            # normcase: names that only differ by case are the same file on Windows
+            output_name = os.path.normcase(self.output_name_stem(img_file_name)+self.output_codec.extension(img_file_name))
+            name_groups.setdefault(output_name,[]).append(img_file_name)
+        collisions = []
+        for group in name_groups.values():
+            if len(group) < 2:
+                continue
+            # files that are not images are skipped by the run, they write nothing
+            group = [img_file_name for img_file_name in group
+                     if cv2.haveImageReader(os.path.join(self.input_images_dir_path,img_file_name))]
+            if len(group) > 1:
+                collisions.append(', '.join(group))
+        if collisions:
+            raise OutputNameCollisionError('input files with the same output names, rename them: {}'.format('; '.join(collisions)))
+
+    def augment_decoded_image(self,current_img_file_name,input_data,pipeline=None,pending_records=None):
+        """
+            Apply the entries still to do to one decoded input image and save the results.
+            Output names are made of the image file name without its extension, the config key and the method names, so they
+            don't depend on the order in which the images are processed
+            Parameters
+            ----------
+                input_data : tuple
+                    as returned by read_input
+                pending_records : deque
+                    manifest records of the images whose outputs are being written
+            Returns
+            -------
+                (number of saved images, number of ops saved by sharing common steps between entries,
+                 number of outputs already done) tuple
+        """
+        current_img,entries,input_record = input_data
+        assigned_entries = self.assigned_entries(current_img_file_name)
+        if not assigned_entries:
+            print(current_img_file_name,'--- skipped, assigned to other shards')
+            return (0,0,0)
+        if not entries:
+            print(current_img_file_name,'--- skipped, already augmented')
+            return (0,0,self.output_count(assigned_entries))
+        if current_img is None: # not an image file
+            print(current_img_file_name,'--- skipped, can not be read as an image')
+            return (0,0,0)
+        img_name = self.output_name_stem(current_img_file_name)
+        extension = self.output_codec.extension(current_img_file_name)
+        outputs = []
+
+        def save_entry_img(entry,transformed_img):
+            sample_name = [] if entry.sample is None else ['s{}'.format(entry.sample)]
+            img_file_name = '_'.join(str(value) for value in [img_name, entry.key] + sample_name + entry.method_names)+extension
+            output_key = OutputManifest.sample_output_key(self.entry_hashes[entry.key],entry.sample)
+            seed = self.entry_seeds[output_key]
+            metadata = {'source': current_img_file_name, 'config_key': entry.key, 'sample': entry.sample, 'ops': entry.method_names, 'seed': seed}
+            outputs.append((output_key,seed,self.save_img(transformed_img,img_file_name,pipeline,metadata)))
+            print(current_img_file_name,'---',entry.key,*sample_name,entry.method_names)
+
+        # consecutive geometric ops of an entry are fused into a single warpAffine resample, consecutive
+        # photometric ops into as few lookup table passes as possible and the steps shared by several
+        # entries are computed once
+        # every sample of the entries is made from this single decoded image
+        rng_factory = lambda sample_key: self.image_rng(current_img_file_name,sample_key)
+        start = self.stats.start()
+        ops_saved = self.entry_dag(entries,rng_factory).run(current_img,rng_factory,save_entry_img,self.stats,self.buffers)
+        self.stats.stop('image',start)
+        if input_record is not None:
+            if pending_records is None:
+                pending_records = deque()
+            pending_records.append((current_img_file_name,input_record,outputs))
+            self.record_outputs(pending_records,wait=pipeline is None)
+        return (len(outputs),ops_saved,self.output_count(assigned_entries)-self.output_count(entries))
+
+    def record_outputs(self,pending_records,wait=True,skip_failed=False):
+        """
+            Add to the manifest the images whose outputs are all written, in order. With wait,
+            every pending image is recorded once its writes are done. With skip_failed (once an
+            error stopped the run and the pipeline is closed), the images with a failed or cancelled
+            write are left out instead of raising
+        """
+        while pending_records and (wait or all(future.done() for _,_,future in pending_records[0][2])):
+            img_file_name,(stat,content_hash),outputs = pending_records.popleft()
+            if skip_failed and not all(future.done() and not future.cancelled() and future.exception() is None
+                                       for _,_,future in outputs):
+                continue
+            # result raises the error of a failed write, its image is not recorded
+            self.manifest.record(img_file_name,stat,content_hash,[(entry_hash,seed,future.result()) for entry_hash,seed,future in outputs])
+
+    def augment_image_files(self,img_file_names):
+        """
+            Augment the given input images: the next images are decoded and the augmented ones encoded
+            on I/O threads while the current image is transformed, with at most queue_size images
+            waiting on each side. An image is recorded in the manifest once all its outputs are written
+            Returns
+            -------
+                (number of saved images, number of ops saved by sharing common steps between entries,
+                 number of outputs already done, RunStats of the call) tuple
+        """
+        saved_count,ops_saved,done_count = 0,0,0
+        pending_records = deque()
+        self.stats = RunStats(enabled=self.stats.enabled)
+        if(self.buffers is None and self.buffer_pool_limit):
+            self.buffers = BufferPool(self.buffer_pool_limit)
+        if self.shard_size is not None: # shards of this call only, several workers never append to the same shard
+            self.dataset_writer = PackedDatasetWriter(self.output_dir_path,self.output_codec,self.shard_size,self.raw_shards,self.stats)
+        completed = False
+        try:
+            with ImagePipeline(self.io_threads,self.io_threads,self.queue_size) as pipeline:
+                for current_img_file_name,input_data in pipeline.decoded(img_file_names,self.read_input):
+                    img_saved_count,img_ops_saved,img_done_count = self.augment_decoded_image(current_img_file_name,input_data,pipeline,pending_records)
+                    saved_count += img_saved_count
+                    ops_saved += img_ops_saved
+                    done_count += img_done_count
+                    if self.progress is not None:
+                        self.progress.update(1,img_saved_count)
+            completed = True
+        finally:
+            if self.dataset_writer is not None:
+                self.dataset_writer.close()
+                self.dataset_writer = None
+            # the pipeline waited for the writes. When an error stopped the run, the images whose
+            # writes all succeeded are still recorded, so the next run doesn't do them again
+            self.record_outputs(pending_records,skip_failed=not completed)
+        return (saved_count,ops_saved,done_count,self.stats)
+
+    def augment_image_file(self,current_img_file_name):
+        return self.augment_image_files([current_img_file_name])
+
     def augment_images(self):
-        img_file_names = os.listdir(self.input_images_dir_path)
-        for current_img_file_name in img_file_names: #iterate through input images
-            current_img_path = os.path.join(self.input_images_dir_path,current_img_file_name)
-            current_img = cv2.imread(current_img_path)
-            current_img = cv2.cvtColor(current_img, cv2.COLOR_BGR2RGB)
-            for _,aug_method_dict in self.aug_config_dict.items(): #iterate trough all the functions of the config file
-                if(len(aug_method_dict) == 1): #simple processing case
-                    print('----simple transform----')
-                    method_name,method_params_dict = list(aug_method_dict.items())[0] # get the only tuple (key-value pair) from the aug_method_dict
-                    name_content_list = [current_img_file_name.split('.')[0], method_name, self.img_count]
-                    transformed_img = self.apply_transform(current_img=current_img,method_name=method_name,method_params_dict=method_params_dict)
-                    self.save_img(transformed_img,name_content_list)
-                    
-                if(len(aug_method_dict)>1): # chain processing case
-                    print('----chain transform----')
-                    chain_processed_img = current_img
-                    methods_names = []
-                    name_content_list = [] 
-                    for method_name,method_params_dict in aug_method_dict.items(): #iterate through all the methods of each function                       
-                        chain_processed_img = self.apply_transform(current_img=chain_processed_img,method_name=method_name,method_params_dict=method_params_dict)
-                        methods_names.append(method_name)
-                    name_content_list.append(current_img_file_name.split('.')[0])
-                    name_content_list.extend([method_name for method_name in methods_names])
-                    name_content_list.append(self.img_count)
-                    self.save_img(chain_processed_img,name_content_list)
-                print(current_img_file_name,'---',aug_method_dict)              
+        """
+            Augment every image of the input directory. With more than one worker the images are
+            spread across a process pool, in contiguous chunks so that each worker keeps its I/O
+            pipeline busy; the results are the same for any number of workers
+        """
+        print('seed:',self.seed)
+        started = time.perf_counter()
+        img_file_names = sorted(os.listdir(self.input_images_dir_path))
+        self.check_output_names(img_file_names)
+        run_stats = RunStats(enabled=self.stats.enabled)
+        progress = ProgressLine(len(img_file_names),self.progress_interval) if self.progress_interval is not None else None
+        run_saved_count,done_count = 0,0
+        if(self.workers > 1):
+            from multiprocessing import Pool
+            chunk_size = max(len(img_file_names)//(self.workers*4),1)
+            chunks = [img_file_names[index:index+chunk_size] for index in range(0,len(img_file_names),chunk_size)]
+            # one OpenCV thread per worker process, the pool already keeps every core busy
+            with Pool(processes=self.workers,initializer=cv2.setNumThreads,initargs=(1,)) as pool:
+                # in order, so that the progress line knows the size of each finished chunk
+                for chunk,(saved_count,ops_saved,chunk_done_count,chunk_stats) in zip(chunks,pool.imap(self.augment_image_files,chunks)):
+                    run_saved_count += saved_count
+                    self.ops_saved += ops_saved
+                    done_count += chunk_done_count
+                    run_stats.merge(chunk_stats)
+                    if progress is not None:
+                        progress.update(len(chunk),saved_count)
+        else:
+            self.progress = progress
+            try:
+                run_saved_count,ops_saved,done_count,chunk_stats = self.augment_image_files(img_file_names)
+            finally:
+                self.progress = None
+            self.ops_saved += ops_saved
+            run_stats.merge(chunk_stats)
+        self.img_count += run_saved_count
+        print('ops saved by sharing common steps between entries:',self.ops_saved)
+        print('outputs already done in a previous run:',done_count)
+        if(self.prune):
+            output_keys = [output_key for entry_output_keys in self.entry_output_keys.values() for output_key in entry_output_keys]
+            deleted_count = self.manifest.prune(img_file_names,output_keys)
+            print('outputs of removed images or config entries deleted:',deleted_count)
+        if(self.stats_file_path is not None):
+            image_count = run_stats.stages.get('image',[0])[0]
+            run_stats.write_summary(self.stats_file_path,time.perf_counter()-started,image_count,run_saved_count)
+            print('run statistics:',self.stats_file_path)
+
+    def output_exists(self,output_path):
+        # packed outputs are '<shard name>#<sample number>' references
+        if '#' in output_path:
+            output_path = output_path.split('#')[0]+'.bin'
+        return os.path.isfile(os.path.join(self.output_dir_path,output_path))
+
+    def merge_shard_manifests(self,shard_count):
+        """
+            Check the manifests of the shards of a sharded run and merge them into the manifest of the
+            output directory, which then indexes the whole dataset (and lets later runs resume from it).
+            Every output of every work unit of the image files of the input directory has to be recorded
+            exactly once, by the shard the unit is assigned to, with the seed of this run, for the current
+            content of the input file, and has to exist
+            Returns
+            -------
+                list of the problems found, the manifests are merged only when there is none
+        """
+        problems = []
+        recorded = {} # (input name, output key) -> list of (shard index, output row)
+        input_rows = {} # input name -> (size, mtime_ns, content hash) recorded by the shards
+        for shard_index in range(shard_count):
+            file_name = OutputManifest.shard_file_name(shard_index,shard_count)
+            if not os.path.isfile(os.path.join(self.output_dir_path,file_name)):
+                problems.append('shard {}/{}: manifest {} not found'.format(shard_index,shard_count,file_name))
+                continue
+            shard_manifest = OutputManifest(self.output_dir_path,file_name)
+            shard_input_rows = shard_manifest.input_rows()
+            for row in shard_manifest.output_rows():
+                input_row = shard_input_rows.get(row[0])
+                if input_row is not None and input_row[2] == row[2]: # rows of a former content of the input are stale
+                    recorded.setdefault(row[:2],[]).append((shard_index,row))
+            shard_manifest.close()
+            for input_name,input_row in shard_input_rows.items():
+                if input_name in input_rows and input_rows[input_name][2] != input_row[2]:
+                    problems.append('{}: the shards read different contents of the file'.format(input_name))
+                input_rows[input_name] = input_row
+        merged_rows = []
+        for img_file_name in sorted(os.listdir(self.input_images_dir_path)):
+            img_file_path = os.path.join(self.input_images_dir_path,img_file_name)
+            if not os.path.isfile(img_file_path) or not cv2.haveImageReader(img_file_path): # never augmented
+                continue
+            stat = os.stat(img_file_path)
+            if img_file_name in input_rows and input_rows[img_file_name][:2] != (stat.st_size,stat.st_mtime_ns):
+                problems.append('{}: changed since it was augmented'.format(img_file_name))
+                continue
+            for entry in self.plan.entries:
+                unit_shard = self.unit_shard(img_file_name,entry.key,shard_count)
+                for output_key in self.entry_output_keys[entry.key]:
+                    # entry key, with the sample number of entries with several samples
+                    output_name = '{} {}{}'.format(img_file_name,entry.key,output_key[len(self.entry_hashes[entry.key]):])
+                    seed = OutputManifest.seed_value(self.entry_seeds[output_key])
+                    rows = [(shard_index,row) for shard_index,row in recorded.get((img_file_name,output_key),[]) if row[3] == seed]
+                    if not rows:
+                        problems.append('{}: missing, assigned to shard {}'.format(output_name,unit_shard))
+                    elif len(rows) > 1:
+                        problems.append('{}: duplicated by shards {}'.format(output_name,', '.join(str(shard_index) for shard_index,_ in rows)))
+                    elif rows[0][0] != unit_shard:
+                        problems.append('{}: recorded by shard {}, assigned to shard {}'.format(output_name,rows[0][0],unit_shard))
+                    elif not self.output_exists(rows[0][1][4]):
+                        problems.append('{}: output {} not found'.format(output_name,rows[0][1][4]))
+                    else:
+                        merged_rows.append(rows[0][1])
+        if not problems:
+            merged_input_names = {row[0] for row in merged_rows}
+            manifest = OutputManifest(self.output_dir_path)
+            manifest.merge({input_name: input_row for input_name,input_row in input_rows.items() if input_name in merged_input_names},merged_rows)
+            manifest.close()
+            print('outputs merged from {} shards:'.format(shard_count),len(merged_rows))
+        return problems
 
 # da = DataAugmentation(r'\configuration.json')
 if __name__ == '__main__':
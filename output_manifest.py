@@ -0,0 +1,184 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+
+class OutputManifest:
+    """
+        SQLite record of the augmented images of an output directory, so that an interrupted or
+        repeated run only does the work that is not done yet.
+
+        An output is done when the manifest has a row for its (input file, config entry) pair with
+        the same input content hash, entry hash and seed as the current run. Entries without random
+        methods are recorded without a seed, so their outputs are reused whatever the seed of the run.
+        Content hashes are cached by file size and modification time, so unchanged inputs are not read
+        again. Rows are only added once the output file is written, a crashed run loses no finished work.
+
+        Every shard of a sharded run records its work units in a manifest of its own (shard_file_name),
+        merge combines them into the manifest of the output directory
+    """
+    FILE_NAME = 'augmentation_manifest.sqlite'
+
+    def __init__(self, output_dir_path, file_name=FILE_NAME):
+        self.path = os.path.join(output_dir_path, file_name)
+        self.local = threading.local() # one connection per thread, sqlite connections can't be shared
+        with self.connection() as connection:
+            connection.execute('PRAGMA journal_mode=WAL') # readers don't block the writing worker processes
+            connection.execute('CREATE TABLE IF NOT EXISTS inputs (name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                               'content_hash TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS outputs (input_name TEXT, entry_hash TEXT, content_hash TEXT, '
+                               'seed TEXT, output_path TEXT, PRIMARY KEY (input_name, entry_hash))')
+
+    def __getstate__(self):
+        # worker processes open their own connections
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = sqlite3.connect(self.path, timeout=60)
+        return self.local.connection
+
+    @staticmethod
+    def shard_file_name(shard_index, shard_count):
+        return 'augmentation_manifest.shard-{}-of-{}.sqlite'.format(shard_index, shard_count)
+
+    @staticmethod
+    def entry_hash(entry, codec_settings=()):
+        """
+            Hash of everything that defines the outputs of a config entry: its key, its ops with their
+            parsed parameters, its samples and policy and the output encoding settings
+        """
+        definition = (entry.key, entry.ops, codec_settings)
+        if entry.samples != 1 or entry.policy is not None: # entries of a single sample keep their former hash
+            definition += (entry.samples, entry.policy, entry.policy_index)
+        return hashlib.sha256(repr(definition).encode('utf8')).hexdigest()[:32]
+
+    @staticmethod
+    def sample_output_key(entry_hash, sample):
+        """
+            Key of the output of one sample of an entry in the manifest
+        """
+        return entry_hash if sample is None else '{}#{}'.format(entry_hash, sample)
+
+    def read_input(self, input_path):
+        """
+            Content hash of an input file, read again only when its size or modification time changed
+            Returns
+            -------
+                (os.stat_result, content hash, file bytes or None when the cached hash was used) tuple
+        """
+        stat = os.stat(input_path)
+        row = self.connection().execute('SELECT size, mtime_ns, content_hash FROM inputs WHERE name = ?',
+                                        (os.path.basename(input_path),)).fetchone()
+        if row is not None and row[:2] == (stat.st_size, stat.st_mtime_ns):
+            return (stat, row[2], None)
+        with open(input_path, 'rb') as input_file:
+            data = input_file.read()
+        return (stat, hashlib.sha256(data).hexdigest(), data)
+
+    def done_entry_hashes(self, input_name, content_hash, entry_seeds):
+        """
+            Output keys (entry hashes, or sample output keys) already done for the given content of the input file
+            Parameters
+            ----------
+                entry_seeds : dict
+                    output key -> seed the entry is applied with in this run (None for entries without random methods)
+        """
+        rows = self.connection().execute('SELECT entry_hash, seed FROM outputs WHERE input_name = ? AND content_hash = ?',
+                                         (input_name, content_hash)).fetchall()
+        return {entry_hash for entry_hash, seed in rows
+                if entry_hash in entry_seeds and seed == self.seed_value(entry_seeds[entry_hash])}
+
+    @staticmethod
+    def seed_value(seed):
+        # seeds can be larger than sqlite integers, they are stored as text
+        return None if seed is None else str(seed)
+
+    def record(self, input_name, stat, content_hash, outputs):
+        """
+            Record the written outputs of an input file
+            Parameters
+            ----------
+                outputs : list of (entry hash, seed, output path relative to the output directory) tuples
+        """
+        with self.connection() as connection: # one transaction
+            connection.execute('INSERT OR REPLACE INTO inputs VALUES (?, ?, ?, ?)',
+                               (input_name, stat.st_size, stat.st_mtime_ns, content_hash))
+            connection.executemany('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?)',
+                                   [(input_name, entry_hash, content_hash, self.seed_value(seed), output_path)
+                                    for entry_hash, seed, output_path in outputs])
+
+    def prune(self, input_names, entry_hashes):
+        """
+            Delete the recorded outputs of the input files and config entries that are no longer part
+            of the run, along with their rows. Files still recorded for a current (input, entry) pair are kept.
+            Packed samples ('<shard name>#<sample number>' outputs) can't be deleted from their shard: once
+            their row is deleted they are dead, PackedDatasetReader no longer serves them, and the shards
+            left without any live sample are deleted
+            Returns
+            -------
+                number of deleted output files and dead packed samples
+        """
+        connection = self.connection()
+        connection.execute('CREATE TEMP TABLE IF NOT EXISTS wanted_inputs (name TEXT PRIMARY KEY)')
+        connection.execute('CREATE TEMP TABLE IF NOT EXISTS wanted_entries (entry_hash TEXT PRIMARY KEY)')
+        with connection:
+            connection.execute('DELETE FROM wanted_inputs')
+            connection.execute('DELETE FROM wanted_entries')
+            connection.executemany('INSERT OR IGNORE INTO wanted_inputs VALUES (?)', [(name,) for name in input_names])
+            connection.executemany('INSERT OR IGNORE INTO wanted_entries VALUES (?)', [(entry_hash,) for entry_hash in entry_hashes])
+            stale = 'input_name NOT IN wanted_inputs OR entry_hash NOT IN wanted_entries'
+            kept_paths = {path for (path,) in connection.execute('SELECT output_path FROM outputs WHERE NOT ({})'.format(stale))}
+            stale_paths = {path for (path,) in connection.execute('SELECT output_path FROM outputs WHERE {}'.format(stale))}
+            deleted_count = 0
+            for output_path in stale_paths - kept_paths:
+                if '#' in output_path: # packed sample
+                    deleted_count += 1
+                    continue
+                try:
+                    os.remove(os.path.join(os.path.dirname(self.path), output_path))
+                    deleted_count += 1
+                except FileNotFoundError:
+                    pass
+            kept_shard_names = {path.split('#')[0] for path in kept_paths if '#' in path}
+            for shard_name in {path.split('#')[0] for path in stale_paths if '#' in path} - kept_shard_names:
+                for extension in ('.bin', '.index.jsonl'):
+                    try:
+                        os.remove(os.path.join(os.path.dirname(self.path), shard_name + extension))
+                    except FileNotFoundError:
+                        pass
+            connection.execute('DELETE FROM outputs WHERE {}'.format(stale))
+            connection.execute('DELETE FROM inputs WHERE name NOT IN wanted_inputs')
+        return deleted_count
+
+    def input_rows(self):
+        """
+            input name -> (size, mtime_ns, content hash) of every recorded input file
+        """
+        return {name: (size, mtime_ns, content_hash) for name, size, mtime_ns, content_hash
+                in self.connection().execute('SELECT name, size, mtime_ns, content_hash FROM inputs')}
+
+    def output_rows(self):
+        """
+            (input name, entry hash, content hash, seed, output path) of every recorded output
+        """
+        return self.connection().execute('SELECT input_name, entry_hash, content_hash, seed, output_path FROM outputs').fetchall()
+
+    def merge(self, input_rows, output_rows):
+        """
+            Record the given rows, as returned by input_rows and output_rows of other manifests, in one transaction
+        """
+        with self.connection() as connection:
+            connection.executemany('INSERT OR REPLACE INTO inputs VALUES (?, ?, ?, ?)',
+                                   [(name,) + tuple(row) for name, row in input_rows.items()])
+            connection.executemany('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?)', output_rows)
+
+    def close(self):
+        if getattr(self.local, 'connection', None) is not None:
+            self.local.connection.close()
+            self.local.connection = None
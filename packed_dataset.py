@@ -0,0 +1,192 @@
+"""
+    Packed output layout: instead of one file per augmented image, samples are appended to
+    shard files of a fixed maximum size, each with an index of its samples:
+
+        shard-<run>-00000.bin           samples, one after the other, 64 byte aligned
+        shard-<run>-00000.index.jsonl   one JSON line per sample: offset, size, shape, encoding
+                                        and metadata (source file, config key, ops, seed)
+
+    Samples are either encoded images (as set by the OutputCodec) or raw uint8 arrays. A sample
+    is written and flushed before its index line, so a crashed run leaves readable shards.
+    PackedDatasetReader memory-maps the shards: raw samples are returned as read-only views of the
+    mapped file (no copy), encoded samples are decoded from it.
+
+    Shards are append only. When a run records its samples in the output manifest, the manifest says
+    which samples are live: a sample replaced by a later run, pruned, or written by a crashed run
+    before it was recorded stays in its shard but is no longer served by the reader
+"""
+import glob
+import json
+import os
+import threading
+import uuid
+import numpy as np
+from cv2 import cv2
+from output_manifest import OutputManifest
+from run_stats import DISABLED_STATS
+
+
+class PackedDatasetWriter:
+    ALIGNMENT = 64 # raw samples start on cache line boundaries
+
+    def __init__(self, output_dir_path, codec=None, shard_size=1024 * 1024 * 1024, raw=False, stats=DISABLED_STATS):
+        """
+            Parameters
+            ----------
+                output_dir_path : str
+                    directory of the shards
+                codec : OutputCodec
+                    encoding of the samples, not used for raw samples
+                shard_size : int
+                    maximum bytes of a shard, a sample larger than that gets a shard of its own
+                raw : bool
+                    store the uint8 arrays as they are instead of encoding them
+                stats : RunStats
+                    records the time and bytes of every added sample as the 'write' stage
+        """
+        if codec is None and not raw:
+            raise ValueError('encoded samples need a codec')
+        self.output_dir_path = output_dir_path
+        self.codec = codec
+        self.shard_size = shard_size
+        self.raw = raw
+        self.stats = stats
+        # shards of different runs and worker processes never collide
+        self.shard_prefix = 'shard-{}'.format(uuid.uuid4().hex[:12])
+        self.shard_count = 0
+        self.shard_name = None
+        self.sample_count = 0 # samples of the current shard
+        self.data_file = None
+        self.index_file = None
+        self.lock = threading.Lock() # samples are added by the encode threads of the pipeline
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open_shard(self):
+        self.close()
+        shard_name = '{}-{:05d}'.format(self.shard_prefix, self.shard_count)
+        self.shard_count += 1
+        self.data_file = open(os.path.join(self.output_dir_path, shard_name + '.bin'), 'wb')
+        self.index_file = open(os.path.join(self.output_dir_path, shard_name + '.index.jsonl'), 'w', encoding='utf8')
+        return shard_name
+
+    def add(self, image, metadata, extension='.png'):
+        """
+            Append one sample to the current shard, starting a new shard when it is full
+            Parameters
+            ----------
+                image : ndim np.array
+                    augmented (BGR) image
+                metadata : dict
+                    JSON serializable metadata of the sample
+                extension : str
+                    encoding of the sample (ignored for raw samples)
+            Returns
+            -------
+                reference of the sample: '<shard name>#<sample number in the shard>'
+        """
+        start = self.stats.start()
+        if self.raw:
+            data = np.ascontiguousarray(image)
+            record = {'encoding': 'raw', 'shape': list(data.shape), 'dtype': data.dtype.str}
+        else:
+            data = self.codec.encode(image, extension)
+            record = {'encoding': extension[1:]}
+        with self.lock:
+            offset = self.data_file.tell() if self.data_file is not None else 0
+            offset += -offset % self.ALIGNMENT
+            if self.data_file is None or (offset + data.nbytes > self.shard_size and offset > 0):
+                self.shard_name = self.open_shard()
+                self.sample_count, offset = 0, 0
+            self.data_file.seek(offset)
+            self.data_file.write(memoryview(data).cast('B'))
+            self.data_file.flush()
+            record.update(offset=offset, size=data.nbytes, metadata=metadata)
+            self.index_file.write(json.dumps(record) + '\n')
+            self.index_file.flush()
+            self.sample_count += 1
+            sample_reference = '{}#{}'.format(self.shard_name, self.sample_count - 1)
+        self.stats.stop('write', start, data.nbytes)
+        return sample_reference
+
+    def close(self):
+        for shard_file in (self.data_file, self.index_file):
+            if shard_file is not None:
+                shard_file.close()
+        self.data_file = self.index_file = None
+
+
+class PackedDatasetReader:
+    """
+        Random access to the live samples of the shards of a directory, in shard name order
+    """
+
+    def __init__(self, dir_path, manifest_file_name=OutputManifest.FILE_NAME):
+        """
+            Parameters
+            ----------
+                dir_path : str
+                    directory of the shards
+                manifest_file_name : str
+                    output manifest of the directory: only the samples it records are served. When it
+                    doesn't exist (or is None), every complete sample of every shard is served
+        """
+        self.shards = [] # memory maps, opened on first access
+        self.samples = [] # (shard number, index record)
+        self.shard_paths = []
+        live_references = self.live_references(dir_path, manifest_file_name)
+        for index_path in sorted(glob.glob(os.path.join(dir_path, 'shard-*.index.jsonl'))):
+            shard_name = os.path.basename(index_path)[:-len('.index.jsonl')]
+            with open(index_path, 'r', encoding='utf8') as index_file:
+                for sample_number, line in enumerate(index_file):
+                    if not line.endswith('\n'): # last line of a crashed run
+                        break
+                    if live_references is None or '{}#{}'.format(shard_name, sample_number) in live_references:
+                        self.samples.append((len(self.shard_paths), json.loads(line)))
+            self.shard_paths.append(os.path.join(dir_path, shard_name + '.bin'))
+            self.shards.append(None)
+
+    @staticmethod
+    def live_references(dir_path, manifest_file_name):
+        """
+            '<shard name>#<sample number>' references of the samples recorded in the manifest, None without manifest
+        """
+        if manifest_file_name is None or not os.path.isfile(os.path.join(dir_path, manifest_file_name)):
+            return None
+        manifest = OutputManifest(dir_path, manifest_file_name)
+        try:
+            return {row[4] for row in manifest.output_rows() if '#' in row[4]}
+        finally:
+            manifest.close()
+
+    def __len__(self):
+        return len(self.samples)
+
+    def shard(self, shard_number):
+        if self.shards[shard_number] is None:
+            self.shards[shard_number] = np.memmap(self.shard_paths[shard_number], dtype=np.uint8, mode='r')
+        return self.shards[shard_number]
+
+    def sample_bytes(self, sample_number):
+        """
+            Stored bytes of a sample, as a read-only view of the mapped shard
+        """
+        shard_number, record = self.samples[sample_number]
+        return self.shard(shard_number)[record['offset']:record['offset'] + record['size']]
+
+    def metadata(self, sample_number):
+        return self.samples[sample_number][1]['metadata']
+
+    def __getitem__(self, sample_number):
+        """
+            Image of a sample: a read-only view of the mapped shard for raw samples, decoded otherwise
+        """
+        record = self.samples[sample_number][1]
+        data = self.sample_bytes(sample_number)
+        if record['encoding'] == 'raw':
+            return data.view(np.dtype(record['dtype'])).reshape(record['shape'])
+        return cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
@@ -1,109 +1,149 @@
+class ConfigError(ValueError):
+    """
+        Raised when the configuration file has an invalid entry, method or parameter
+    """
+
+
 class ParamsExtractUtils:
+    # border fill modes of ImageAugmentation.shift_image and ImageAugmentation.shear_image
+    FILL_MODES = ('constant', 'edge', 'reflect', 'wrap')
+    # smallest zoom factor and crop range, smaller ones leave nothing meaningful of any image. The
+    # ops keep at least one pixel of the zoomed or cropped image, so images under 100 pixels work too
+    MIN_SCALE_FACTOR = 0.01
+
     def __init__(self):
-        pass 
-    
+        pass
+
+    def check_param_names(self,method_name,params_dict,required_names,optional_names=()):
+        """
+            check that the parameters of a method are an object with all the required parameters
+            and no unknown ones
+        """
+        if(type(params_dict) is not dict):
+            raise ConfigError("parameters of '{}' must be an object, got {!r}".format(method_name,params_dict))
+        unknown_names = [name for name in params_dict if name not in required_names and name not in optional_names]
+        if(unknown_names):
+            raise ConfigError("unknown parameter(s) {} for '{}', expected {}".format(
+                ', '.join(unknown_names),method_name,', '.join(tuple(required_names)+tuple(optional_names))))
+        missing_names = [name for name in required_names if name not in params_dict]
+        if(missing_names):
+            raise ConfigError("missing parameter(s) {} for '{}'".format(', '.join(missing_names),method_name))
+
+    def is_number(self,value):
+        # bool is a subclass of int but true/false are not valid numbers in a config file
+        return type(value) in (int,float)
+
+    def check_number(self,method_name,param_name,value,min_value=None,max_value=None,min_exclusive=False):
+        """
+            check that a parameter is a number (int or float) within the given bounds and return it
+        """
+        in_range = self.is_number(value) \
+            and (min_value is None or (value > min_value if min_exclusive else value >= min_value)) \
+            and (max_value is None or value <= max_value)
+        if(not in_range):
+            bounds = '{}{},{}'.format('(' if min_exclusive else '[',
+                                      '-inf' if min_value is None else min_value,
+                                      'inf)' if max_value is None else '{}]'.format(max_value))
+            raise ConfigError("'{}' of '{}' must be a number in {}, got {!r}".format(param_name,method_name,bounds,value))
+        return value
+
+    def check_fill_mode(self,method_name,params_dict):
+        fill_mode = params_dict.get('fill_mode','constant')
+        if(fill_mode not in self.FILL_MODES):
+            raise ConfigError("'fill_mode' of '{}' must be one of {}, got {!r}".format(method_name,', '.join(self.FILL_MODES),fill_mode))
+        return fill_mode
+
     def extract_rotation_params(self,rotation_params_dict):
         """
-            iterate through all the parameters of the method and extract the valid rotate parameters
+            extract the rotate parameters, the angle has to be in [-180,180] degrees
         """
-        angle = 0
-        for param_name, param_value in rotation_params_dict.items():
-            if(param_name == 'angle' and type(param_value) is int or type(param_value) is float):
-                angle = param_value
-        return angle
+        self.check_param_names('rotation',rotation_params_dict,('angle',))
+        return self.check_number('rotation','angle',rotation_params_dict['angle'],-180,180)
 
     def extract_flip_params(self,flip_params_dict):
         """
-            iterate through all the parameters of the method and extract the valid flip parameters
+            extract the flip parameters, the flip code has to be an integer
         """
-        flip_code = 0
-        for param_name, param_value in flip_params_dict.items(): 
-            if(param_name == 'flip_code' and type(param_value) is int):
-                flip_code = param_value
+        self.check_param_names('flip',flip_params_dict,('flip_code',))
+        flip_code = flip_params_dict['flip_code']
+        if(type(flip_code) is not int):
+            raise ConfigError("'flip_code' of 'flip' must be an integer, got {!r}".format(flip_code))
         return flip_code
 
     def extract_shear_params(self,shear_params_dict):
         """
-            iterate through all the parameters of the shear method and extract the valid parameters for shearing
+            extract the parameters for shearing, the shear angle is in radians
         """
-        shear_angle = 0
-        for param_name, param_value in shear_params_dict.items(): 
-            if(param_name == 'shear_angle' and type(param_value) is float):
-                shear_angle = param_value
-        return shear_angle
-    
+        self.check_param_names('shear',shear_params_dict,('shear_angle',),('fill_mode',))
+        shear_angle = self.check_number('shear','shear_angle',shear_params_dict['shear_angle'])
+        return (shear_angle,self.check_fill_mode('shear',shear_params_dict))
+
     def extract_zoom_params(self,zoom_params_dict):
         """
-            iterate through all the parameters of the zoom method and extract the valid parameters for zooming
+            extract the parameters for zooming, the zoom factor has to be at least MIN_SCALE_FACTOR
         """
-        zoom_factor = 0
-        for param_name, param_value in zoom_params_dict.items(): 
-            if(param_name == 'zoom_factor' and type(param_value) is float):
-                zoom_factor = param_value
-        return zoom_factor
+        self.check_param_names('zoom',zoom_params_dict,('zoom_factor',))
+        return self.check_number('zoom','zoom_factor',zoom_params_dict['zoom_factor'],self.MIN_SCALE_FACTOR)
+
+    def extract_shift_params(self,shift_params_dict):
+        """
+            extract the shift parameters. axis and shift_range are either single values or lists
+            with one shift range per axis; both are returned as tuples
+        """
+        self.check_param_names('shift',shift_params_dict,('axis','shift_range'),('fill_mode',))
+        axis, shift_range = shift_params_dict['axis'], shift_params_dict['shift_range']
+        axes = (axis,) if type(axis) is int else tuple(axis) if type(axis) is list else ()
+        if(not axes or len(set(axes)) != len(axes) or any(value not in (0,1) or type(value) is not int for value in axes)):
+            raise ConfigError("'axis' of 'shift' must be 0, 1 or a list of distinct axes, got {!r}".format(axis))
+        shift_ranges = tuple(shift_range) if type(shift_range) is list else (shift_range,)
+        if((type(axis) is list) != (type(shift_range) is list) or len(shift_ranges) != len(axes)):
+            raise ConfigError("'shift_range' of 'shift' must have one value per axis, got {!r} for axis {!r}".format(shift_range,axis))
+        for value in shift_ranges:
+            self.check_number('shift','shift_range',value,-1,1) # because it's a probability, negative values shift the other way
+        return (axes,shift_ranges,self.check_fill_mode('shift',shift_params_dict))
 
-    def extract_shift_params(self,shift_params_dict,img_shape_dim):
-        """
-            iterate through all the parameters of the shift method and extract the valid shift parameters
-        """
-        axis = 0
-        shift_range = 0
-        for param_name, param_value in shift_params_dict.items(): 
-            if(param_name == 'axis' and type(param_value) is int and param_value<img_shape_dim):
-                axis = param_value
-            if(param_name == 'shift_range' and type(param_value) is float and param_value<=1): # because it's a probability
-                shift_range = param_value
-        return (axis,shift_range)
-    
     def extract_random_crop_params(self,random_crop_params_dict):
         """
-            iterate through all the parameters of the cropping method and extract the valid crop parameters
+            extract the crop parameters, both ranges have to be in [MIN_SCALE_FACTOR,1]. A missing range means no crop along that axis
         """
-        height_range = 1 # no crop case
-        width_range = 1 # no crop case
-        for param_name, param_value in random_crop_params_dict.items(): 
-            if(param_name == 'height_range' and type(param_value) is float and param_value<=1):
-                height_range = param_value
-            if(param_name == 'width_range' and type(param_value) is float and param_value<=1): # because it's a probability
-                width_range = param_value
+        self.check_param_names('random_crop',random_crop_params_dict,(),('height_range','width_range'))
+        height_range = self.check_number('random_crop','height_range',random_crop_params_dict.get('height_range',1),self.MIN_SCALE_FACTOR,1)
+        width_range = self.check_number('random_crop','width_range',random_crop_params_dict.get('width_range',1),self.MIN_SCALE_FACTOR,1)
         return (height_range,width_range)
-    
+
     def extract_random_brightness_params(self,random_bright_dict):
         """
-            iterate through all the parameters of the cropping method and extract the valid pixel range parameters
+            extract the pixel range parameters, two integers in [-255,255] in increasing order
         """
-        for param_name, param_value in random_bright_dict.items():
-            if(param_name == 'brightness_range'):
-                if((type(param_value[0]) is int) and (type(param_value[1]) is int) and (param_value[0] < param_value[1])):
-                    return (param_value[0],param_value[1])    
-        return (0,0) # default: no range
-    
+        self.check_param_names('random_brightness',random_bright_dict,('brightness_range',))
+        brightness_range = random_bright_dict['brightness_range']
+        if(type(brightness_range) is not list or len(brightness_range) != 2
+                or any(type(value) is not int or not -255 <= value <= 255 for value in brightness_range)
+                or brightness_range[0] > brightness_range[1]):
+            raise ConfigError("'brightness_range' of 'random_brightness' must be [start, end] integers in [-255,255] "
+                              "with start <= end, got {!r}".format(brightness_range))
+        return (brightness_range[0],brightness_range[1])
+
     def extract_gamma_correction_params(self,gamma_dict):
         """
-            iterate through all the parameters of the given gamma correction config and extract the valid gamma params
+            extract the gamma correction parameters, gamma has to be in (0,2]
         """
-        gamma = 1.0 # no gamma correction
-        for param_name, param_value in gamma_dict.items():
-            if(param_name == 'gamma' and type(param_value) is float or type(param_value) is int):  
-                gamma = param_value
-        return gamma
-    
+        self.check_param_names('adjust_gamma',gamma_dict,('gamma',))
+        return self.check_number('adjust_gamma','gamma',gamma_dict['gamma'],0,2,min_exclusive=True)
+
     def extract_gaussian_blur_params(self,blur_dict):
         """
-            iterate through all the parameters of the given gaussian blur config and extract the valid gaussian blur params
+            extract the gaussian blur parameters, the kernel size has to be a positive odd integer (3 by default)
         """
-        kernel = (3,3) # default kernel size 
-        for param_name, param_value in blur_dict.items():
-            if(param_name == 'kernel_size' and type(param_value) is int and param_value%2==1):
-                kernel = (param_value,param_value)
-        return kernel
+        self.check_param_names('gaussian_blur',blur_dict,(),('kernel_size',))
+        kernel_size = blur_dict.get('kernel_size',3)
+        if(type(kernel_size) is not int or kernel_size < 1 or kernel_size%2 != 1):
+            raise ConfigError("'kernel_size' of 'gaussian_blur' must be a positive odd integer, got {!r}".format(kernel_size))
+        return (kernel_size,kernel_size)
 
     def extract_contrast_params(self,contrast_dict):
         """
-            iterate through all the parameters of the given contrast config and extract the valid construct params
+            extract the contrast parameters, the contrast factor can be any non negative number
         """
-        contrast_factor = 1.0 # 1 gives the original image => NO brightness
-        for param_name, param_value in contrast_dict.items():
-            if(param_name == 'contrast_factor' and type(param_value) is float and param_value > 0):  
-                contrast_factor = param_value
-        return contrast_factor
\ No newline at end of file
+        self.check_param_names('contrast',contrast_dict,('contrast_factor',))
+        return self.check_number('contrast','contrast_factor',contrast_dict['contrast_factor'],0)
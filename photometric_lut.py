@@ -0,0 +1,77 @@
+from cv2 import cv2
+
+
+class PhotometricLutCompiler:
+    """
+        Compiles consecutive photometric ops of a config entry into lookup tables.
+        Every run of per pixel value ops (gamma correction, contrast) is collapsed into a
+        single table applied with one cv2.LUT pass. Ops that can't be expressed as a table
+        (op.table() is None), like random brightness which depends on the value (max channel)
+        of each pixel rather than on a single channel value, stay a step of their own
+        between the collapsed tables
+    """
+
+    # compiled chains kept in the cache: policies draw new chains for every image, the oldest ones are dropped
+    CACHE_SIZE = 4096
+
+    def __init__(self):
+        self.compiled_chains = {} # ops -> list of compiled steps
+
+    def compile_chain(self, ops):
+        """
+            Compile a run of photometric ops into steps, once per config entry
+            Parameters
+            ----------
+                ops : tuple of photometric AugmentationOp
+                    ops in the order they have to be applied
+            Returns
+            -------
+                list of ('lut', table) and ('op', op) tuples
+        """
+        if ops not in self.compiled_chains:
+            steps = []
+            table = None
+            for op in ops:
+                op_table = op.table()
+                if op_table is None:
+                    if table is not None:
+                        steps.append(('lut', table))
+                        table = None
+                    steps.append(('op', op))
+                else:
+                    # applying table A then table B to a pixel value means B[A]
+                    table = op_table if table is None else op_table[table]
+            if table is not None:
+                steps.append(('lut', table))
+            if len(self.compiled_chains) >= self.CACHE_SIZE:
+                del self.compiled_chains[next(iter(self.compiled_chains))]
+            self.compiled_chains[ops] = steps
+        return self.compiled_chains[ops]
+
+    def apply_chain(self, image, ops, rng=None, out=None):
+        """
+            Apply a run of photometric ops to the given image
+            Parameters
+            ----------
+                image : ndim np.array
+                    image to be transformed
+                ops : tuple of photometric AugmentationOp
+                    ops in the order they have to be applied
+                rng : np.random.Generator
+                    generator the random ops draw their values from
+                out : ndim np.array
+                    buffer of the shape and dtype of the image the first step writes into
+            Returns
+            -------
+                transformed image as np.array
+        """
+        owned = False # whether image is a result of the chain, that the next tables can map in place
+        for step, value in self.compile_chain(ops):
+            if(step == 'lut'):
+                image = cv2.LUT(image, value, dst=image if owned else out)
+            elif not owned and value.writes_out:
+                image = value.apply(image, rng=rng, out=out)
+            else:
+                image = value.apply(image, rng=rng)
+            owned = True
+        return image
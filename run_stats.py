@@ -0,0 +1,139 @@
+import json
+import sys
+import threading
+import time
+
+HISTOGRAM_BUCKETS = 32 # bucket i counts the durations in [2^(i-1), 2^i) microseconds, the last one everything longer
+
+
+class RunStats:
+    """
+        Wall time, latency histogram and bytes of the stages of a run:
+
+            read               reading and decoding an input image (bytes: input file size)
+            op:<name>          one step of a plan, fused chains are named after their methods ('rotation+flip')
+            entry:<key>        all the steps of a config entry, shared steps counted for every entry using them
+            image              all the entries of one input image
+            write              encoding and writing one output (bytes: encoded size)
+
+        A disabled instance only costs an attribute check per call, so the instrumentation can stay in
+        the code paths. Stages are recorded from several threads; per worker process stats are merged
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = {} # name -> [count, seconds, bytes, histogram]
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def start(self):
+        return time.perf_counter() if self.enabled else 0.0
+
+    def stop(self, stage_name, start, byte_count=0):
+        """
+            Record the time since start (as returned by start()) for the given stage
+            Returns
+            -------
+                recorded seconds, 0 when disabled
+        """
+        if not self.enabled:
+            return 0.0
+        seconds = time.perf_counter() - start
+        self.add(stage_name, seconds, byte_count)
+        return seconds
+
+    def add(self, stage_name, seconds, byte_count=0, count=1):
+        if not self.enabled:
+            return
+        bucket = min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)
+        with self.lock:
+            stage = self.stages.get(stage_name)
+            if stage is None:
+                stage = self.stages[stage_name] = [0, 0.0, 0, [0] * HISTOGRAM_BUCKETS]
+            stage[0] += count
+            stage[1] += seconds
+            stage[2] += byte_count
+            stage[3][bucket] += count
+
+    def merge(self, other):
+        """
+            Add the stages of other RunStats, for example of a worker process
+        """
+        with self.lock:
+            for stage_name, (count, seconds, byte_count, histogram) in other.stages.items():
+                stage = self.stages.setdefault(stage_name, [0, 0.0, 0, [0] * HISTOGRAM_BUCKETS])
+                stage[0] += count
+                stage[1] += seconds
+                stage[2] += byte_count
+                stage[3] = [total + value for total, value in zip(stage[3], histogram)]
+
+    @staticmethod
+    def percentile_ms(histogram, fraction):
+        # upper bound of the histogram bucket holding the percentile
+        rank = fraction * sum(histogram)
+        running_count = 0
+        for bucket, bucket_count in enumerate(histogram):
+            running_count += bucket_count
+            if running_count >= rank:
+                return (2 ** bucket) / 1000
+        return (2 ** (len(histogram) - 1)) / 1000
+
+    def summary(self, wall_seconds, image_count, output_count):
+        """
+            JSON serializable summary of the run
+        """
+        stages = {}
+        for stage_name, (count, seconds, byte_count, histogram) in sorted(self.stages.items()):
+            last_bucket = max((bucket for bucket, bucket_count in enumerate(histogram) if bucket_count), default=0)
+            stages[stage_name] = {
+                'count': count, 'total_seconds': seconds, 'mean_ms': seconds * 1000 / count if count else 0.0,
+                'p50_ms': self.percentile_ms(histogram, 0.5), 'p90_ms': self.percentile_ms(histogram, 0.9),
+                'p99_ms': self.percentile_ms(histogram, 0.99), 'bytes': byte_count,
+                # '<N': number of durations under N microseconds (and over the previous bound)
+                'histogram_us': {'<{}'.format(2 ** bucket): histogram[bucket] for bucket in range(last_bucket + 1)}}
+        return {
+            'wall_seconds': wall_seconds, 'images': image_count, 'outputs': output_count,
+            'images_per_second': image_count / wall_seconds if wall_seconds else 0.0,
+            'outputs_per_second': output_count / wall_seconds if wall_seconds else 0.0,
+            'bytes_read': self.stages.get('read', (0, 0.0, 0))[2],
+            'bytes_written': self.stages.get('write', (0, 0.0, 0))[2],
+            'stages': stages}
+
+    def write_summary(self, file_path, wall_seconds, image_count, output_count):
+        with open(file_path, 'w', encoding='utf8') as summary_file:
+            json.dump(self.summary(wall_seconds, image_count, output_count), summary_file, indent=2)
+
+
+DISABLED_STATS = RunStats() # default of the instrumented functions, never records anything
+
+
+class ProgressLine:
+    """
+        Prints the progress of a run on stderr, at most once every interval seconds
+    """
+
+    def __init__(self, total_file_count, interval=10.0):
+        self.total_file_count = total_file_count
+        self.interval = interval
+        self.file_count = 0
+        self.output_count = 0
+        self.started = self.last_printed = time.perf_counter()
+
+    def update(self, file_count, output_count):
+        self.file_count += file_count
+        self.output_count += output_count
+        now = time.perf_counter()
+        if now - self.last_printed >= self.interval or self.file_count == self.total_file_count:
+            self.last_printed = now
+            files_per_second = self.file_count / (now - self.started)
+            eta = (self.total_file_count - self.file_count) / files_per_second if files_per_second else float('inf')
+            print('progress: {}/{} images, {} outputs, {:.1f} images/s, eta {:.0f} s'.format(
+                self.file_count, self.total_file_count, self.output_count, files_per_second, eta), file=sys.stderr)
@@ -0,0 +1,97 @@
+"""
+    Compiling config files into plans: invalid configs raise ConfigError when they are loaded,
+    before any image is processed, and rand_augment policies draw the ops of every image from
+    the generator of that image only
+"""
+import pytest
+from augmentation_plan import AugmentationPlan, image_rng
+from params_extract_utils import ConfigError
+
+INVALID_CONFIGS = [
+    ([], 'config must be an object'),
+    ({'a': {}}, 'must be a non empty object of methods'),
+    ({'a': {'blur': {}}}, "unknown method 'blur'"),
+    ({'a': {'rotation': {'angle': 30, 'center': 0}}}, 'unknown parameter'),
+    ({'a': {'rotation': {}}}, 'missing parameter'),
+    ({'a': {'rotation': {'angle': '30'}}}, "'angle' of 'rotation' must be a number"),
+    ({'a': {'rotation': {'angle': 200}}}, "'angle' of 'rotation' must be a number in \\[-180,180\\]"),
+    ({'a': {'flip': {'flip_code': 1.0}}}, "'flip_code' of 'flip' must be an integer"),
+    ({'a': {'zoom': {'zoom_factor': 0}}}, "'zoom_factor' of 'zoom' must be a number in \\[0.01,inf\\)"),
+    ({'a': {'zoom': {'zoom_factor': 0.001}}}, "'zoom_factor' of 'zoom'"),
+    ({'a': {'random_crop': {'height_range': 0.001}}}, "'height_range' of 'random_crop' must be a number in \\[0.01,1\\]"),
+    ({'a': {'random_crop': {'width_range': 1.5}}}, "'width_range' of 'random_crop'"),
+    ({'a': {'shift': {'axis': 2, 'shift_range': 0.1}}}, "'axis' of 'shift'"),
+    ({'a': {'shift': {'axis': [0, 1], 'shift_range': 0.1}}}, "'shift_range' of 'shift' must have one value per axis"),
+    ({'a': {'shift': {'axis': 0, 'shift_range': 0.1, 'fill_mode': 'mirror'}}}, "'fill_mode' of 'shift'"),
+    ({'a': {'random_brightness': {'brightness_range': [50, 10]}}}, "'brightness_range' of 'random_brightness'"),
+    ({'a': {'adjust_gamma': {'gamma': 3}}}, "'gamma' of 'adjust_gamma'"),
+    ({'a': {'gaussian_blur': {'kernel_size': 4}}}, "'kernel_size' of 'gaussian_blur' must be a positive odd integer"),
+    ({'a': {'contrast': {'contrast_factor': -1}}}, "'contrast_factor' of 'contrast'"),
+    ({'a': {'flip': {'flip_code': 1}, 'samples': 0}}, "'samples' must be a positive integer"),
+    ({'a': {'samples': 2}}, 'needs at least one method'),
+    ({'a': {'rand_augment': {'num_ops': 3, 'ops': {'flip': {'flip_code': 1}}}}}, "'num_ops' of 'rand_augment'"),
+    ({'a': {'rand_augment': {'num_ops': 1, 'ops': {'rotation': {'angle': [30, -30]}}}}}, 'must be \\[low, high\\] with low <= high'),
+    ({'a': {'rand_augment': {'num_ops': 1, 'ops': {'zoom': {'zoom_factor': [0.001, 2]}}}}}, "'zoom_factor' of 'zoom'"),
+]
+
+
+@pytest.mark.parametrize('config,message', INVALID_CONFIGS)
+def test_invalid_config_raises_config_error(config, message):
+    with pytest.raises(ConfigError, match=message):
+        AugmentationPlan.from_config(config)
+
+
+def test_errors_name_the_entry_at_fault():
+    with pytest.raises(ConfigError, match="^entry 'second': "):
+        AugmentationPlan.from_config({'first': {'flip': {'flip_code': 1}}, 'second': {'zoom': {'zoom_factor': -1}}})
+
+
+POLICY_CONFIG = {
+    'policy': {
+        'zoom': {'zoom_factor': 1.1},
+        'rand_augment': {'num_ops': 2, 'ops': {'rotation': {'angle': [-30, 30]}, 'adjust_gamma': {'gamma': [0.5, 1.5]},
+                                                'flip': {'flip_code': 1}, 'contrast': {'contrast_factor': [0.5, 1.5]}}},
+        'gaussian_blur': {'kernel_size': 3},
+        'samples': 8,
+    },
+    'samples': {'rotation': {'angle': 10}, 'samples': 3},
+    'single': {'flip': {'flip_code': 0}},
+}
+
+
+def drawn_ops(source_id, seed=3):
+    plan = AugmentationPlan.from_config(POLICY_CONFIG)
+    return [entry.ops for entry in plan.sample_entries(lambda sample_key: image_rng(seed, source_id, sample_key))]
+
+
+def test_policy_draws_the_same_ops_for_the_same_seed_and_image():
+    assert drawn_ops('a.png') == drawn_ops('a.png')
+    assert drawn_ops('a.png') != drawn_ops('a.png', seed=4)
+
+
+def test_policy_draws_other_ops_for_other_images():
+    policy_ops = {source_id: drawn_ops(source_id)[:8] for source_id in ('a.png', 'b.png', 'c.png')}
+    assert len({tuple(ops) for ops in policy_ops.values()}) == 3
+    # the entries without a policy are the same for every image
+    assert len({tuple(ops[8:]) for ops in map(drawn_ops, ('a.png', 'b.png', 'c.png'))}) == 1
+
+
+def test_policy_samples_apply_num_ops_distinct_ops_in_place_of_the_policy():
+    magnitude_ranges = {'rotation': (-30, 30), 'adjust_gamma': (0.5, 1.5), 'contrast': (0.5, 1.5)}
+    for ops in drawn_ops('a.png')[:8]:
+        method_names = [op.method_name for op in ops]
+        assert method_names[0] == 'zoom' and method_names[-1] == 'gaussian_blur'
+        assert len(set(method_names[1:3])) == 2
+        for op in ops[1:3]:
+            if op.method_name in magnitude_ranges:
+                low, high = magnitude_ranges[op.method_name]
+                assert low <= getattr(op, op.magnitude_param) <= high
+
+
+def test_sample_keys():
+    plan = AugmentationPlan.from_config(POLICY_CONFIG)
+    sample_entries = plan.sample_entries(lambda sample_key: image_rng(3, 'a.png', sample_key))
+    assert [entry.sample_key for entry in sample_entries] == (['policy#{}'.format(sample) for sample in range(8)]
+                                                               + ['samples#0', 'samples#1', 'samples#2', 'single'])
+    assert [entry.sample for entry in sample_entries] == list(range(8)) + [0, 1, 2, None]
+    assert all(entry.key == entry.sample_key.split('#')[0] for entry in sample_entries)
@@ -0,0 +1,83 @@
+"""
+    Streamed augmentation: the first epoch yields the images a run writes to disk, a stream with the
+    same seed repeats itself, and the images held by the consumer are never overwritten
+"""
+import json
+import os
+import numpy as np
+import pytest
+from cv2 import cv2
+from augmentation_stream import AugmentationStream
+from main import DataAugmentation
+
+CONFIG = {
+    'flip': {'flip': {'flip_code': 1}},
+    'bright': {'zoom': {'zoom_factor': 1.2}, 'random_brightness': {'brightness_range': [-30, 30]}},
+    'rotations': {'rotation': {'angle': 20}, 'samples': 2},
+}
+IMAGE_NAMES = ['a.png', 'b.png', 'c.png', 'd.png', 'e.png', 'f.png']
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    input_dir_path = tmp_path / 'input'
+    input_dir_path.mkdir()
+    rng = np.random.default_rng(0)
+    for img_file_name in IMAGE_NAMES:
+        cv2.imwrite(str(input_dir_path / img_file_name), rng.integers(0, 256, (48, 64, 3), dtype=np.uint8))
+    return [str(input_dir_path / img_file_name) for img_file_name in IMAGE_NAMES]
+
+
+def test_first_epoch_yields_the_images_of_a_run(tmp_path, image_paths):
+    config_file_path = tmp_path / 'config.json'
+    config_file_path.write_text(json.dumps(CONFIG))
+    output_dir_path = tmp_path / 'output'
+    DataAugmentation(str(config_file_path), os.path.dirname(image_paths[0]), str(output_dir_path), seed=3).augment_images()
+    output_names = {'flip': 'flip_flip', 'bright': 'bright_zoom_random_brightness',
+                    'rotations#0': 'rotations_s0_rotation', 'rotations#1': 'rotations_s1_rotation'}
+    streamed = list(AugmentationStream(CONFIG, image_paths, seed=3))
+    assert len(streamed) == len(IMAGE_NAMES) * len(output_names)
+    for source_id, config_key, image in streamed:
+        output_path = output_dir_path / '{}_{}.png'.format(os.path.splitext(source_id)[0], output_names[config_key])
+        assert np.array_equal(image, cv2.imread(str(output_path))), output_path
+
+
+def test_stream_with_the_same_seed_repeats_itself(image_paths):
+    def streamed(seed):
+        return list(AugmentationStream(CONFIG, image_paths, seed=seed, epochs=3, shuffle=True))
+    first, second = streamed(3), streamed(3)
+    assert [item[:2] for item in first] == [item[:2] for item in second]
+    assert all(np.array_equal(first_item[2], second_item[2]) for first_item, second_item in zip(first, second))
+    # every epoch visits the sources in a new order, and draws new random values
+    per_epoch = len(first) // 3
+    orders = [[source_id for source_id, config_key, _ in first[epoch * per_epoch:(epoch + 1) * per_epoch] if config_key == 'flip']
+              for epoch in range(3)]
+    assert all(sorted(order) == IMAGE_NAMES for order in orders)
+    assert len({tuple(order) for order in orders}) == 3
+    bright_images = {}
+    for source_id, config_key, image in first:
+        if config_key == 'bright':
+            bright_images.setdefault(source_id, []).append(image)
+    assert all(not np.array_equal(images[0], images[1]) for images in bright_images.values())
+    assert [item[:2] for item in streamed(4)] != [item[:2] for item in first]
+
+
+@pytest.mark.parametrize('epochs', [1, None])
+def test_stream_stops_after_an_epoch_without_images(tmp_path, capsys, epochs):
+    (tmp_path / 'text.png').write_text('not an image')
+    (tmp_path / 'directory.png').mkdir()
+    sources = [str(tmp_path / 'text.png'), str(tmp_path / 'directory.png')]
+    assert list(AugmentationStream(CONFIG, sources, seed=3, epochs=epochs)) == []
+    assert list(AugmentationStream(CONFIG, [], seed=3, epochs=epochs)) == []
+    if epochs is None:
+        assert 'stream stopped' in capsys.readouterr().err
+
+
+def test_held_images_are_not_overwritten(image_paths):
+    sources = [cv2.imread(image_path) for image_path in image_paths]
+    # the buffers of one input are enough for all of its outputs, the pool reuses them from input to input
+    stream = AugmentationStream(CONFIG, sources, seed=3, epochs=2, buffer_pool_limit=1024 * 1024)
+    held = [(image, image.copy()) for _, _, image in stream]
+    assert all(np.array_equal(image, copy) for image, copy in held)
+    unheld = [image.copy() for _, _, image in AugmentationStream(CONFIG, sources, seed=3, epochs=2, buffer_pool_limit=1024 * 1024)]
+    assert all(np.array_equal(image, copy) for (image, _), copy in zip(held, unheld))
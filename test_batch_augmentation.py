@@ -0,0 +1,92 @@
+"""
+    Every BatchAugmentation method gives, bit for bit, the batch of the ImageAugmentation method
+    applied to each sample with its own parameters
+"""
+import glob
+import os
+import numpy as np
+import pytest
+from cv2 import cv2
+from batch_augmentation import BatchAugmentation
+from image_augmentation import ImageAugmentation
+
+IMAGES_DIR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+batch_augmentator = BatchAugmentation()
+img_augmentator = ImageAugmentation()
+
+
+@pytest.fixture(scope='module', params=['bgr', 'gray'])
+def batch(request):
+    images = [cv2.imread(path) for path in sorted(glob.glob(os.path.join(IMAGES_DIR_PATH, '*')))]
+    images = [cv2.resize(image, (96, 72), interpolation=cv2.INTER_AREA) for image in images if image is not None][:5]
+    if request.param == 'gray':
+        images = [cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)[..., None] for image in images]
+    return np.stack(images)
+
+
+def single_batch(batch, method, *sample_params):
+    """
+        Batch of the single image method applied to every sample with its own parameters
+    """
+    results = []
+    for sample, params in zip(batch, zip(*sample_params) if sample_params else [()] * len(batch)):
+        image = sample if sample.shape[2] > 1 else sample[..., 0] # single image methods take 2 dimensional grayscale images
+        results.append(method(image, *params).reshape(sample.shape[:2] + (-1,)))
+    return np.stack(results)
+
+
+def test_flip(batch):
+    flip_codes = [-1, 0, 1, 1, 0]
+    assert np.array_equal(batch_augmentator.flip_batch(batch, flip_codes), single_batch(batch, img_augmentator.flip_image, flip_codes))
+
+
+def test_rotation(batch):
+    angles = [0.0, 15.0, -30.0, 90.0, 170.0]
+    assert np.array_equal(batch_augmentator.rotate_batch(batch, angles), single_batch(batch, img_augmentator.rotate_image, angles))
+
+
+@pytest.mark.parametrize('fill_mode', ['constant', 'edge', 'reflect', 'wrap'])
+def test_shear(batch, fill_mode):
+    shear_angles = [0.0, 0.2, -0.3, 0.5, -0.1]
+    expected = single_batch(batch, lambda image, angle: img_augmentator.shear_image(image, angle, fill_mode, 128), shear_angles)
+    assert np.array_equal(batch_augmentator.shear_batch(batch, shear_angles, fill_mode, 128), expected)
+
+
+def test_zoom(batch):
+    zoom_factors = [1.0, 1.3, 0.7, 2.0, 0.5]
+    assert np.array_equal(batch_augmentator.zoom_batch(batch, zoom_factors), single_batch(batch, img_augmentator.clipped_zoom_image, zoom_factors))
+
+
+@pytest.mark.parametrize('fill_mode', ['constant', 'edge', 'reflect', 'wrap'])
+@pytest.mark.parametrize('axis', [0, 1, (0, 1)])
+def test_shift(batch, axis, fill_mode):
+    shift_ranges = [0.0, 0.2, -0.3, 0.5, -0.05]
+    if axis == (0, 1):
+        shift_ranges = [(value, -value / 2) for value in shift_ranges]
+    expected = single_batch(batch, lambda image, shift_range: img_augmentator.shift_image(image, axis, shift_range, fill_mode, 128), shift_ranges)
+    assert np.array_equal(batch_augmentator.shift_batch(batch, axis, shift_ranges, fill_mode, 128), expected)
+
+
+def test_random_crop_windows(batch):
+    # the crop positions are drawn at once for the batch, the windows are the single image crops at these positions
+    ys, xs, height, width = np.array([0, 5, 10, 20, 36]), np.array([48, 0, 7, 13, 1]), 36, 48
+    expected = np.stack([sample[y:y + height, x:x + width] for sample, y, x in zip(batch, ys, xs)])
+    assert np.array_equal(batch_augmentator.window_batch(batch, ys, xs, height, width), expected)
+    cropped = batch_augmentator.random_crop_batch(batch, 0.5, 0.5, rng=np.random.default_rng(0))
+    assert cropped.shape == (len(batch), 36, 48, batch.shape[3])
+
+
+def test_brightness(batch):
+    brightness_values = [0, 40, -40, 255, -255]
+    expected = single_batch(batch, lambda image, value: img_augmentator.bright_image(image, value, channel_order='BGR'), brightness_values)
+    assert np.array_equal(batch_augmentator.bright_batch(batch, brightness_values), expected)
+
+
+def test_gamma(batch):
+    gammas = [0.5, 1.0, 1.5, 2.0, 0.8]
+    assert np.array_equal(batch_augmentator.adjust_gamma_batch(batch, gammas), single_batch(batch, img_augmentator.adjust_gamma, gammas))
+
+
+def test_contrast(batch):
+    contrast_factors = [0.0, 0.7, 1.0, 1.3, 2.5]
+    assert np.array_equal(batch_augmentator.contrast_batch(batch, contrast_factors), single_batch(batch, img_augmentator.contrast_image, contrast_factors))
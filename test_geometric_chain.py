@@ -0,0 +1,63 @@
+"""
+    Fused chains against their methods applied one after another. A fused geometric chain resamples
+    the image once where the methods resample it once each, so the two differ by the interpolation
+    blur the single resample avoids and along the rasterized borders of the blanked pixels: on
+    average by at most 4 intensity levels, with at least 85% of the pixel values within 8 levels.
+    Fused photometric chains are exact
+"""
+import glob
+import os
+import numpy as np
+import pytest
+from cv2 import cv2
+from augmentation_plan import AugmentationPlan
+
+IMAGES_DIR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+MEAN_TOLERANCE = 4
+PIXEL_TOLERANCE, PIXEL_FRACTION = 8, 0.85
+
+GEOMETRIC_CHAINS = {
+    'all': {'rotation': {'angle': 30}, 'shear': {'shear_angle': 0.2}, 'zoom': {'zoom_factor': 1.2},
+            'flip': {'flip_code': 1}, 'shift': {'axis': 1, 'shift_range': 0.1}},
+    'rotation_zoom_out': {'rotation': {'angle': 15}, 'zoom': {'zoom_factor': 0.8}},
+    'zoom_two_axis_shift': {'zoom': {'zoom_factor': 1.5}, 'shift': {'axis': [0, 1], 'shift_range': [0.1, -0.2]}},
+    'flip_rotation': {'flip': {'flip_code': 0}, 'rotation': {'angle': -45}},
+}
+PHOTOMETRIC_CHAINS = {
+    'gamma_contrast': {'adjust_gamma': {'gamma': 1.4}, 'contrast': {'contrast_factor': 1.3}},
+    'contrast_gamma': {'contrast': {'contrast_factor': 0.7}, 'adjust_gamma': {'gamma': 0.6}},
+}
+
+
+@pytest.fixture(scope='module')
+def images():
+    images = [cv2.imread(path) for path in sorted(glob.glob(os.path.join(IMAGES_DIR_PATH, '*')))]
+    return [image for image in images if image is not None]
+
+
+def fused_and_sequential(entry, image):
+    sequential = image
+    for op in entry.ops:
+        sequential = op.apply(sequential)
+    return entry.apply(image), sequential
+
+
+@pytest.mark.parametrize('key', sorted(GEOMETRIC_CHAINS))
+def test_fused_geometric_chain_within_tolerance(images, key):
+    entry, = AugmentationPlan.from_config({key: GEOMETRIC_CHAINS[key]}).entries
+    assert len(entry.steps) == 1 # the whole chain is a single resample
+    for image in images:
+        fused, sequential = fused_and_sequential(entry, image)
+        assert fused.shape == sequential.shape
+        difference = np.abs(fused.astype(np.int16) - sequential)
+        assert difference.mean() <= MEAN_TOLERANCE
+        assert (difference <= PIXEL_TOLERANCE).mean() >= PIXEL_FRACTION
+
+
+@pytest.mark.parametrize('key', sorted(PHOTOMETRIC_CHAINS))
+def test_fused_photometric_chain_is_exact(images, key):
+    entry, = AugmentationPlan.from_config({key: PHOTOMETRIC_CHAINS[key]}).entries
+    assert len(entry.steps) == 1
+    for image in images:
+        fused, sequential = fused_and_sequential(entry, image)
+        assert np.array_equal(fused, sequential)
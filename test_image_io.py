@@ -0,0 +1,83 @@
+"""
+    Decoding at a working resolution: the size read from the JPEG headers picks the reduced libjpeg
+    decode, and entries that can't be read as images are skipped as without a target size
+"""
+import json
+import os
+import numpy as np
+import pytest
+from cv2 import cv2
+from image_io import ImageDecoder
+from main import DataAugmentation
+
+# (height, width) of the generated JPEGs
+JPEG_SIZE = (480, 640)
+
+
+def jpeg_bytes(progressive=False):
+    image = cv2.resize(np.random.default_rng(0).integers(0, 256, (12, 16, 3), dtype=np.uint8), JPEG_SIZE[::-1])
+    is_encoded, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive)])
+    assert is_encoded
+    return buffer.tobytes()
+
+
+def with_exif(data):
+    # APP1 segment right after SOI, as cameras write it: an empty big endian TIFF directory followed
+    # by the bytes of a start of frame marker, which the header parser must skip with the segment
+    payload = b'Exif\0\0' + b'MM\0\x2a\0\0\0\x08' + b'\0\0' + b'\0\0\0\0' + b'\xff\xc0\x00\x11\x08\x00\x10\x00\x10'
+    return data[:2] + b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload + data[2:]
+
+
+@pytest.fixture(params=['baseline', 'progressive', 'exif'])
+def jpeg(request):
+    data = jpeg_bytes(progressive=request.param == 'progressive')
+    return with_exif(data) if request.param == 'exif' else data
+
+
+def test_jpeg_size_is_read_from_the_frame_header(jpeg):
+    assert ImageDecoder.jpeg_size(jpeg) == JPEG_SIZE
+
+
+def test_jpeg_size_of_other_data_is_none(jpeg):
+    assert ImageDecoder.jpeg_size(cv2.imencode('.png', np.zeros((8, 8, 3), np.uint8))[1].tobytes()) is None
+    assert ImageDecoder.jpeg_size(b'') is None
+    assert ImageDecoder.jpeg_size(jpeg[:4]) is None # truncated before the frame header
+
+
+@pytest.mark.parametrize('target_size,factor,reduced_flag', [(100, 4, cv2.IMREAD_REDUCED_COLOR_4),
+                                                             (200, 2, cv2.IMREAD_REDUCED_COLOR_2),
+                                                             (479, 1, cv2.IMREAD_COLOR)])
+def test_target_size_decodes_jpegs_reduced(jpeg, target_size, factor, reduced_flag):
+    decoded = ImageDecoder(target_size).decode(jpeg)
+    assert min(decoded.shape[:2]) == target_size
+    assert decoded.shape[1] == round(JPEG_SIZE[1] / JPEG_SIZE[0] * target_size)
+    reduced = cv2.imdecode(np.frombuffer(jpeg, np.uint8), reduced_flag)
+    assert reduced.shape[:2] == (JPEG_SIZE[0] // factor, JPEG_SIZE[1] // factor)
+    assert np.array_equal(decoded, cv2.resize(reduced, decoded.shape[1::-1], interpolation=cv2.INTER_AREA))
+
+
+def test_target_size_keeps_smaller_images(jpeg):
+    assert np.array_equal(ImageDecoder(1000).decode(jpeg), cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR))
+
+
+@pytest.mark.parametrize('target_size', [None, 100])
+def test_unreadable_paths_are_none(tmp_path, target_size):
+    decoder = ImageDecoder(target_size)
+    (tmp_path / 'text.txt').write_text('not an image')
+    (tmp_path / 'directory.jpg').mkdir()
+    assert decoder.read(str(tmp_path / 'text.txt')) is None
+    assert decoder.read(str(tmp_path / 'directory.jpg')) is None
+    assert decoder.read(str(tmp_path / 'missing.jpg')) is None
+
+
+def test_run_with_target_size_skips_directories(tmp_path, jpeg):
+    input_dir_path, output_dir_path = tmp_path / 'input', tmp_path / 'output'
+    input_dir_path.mkdir()
+    (input_dir_path / 'a.jpg').write_bytes(jpeg)
+    (input_dir_path / 'b').mkdir()
+    config_file_path = tmp_path / 'config.json'
+    config_file_path.write_text(json.dumps({'flip': {'flip': {'flip_code': 1}}}))
+    data_augmentation = DataAugmentation(str(config_file_path), str(input_dir_path), str(output_dir_path), seed=3, target_size=100)
+    data_augmentation.augment_images()
+    assert sorted(name for name in os.listdir(output_dir_path) if name.endswith('.jpg')) == ['a_flip_flip.jpg']
+    assert cv2.imread(str(output_dir_path / 'a_flip_flip.jpg')).shape == (100, 133, 3)
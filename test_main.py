@@ -0,0 +1,141 @@
+"""
+    Incremental and sharded runs of DataAugmentation on small generated images: finished work is
+    skipped on the next run and is never lost when a run stops with an error, and the shards of a
+    sharded run write and merge the outputs of a single run
+"""
+import json
+import os
+import numpy as np
+import pytest
+from cv2 import cv2
+from main import DataAugmentation, OutputNameCollisionError
+from output_manifest import OutputManifest
+from packed_dataset import PackedDatasetReader
+
+CONFIG = {
+    'flip': {'flip': {'flip_code': 1}},
+    'bright': {'zoom': {'zoom_factor': 1.2}, 'random_brightness': {'brightness_range': [-30, 30]}},
+}
+IMAGE_NAMES = ['a.png', 'b.png', 'c.png', 'd.png']
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    input_dir_path = tmp_path / 'input'
+    input_dir_path.mkdir()
+    rng = np.random.default_rng(0)
+    for img_file_name in IMAGE_NAMES:
+        cv2.imwrite(str(input_dir_path / img_file_name), rng.integers(0, 256, (48, 64, 3), dtype=np.uint8))
+    config_file_path = tmp_path / 'config.json'
+    config_file_path.write_text(json.dumps(CONFIG))
+    return str(config_file_path), str(input_dir_path), str(tmp_path / 'output')
+
+
+def data_augmentation(dirs, **kwargs):
+    config_file_path, input_dir_path, output_dir_path = dirs
+    return DataAugmentation(config_file_path, input_dir_path, output_dir_path, seed=kwargs.pop('seed', 3), **kwargs)
+
+
+def output_files(output_dir_path):
+    return {name: os.stat(os.path.join(output_dir_path, name)).st_mtime_ns
+            for name in os.listdir(output_dir_path) if name.endswith('.png')}
+
+
+def test_second_run_does_nothing(dirs):
+    saved_count, _, done_count, _ = data_augmentation(dirs).augment_image_files(IMAGE_NAMES)
+    assert (saved_count, done_count) == (8, 0)
+    written = output_files(dirs[2])
+    assert len(written) == 8
+    saved_count, _, done_count, _ = data_augmentation(dirs).augment_image_files(IMAGE_NAMES)
+    assert (saved_count, done_count) == (0, 8)
+    assert output_files(dirs[2]) == written
+
+
+def test_changed_input_and_seed_are_redone(dirs):
+    data_augmentation(dirs).augment_image_files(IMAGE_NAMES)
+    cv2.imwrite(os.path.join(dirs[1], 'b.png'), np.zeros((48, 64, 3), np.uint8))
+    saved_count, _, done_count, _ = data_augmentation(dirs).augment_image_files(IMAGE_NAMES)
+    assert (saved_count, done_count) == (2, 6)
+    # only the random entry depends on the seed
+    saved_count, _, done_count, _ = data_augmentation(dirs, seed=4).augment_image_files(IMAGE_NAMES)
+    assert (saved_count, done_count) == (4, 4)
+
+
+@pytest.mark.parametrize('io_threads', [0, 2])
+def test_stopped_run_keeps_its_finished_images(dirs, io_threads):
+    stopped_run = data_augmentation(dirs, io_threads=io_threads)
+    augment_decoded_image = stopped_run.augment_decoded_image
+
+    def fail_on_third_image(img_file_name, *args):
+        if img_file_name == IMAGE_NAMES[2]:
+            raise RuntimeError('stopped')
+        return augment_decoded_image(img_file_name, *args)
+    stopped_run.augment_decoded_image = fail_on_third_image
+    with pytest.raises(RuntimeError):
+        stopped_run.augment_image_files(IMAGE_NAMES)
+    saved_count, _, done_count, _ = data_augmentation(dirs).augment_image_files(IMAGE_NAMES)
+    assert (saved_count, done_count) == (4, 4)
+
+
+def output_bytes(output_dir_path):
+    return {name: open(os.path.join(output_dir_path, name), 'rb').read()
+            for name in os.listdir(output_dir_path) if name.endswith('.png')}
+
+
+def test_shards_merge_into_the_single_run(dirs, tmp_path):
+    config_file_path, input_dir_path, output_dir_path = dirs
+    DataAugmentation(config_file_path, input_dir_path, str(tmp_path / 'single'), seed=3).augment_images()
+    for shard_index in range(3):
+        data_augmentation(dirs, work_shard=(shard_index, 3)).augment_images()
+    assert output_bytes(output_dir_path) == output_bytes(str(tmp_path / 'single'))
+    assert data_augmentation(dirs).merge_shard_manifests(2) != [] # wrong shard count
+    assert data_augmentation(dirs).merge_shard_manifests(3) == []
+    # the merged manifest indexes the whole dataset
+    saved_count, _, done_count, _ = data_augmentation(dirs).augment_image_files(IMAGE_NAMES)
+    assert (saved_count, done_count) == (0, 8)
+
+
+def test_merge_reports_missing_outputs(dirs):
+    for shard_index in range(2):
+        data_augmentation(dirs, work_shard=(shard_index, 2)).augment_images()
+    os.remove(os.path.join(dirs[2], sorted(output_bytes(dirs[2]))[0]))
+    problems = data_augmentation(dirs).merge_shard_manifests(2)
+    assert len(problems) == 1 and 'not found' in problems[0]
+    assert OutputManifest(dirs[2]).output_rows() == [] # nothing is merged
+
+
+def test_colliding_output_names_are_rejected_before_any_write(dirs):
+    input_dir_path = dirs[1]
+    image = cv2.imread(os.path.join(input_dir_path, 'a.png'))
+    cv2.imwrite(os.path.join(input_dir_path, 'e.v1.jpg'), image)
+    cv2.imwrite(os.path.join(input_dir_path, 'e.v2.jpg'), image) # different stems, no collision
+    cv2.imwrite(os.path.join(input_dir_path, 'a.bmp'), image) # a.png and a.bmp are both augmented as PNG
+    with pytest.raises(OutputNameCollisionError, match='a.bmp, a.png'):
+        data_augmentation(dirs).augment_images()
+    assert output_files(dirs[2]) == {}
+    os.remove(os.path.join(input_dir_path, 'a.bmp'))
+    data_augmentation(dirs).augment_images()
+    output_names = os.listdir(dirs[2])
+    assert len(output_files(dirs[2])) == 8
+    assert sum(name.startswith('e.v1_') for name in output_names) == sum(name.startswith('e.v2_') for name in output_names) == 2
+
+
+def test_packed_reader_serves_the_live_samples_only(dirs):
+    for _ in range(3):
+        data_augmentation(dirs, resume=False, shard_size=1024 * 1024).augment_images()
+    assert len(PackedDatasetReader(dirs[2], manifest_file_name=None)) == 24 # every sample ever written
+    assert len(PackedDatasetReader(dirs[2])) == 8
+    os.remove(os.path.join(dirs[1], 'd.png'))
+    data_augmentation(dirs, shard_size=1024 * 1024, prune=True).augment_images()
+    dataset = PackedDatasetReader(dirs[2])
+    assert sorted(dataset.metadata(sample_number)['source'] for sample_number in range(len(dataset))) == sorted(IMAGE_NAMES[:3] * 2)
+    assert all(dataset[sample_number].shape == (48, 64, 3) for sample_number in range(len(dataset)))
+
+
+def test_smallest_valid_factors_run_on_small_images(dirs, tmp_path):
+    config_file_path = tmp_path / 'small.json'
+    config_file_path.write_text(json.dumps({'zoom': {'zoom': {'zoom_factor': 0.01}}, 'crop': {'random_crop': {'height_range': 0.015, 'width_range': 0.01}},
+                                            'zoom_chain': {'zoom': {'zoom_factor': 0.015}, 'rotation': {'angle': 10}}}))
+    saved_count, _, _, _ = DataAugmentation(str(config_file_path), dirs[1], dirs[2], seed=3).augment_image_files(IMAGE_NAMES)
+    assert saved_count == 12
+    assert cv2.imread(os.path.join(dirs[2], 'a_crop_random_crop.png')).shape == (1, 1, 3)
@@ -0,0 +1,101 @@
+"""
+    Tiled runs give the images of a regular run whatever the tile size, with the tiles of a pass
+    within the memory limit, including the tiles cv2.remap can only compute once split further
+"""
+import json
+import os
+import tracemalloc
+import numpy as np
+import pytest
+from cv2 import cv2
+from augmentation_plan import ZoomOp
+from geometric_chain import GeometricChainCompiler
+from main import DataAugmentation
+from tiled_augmentation import TiledAugmentation, WarpStage
+
+CONFIG = {
+    'flip': {'flip': {'flip_code': -1}},
+    'rotation': {'rotation': {'angle': 33}},
+    'shear': {'shear': {'shear_angle': 0.3}},
+    'crop': {'random_crop': {'height_range': 0.6, 'width_range': 0.7}},
+    'blur': {'gaussian_blur': {'kernel_size': 7}},
+    'lut': {'adjust_gamma': {'gamma': 1.4}, 'contrast': {'contrast_factor': 1.3}},
+    'chain': {'rotation': {'angle': -20}, 'flip': {'flip_code': 1}, 'shift': {'axis': 1, 'shift_range': 0.1}},
+    'mix': {'random_crop': {'height_range': 0.8, 'width_range': 0.8}, 'gaussian_blur': {'kernel_size': 5}, 'rotation': {'angle': 10}},
+}
+# a lone zoom is resampled like in a fused chain, with a single warp
+ZOOM_FACTORS = {'zoom_in': 1.3, 'zoom_out': 0.6}
+
+
+@pytest.fixture(scope='module')
+def image():
+    noise = np.random.default_rng(0).integers(0, 256, (300, 410, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(noise, (9, 9), 3)
+
+
+@pytest.fixture(scope='module')
+def regular_outputs(tmp_path_factory, image):
+    tmp_path = tmp_path_factory.mktemp('regular')
+    (tmp_path / 'input').mkdir()
+    cv2.imwrite(str(tmp_path / 'input' / 'a.png'), image)
+    (tmp_path / 'config.json').write_text(json.dumps(CONFIG))
+    DataAugmentation(str(tmp_path / 'config.json'), str(tmp_path / 'input'), str(tmp_path / 'output'), seed=5, io_threads=0).augment_images()
+    return str(tmp_path / 'output')
+
+
+@pytest.mark.parametrize('tile_size', [64, 100, None])
+def test_tiled_run_matches_the_regular_run(tmp_path, image, regular_outputs, tile_size):
+    np.save(str(tmp_path / 'a.npy'), image)
+    output_paths = TiledAugmentation(CONFIG, seed=5, tile_size=tile_size).augment_file(str(tmp_path / 'a.npy'), str(tmp_path / 'output'), source_id='a.png')
+    assert len(output_paths) == len(CONFIG)
+    for output_path in output_paths:
+        expected = cv2.imread(os.path.join(regular_outputs, os.path.basename(output_path)[:-len('.npy')] + '.png'))
+        assert np.array_equal(np.load(output_path), expected), output_path
+
+
+@pytest.mark.parametrize('zoom_factor', ZOOM_FACTORS.values(), ids=ZOOM_FACTORS.keys())
+def test_tiled_zoom_matches_a_single_warp(tmp_path, image, zoom_factor):
+    np.save(str(tmp_path / 'a.npy'), image)
+    output_path, = TiledAugmentation({'zoom': {'zoom': {'zoom_factor': zoom_factor}}}, seed=5, tile_size=64).augment_file(
+        str(tmp_path / 'a.npy'), str(tmp_path / 'output'))
+    assert np.array_equal(np.load(output_path), GeometricChainCompiler().apply_chain(image, (ZoomOp(zoom_factor),)))
+
+
+def test_tiles_stay_within_the_memory_limit(tmp_path):
+    np.save(str(tmp_path / 'big.npy'), np.random.default_rng(1).integers(0, 256, (2000, 3000, 3), dtype=np.uint8))
+    config = {
+        'warp': {'rotation': {'angle': 30}, 'zoom': {'zoom_factor': 0.7}},
+        'blur': {'gaussian_blur': {'kernel_size': 9}, 'flip': {'flip_code': 1}},
+        'crop': {'random_crop': {'height_range': 0.9, 'width_range': 0.9}, 'adjust_gamma': {'gamma': 1.3}},
+    }
+    memory_limit = 1024 * 1024 # an 18th of the image
+    tiled_augmentation = TiledAugmentation(config, memory_limit=memory_limit, seed=0)
+    tracemalloc.start()
+    try:
+        output_paths = tiled_augmentation.augment_file(str(tmp_path / 'big.npy'), str(tmp_path / 'output'))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert len(output_paths) == 3
+    assert peak <= memory_limit
+
+
+def test_wide_zoom_out_splits_the_tiles_remap_can_not_compute(tmp_path):
+    # zooming out by 0.2 maps a tile of 8192 pixels to a source region of 40960, over the SHRT_MAX of cv2.remap
+    image = np.random.default_rng(2).integers(0, 256, (64, 70000, 3), dtype=np.uint8)
+    np.save(str(tmp_path / 'wide.npy'), image)
+    config = {'zoom': {'zoom': {'zoom_factor': 0.2}}}
+    stage = WarpStage(image.shape, (ZoomOp(0.2),))
+    assert not stage.fits(TiledAugmentation.MAX_TILE_SIZE)
+    assert max(stage.source_extent(TiledAugmentation(config).stage_tile_size(stage))) <= WarpStage.MAX_REMAP_SIDE
+    outputs = []
+    for tile_size in (None, 40000, 1024):
+        output_path, = TiledAugmentation(config, seed=0, tile_size=tile_size).augment_file(
+            str(tmp_path / 'wide.npy'), str(tmp_path / 'output_{}'.format(tile_size)))
+        outputs.append(np.load(output_path))
+    assert outputs[0].shape == image.shape
+    assert np.array_equal(outputs[0], outputs[1]) and np.array_equal(outputs[0], outputs[2])
+    # the zoomed out image is in the middle fifth, the rest is blank
+    assert not outputs[0][:, :27900].any() and not outputs[0][:, 42100:].any()
+    middle_column = 35000
+    assert outputs[0][:, middle_column - 10:middle_column + 10].any()
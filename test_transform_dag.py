@@ -0,0 +1,39 @@
+"""
+    The prefix tree of a plan gives every entry the same image as the entry applied on its own,
+    whether its shared intermediate results are kept or recomputed, with or without a buffer pool
+"""
+import os
+import numpy as np
+import pytest
+from cv2 import cv2
+from augmentation_plan import AugmentationPlan, image_rng
+from buffer_pool import BufferPool
+from transform_dag import TransformDag
+
+IMAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images', 'horse.jpg')
+CONFIG = {
+    'zoom_gamma': {'zoom': {'zoom_factor': 1.3}, 'adjust_gamma': {'gamma': 1.5}},
+    'zoom_contrast': {'zoom': {'zoom_factor': 1.3}, 'contrast': {'contrast_factor': 0.8}},
+    'zoom_blur_flip': {'zoom': {'zoom_factor': 1.3}, 'gaussian_blur': {'kernel_size': 5}, 'flip': {'flip_code': 1}},
+    'zoom_blur_crop': {'zoom': {'zoom_factor': 1.3}, 'gaussian_blur': {'kernel_size': 5},
+                       'random_crop': {'height_range': 0.5, 'width_range': 0.6}},
+    'zoom_brightness': {'zoom': {'zoom_factor': 1.3}, 'random_brightness': {'brightness_range': [-40, 40]}, 'samples': 3},
+    'rotation': {'rotation': {'angle': 20}},
+}
+
+
+@pytest.mark.parametrize('memory_limit', [512 * 1024 * 1024, 0])
+@pytest.mark.parametrize('buffer_pool_limit', [None, 64 * 1024 * 1024])
+def test_dag_results_match_independent_entries(memory_limit, buffer_pool_limit):
+    image = cv2.imread(IMAGE_PATH)
+    plan = AugmentationPlan(AugmentationPlan.from_config(CONFIG).sample_entries())
+    rng_factory = lambda sample_key: image_rng(7, 'horse.jpg', sample_key)
+    dag = TransformDag(plan, memory_limit=memory_limit)
+    results = {}
+    buffers = BufferPool(buffer_pool_limit) if buffer_pool_limit else None
+    ops_saved = dag.run(image, rng_factory, lambda entry, result: results.__setitem__(entry.sample_key, result), buffers=buffers)
+    assert sorted(results) == sorted(entry.sample_key for entry in plan.entries)
+    for entry in plan.entries:
+        assert np.array_equal(results[entry.sample_key], entry.apply(image, rng=rng_factory(entry.sample_key))), entry.sample_key
+    if memory_limit:
+        assert ops_saved == dag.naive_op_count - dag.op_count > 0
@@ -0,0 +1,585 @@
+"""
+    Tiled, bounded-memory augmentation of very large images (gigapixel aerial or histology scans):
+
+        tiled = TiledAugmentation('input_config_1.json', memory_limit=256 * 1024 * 1024, seed=0)
+        tiled.augment_file('scans/slide_01.npy', 'scans_aug')
+
+        python tiled_augmentation.py --config input_config_1.json --input scans --output scans_aug --memory-mb 256
+
+    Inputs and outputs are .npy files (np.save format, uint8 BGR or grayscale images, that np.load
+    can memory map) read and written tile by tile, so the resident memory follows the tile size
+    instead of the image size. Other image files are decoded whole by OpenCV, which needs the full
+    decoded image in memory once: convert huge inputs to .npy.
+
+    Every entry runs as a sequence of stages, each one streaming a .npy image into the next, one
+    output tile at a time. Intermediate images are temporary .npy files next to the outputs:
+
+        rotation, shear, zoom,      every output tile is resampled from the bounding box of its
+        shift (constant fill)       corners mapped back to the input (inverse mapping), consecutive
+                                    geometric methods with a single resample as in fused chains
+        flip, random_crop           every output tile is copied from its mirrored or offset input tile
+        gaussian_blur               input tiles are read with a halo of half the kernel, mirrored at
+                                    the image borders like OpenCV does
+        adjust_gamma, contrast,     applied in place to the output tiles of the previous stage,
+        random_brightness           without an image of their own
+
+    The tile size is the largest power of two whose input region, output tile and temporary arrays
+    fit in memory_limit, halved further for geometric stages until the tile and its input region
+    are smaller than the 32767 pixels a side of cv2.remap. Random values are drawn once per image, from the same generators as
+    DataAugmentation, seeded from the source id of the image (its file name by default). A tiled run
+    gives the same images as a regular run with the same seed on a file of that name: pass the name
+    of the original file as source_id (or --source-extension) for a .npy converted from it. The
+    exceptions are a lone zoom, resampled like in a fused chain, a few pixels along the blanked
+    borders of geometric chains (the frames are rasterized per tile) and random_brightness, within
+    one intensity level on some pixels of the tiles (OpenCV converts the last pixels of a row
+    back from HSV without SIMD, with a different rounding). Shift and shear with other fill modes,
+    and methods without a tiled version, are rejected with ValueError
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import numpy as np
+from cv2 import cv2
+from augmentation_plan import (AugmentationPlan, GeometricChainOp, PhotometricChainOp, FlipOp, ShearOp, RandomCropOp,
+                               RandomBrightnessOp, GaussianBlurOp, image_rng)
+from geometric_chain import GeometricChainCompiler
+from image_augmentation import ImageAugmentation
+from run_stats import DISABLED_STATS
+
+
+class NpyImage:
+    """
+        Image stored in a .npy file, read and written one tile at a time through a file handle kept
+        open until close: every row of a tile is one positioned read or write, so only the tile itself
+        is ever held in memory. Memory maps of the rows of a tile fault whole runs of pages around
+        every row in, several times the size of the tile
+    """
+
+    def __init__(self, file_path, writable=False):
+        self.file_path = file_path
+        self.npy_file = open(file_path, 'r+b' if writable else 'rb', buffering=0)
+        try:
+            version = np.lib.format.read_magic(self.npy_file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(self.npy_file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(self.npy_file)
+            self.offset = self.npy_file.tell()
+            if fortran_order or dtype != np.uint8 or len(shape) not in (2, 3):
+                raise ValueError('{}: tiled images must be 2 or 3 dimensional C ordered uint8 arrays, got {} {}'.format(
+                    file_path, dtype, shape))
+            if os.fstat(self.npy_file.fileno()).st_size < self.offset + int(np.prod(shape)):
+                raise ValueError('{}: truncated, the file is smaller than its {} image'.format(file_path, shape))
+        except BaseException:
+            self.npy_file.close()
+            raise
+        self.shape = shape
+        self.pixel_bytes = int(np.prod(shape[2:]))
+        self.row_bytes = shape[1] * self.pixel_bytes
+
+    @classmethod
+    def create(cls, file_path, shape):
+        # the file is created at its full size without writing it (sparse on most file systems)
+        image = np.lib.format.open_memmap(file_path, mode='w+', dtype=np.uint8, shape=tuple(shape))
+        del image
+        return cls(file_path, writable=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.npy_file.close()
+
+    def row_offset(self, y, x):
+        return self.offset + y * self.row_bytes + x * self.pixel_bytes
+
+    def read(self, y0, y1, x0, x1):
+        """
+            Region of the image as a new array
+        """
+        tile = np.empty((y1 - y0, x1 - x0) + tuple(self.shape[2:]), np.uint8)
+        for row_index in range(y1 - y0):
+            row = tile[row_index].reshape(-1)
+            offset = self.row_offset(y0 + row_index, x0)
+            if hasattr(os, 'preadv'):
+                byte_count = os.preadv(self.npy_file.fileno(), [row], offset)
+            else: # no positioned I/O on Windows
+                self.npy_file.seek(offset)
+                byte_count = self.npy_file.readinto(row)
+            if byte_count != row.nbytes:
+                raise OSError('{}: short read of row {}, {} of {} bytes'.format(self.file_path, y0 + row_index, byte_count, row.nbytes))
+        return tile
+
+    def write(self, y0, x0, tile):
+        tile = np.ascontiguousarray(tile)
+        for row_index in range(tile.shape[0]):
+            row = tile[row_index].reshape(-1)
+            offset = self.row_offset(y0 + row_index, x0)
+            if hasattr(os, 'pwritev'):
+                byte_count = os.pwritev(self.npy_file.fileno(), [row], offset)
+            else:
+                self.npy_file.seek(offset)
+                byte_count = self.npy_file.write(row)
+            if byte_count != row.nbytes:
+                raise OSError('{}: short write of row {}, {} of {} bytes'.format(self.file_path, y0 + row_index, byte_count, row.nbytes))
+
+
+class InMemoryImage:
+    """
+        Decoded image read like a NpyImage
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self.shape = image.shape
+
+    def read(self, y0, y1, x0, x1):
+        return np.array(self.image[y0:y1, x0:x1])
+
+    def close(self):
+        pass
+
+
+class TileStage:
+    """
+        One pass over the tiles of an output image: a spatial step computing every output tile from
+        a region of the input image, followed by the pointwise functions applied in place to the tile
+    """
+    name = 'copy'
+
+    def __init__(self, input_shape):
+        self.input_shape = input_shape
+        self.shape = input_shape # shape of the output image
+        self.pointwise = [] # (name, function of a tile returning the transformed tile)
+
+    @property
+    def names(self):
+        return [self.name] + [name for name, _ in self.pointwise]
+
+    def source_region(self, region):
+        """
+            (y0, y1, x0, x1) region of the input image the given output tile is computed from, None when it's empty
+        """
+        return region
+
+    def compute(self, source_tile, source_region, region):
+        # tiles are read into new arrays, the pointwise functions can transform them in place
+        return source_tile
+
+    def fits(self, tile_size):
+        """
+            Whether the stage can compute tiles of the given size, whatever memory they take
+        """
+        return True
+
+    def tile_bytes(self, tile_size):
+        """
+            Bytes used by the tiles of a pass for the given tile size: the input region, a transformed
+            copy of it and the output tile
+        """
+        y1, x1 = min(tile_size, self.shape[0]), min(tile_size, self.shape[1])
+        source_region = self.source_region((0, y1, 0, x1))
+        source_pixels = 0 if source_region is None else (source_region[1] - source_region[0]) * (source_region[3] - source_region[2])
+        channels = int(np.prod(self.shape[2:]))
+        return (2 * source_pixels + y1 * x1) * channels
+
+    def run(self, source, destination, tile_size):
+        for y0 in range(0, self.shape[0], tile_size):
+            for x0 in range(0, self.shape[1], tile_size):
+                region = (y0, min(y0 + tile_size, self.shape[0]), x0, min(x0 + tile_size, self.shape[1]))
+                source_region = self.source_region(region)
+                source_tile = None if source_region is None else source.read(*source_region)
+                tile = self.compute(source_tile, source_region, region)
+                del source_tile
+                for _, function in self.pointwise:
+                    tile = function(tile)
+                destination.write(y0, x0, tile)
+
+
+class WarpStage(TileStage):
+    """
+        Geometric ops resampled tile by tile: every output pixel is mapped back to the input by the
+        inverse of the forward matrix of the ops, so a tile only needs the bounding box of its mapped corners.
+        Tiles are remapped with the fixed point coordinates cv2.warpAffine computes for the whole image,
+        so they hold the same pixels as a single warp
+    """
+    compiler = GeometricChainCompiler()
+    # fixed point arithmetic of cv2.warpAffine: coordinates scaled by 2**AB_BITS, INTER_BITS bits of sub-pixel position
+    AB_BITS, INTER_BITS = 10, 5
+    # cv2.remap takes source and destination images of less than SHRT_MAX pixels on each side
+    MAX_REMAP_SIDE = np.iinfo(np.int16).max - 1
+
+    def __init__(self, input_shape, ops, inverse_matrix=None):
+        """
+            Parameters
+            ----------
+                input_shape : tuple
+                    shape of the input image
+                ops : tuple of geometric AugmentationOp
+                    ops in the order they have to be applied
+                inverse_matrix : 2x3 np.array
+                    destination -> source matrix, inverted from the forward matrix of the ops when not given
+        """
+        super().__init__(input_shape)
+        self.name = '+'.join(op.method_name for op in ops)
+        self.op_matrices = [op.matrix(input_shape) for op in ops]
+        if inverse_matrix is None:
+            inverse_matrix = cv2.invertAffineTransform(self.compiler.chain_matrix(self.op_matrices)[:2])
+        self.inverse_matrix = inverse_matrix
+
+    def source_region(self, region):
+        y0, y1, x0, x1 = region
+        corners = np.array([[x0, y0, 1], [x1 - 1, y0, 1], [x1 - 1, y1 - 1, 1], [x0, y1 - 1, 1]]).T
+        source_x, source_y = self.inverse_matrix @ corners
+        # one more pixel on each side for the bilinear interpolation
+        sx0, sx1 = max(int(np.floor(source_x.min())) - 1, 0), min(int(np.ceil(source_x.max())) + 2, self.input_shape[1])
+        sy0, sy1 = max(int(np.floor(source_y.min())) - 1, 0), min(int(np.ceil(source_y.max())) + 2, self.input_shape[0])
+        if sx0 >= sx1 or sy0 >= sy1:
+            return None
+        return (sy0, sy1, sx0, sx1)
+
+    def source_extent(self, tile_size):
+        """
+            (height, width) of the source region of a whole tile of the given size, before it is clipped
+            to the input image: the same for every tile of an affine map, up to the rounding of its bounds
+        """
+        corners = np.array([[0, 0, 1], [tile_size - 1, 0, 1], [tile_size - 1, tile_size - 1, 1], [0, tile_size - 1, 1]]).T
+        source_x, source_y = self.inverse_matrix @ corners
+        # the pixel on each side of source_region and one more for the rounding of its bounds
+        return (int(np.ceil(np.ptp(source_y))) + 4, int(np.ceil(np.ptp(source_x))) + 4)
+
+    def fits(self, tile_size):
+        # the remap positions, relative to the source region, are then within the int16 range too
+        return tile_size <= self.MAX_REMAP_SIDE and max(self.source_extent(tile_size)) <= self.MAX_REMAP_SIDE
+
+    def tile_bytes(self, tile_size):
+        # the int32 coordinates and the remap maps take 16 bytes per output pixel
+        return super().tile_bytes(tile_size) + 16 * min(tile_size, self.shape[0]) * min(tile_size, self.shape[1])
+
+    def remap_maps(self, region, source_region):
+        """
+            cv2.remap maps of an output tile relative to its source region: (integer source positions as
+            CV_16SC2, sub-pixel interpolation table indices as CV_16UC1), as computed by cv2.warpAffine
+        """
+        y0, y1, x0, x1 = region
+        sy0, _, sx0, _ = source_region
+        scale, round_delta = 1 << self.AB_BITS, 1 << (self.AB_BITS - self.INTER_BITS - 1)
+        matrix = self.inverse_matrix
+        columns, rows = np.arange(x0, x1), np.arange(y0, y1)[:, None]
+        source_x = np.rint((matrix[0, 1] * rows + matrix[0, 2]) * scale).astype(np.int32) + round_delta
+        source_x = source_x + np.rint(matrix[0, 0] * columns * scale).astype(np.int32)
+        source_y = np.rint((matrix[1, 1] * rows + matrix[1, 2]) * scale).astype(np.int32) + round_delta
+        source_y = source_y + np.rint(matrix[1, 0] * columns * scale).astype(np.int32)
+        source_x >>= self.AB_BITS - self.INTER_BITS
+        source_y >>= self.AB_BITS - self.INTER_BITS
+        table_size = 1 << self.INTER_BITS
+        table_indices = ((source_y & (table_size - 1)) * table_size + (source_x & (table_size - 1))).astype(np.uint16)
+        source_x = (source_x >> self.INTER_BITS) - sx0
+        source_y = (source_y >> self.INTER_BITS) - sy0
+        int16 = np.iinfo(np.int16)
+        if min(source_x.min(), source_y.min()) < int16.min or max(source_x.max(), source_y.max()) > int16.max:
+            raise ValueError('tile {} maps too far from its source region {} for cv2.remap, use smaller tiles'.format(region, source_region))
+        positions = np.empty(source_x.shape + (2,), np.int16)
+        positions[..., 0] = source_x
+        positions[..., 1] = source_y
+        return positions, table_indices
+
+    def compute(self, source_tile, source_region, region):
+        y0, y1, x0, x1 = region
+        if source_tile is None: # the whole tile maps outside of the input image
+            return np.zeros((y1 - y0, x1 - x0) + tuple(self.shape[2:]), np.uint8)
+        positions, table_indices = self.remap_maps(region, source_region)
+        tile = cv2.remap(source_tile, positions, table_indices, cv2.INTER_LINEAR,
+                         borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        if tile.ndim < len(self.shape): # cv2 drops the channel axis of single channel images
+            tile = tile.reshape(tile.shape + (1,))
+        blank_mask = self.compiler.blank_mask(self.op_matrices, self.input_shape, region)
+        if blank_mask is not None:
+            tile[blank_mask] = 0
+        return tile
+
+
+class FlipStage(TileStage):
+    name = 'flip'
+
+    def __init__(self, input_shape, flip_code):
+        super().__init__(input_shape)
+        self.flip_code = flip_code
+
+    def source_region(self, region):
+        y0, y1, x0, x1 = region
+        height, width = self.input_shape[:2]
+        if self.flip_code <= 0: # flip around the x-axis
+            y0, y1 = height - y1, height - y0
+        if self.flip_code != 0: # flip around the y-axis
+            x0, x1 = width - x1, width - x0
+        return (y0, y1, x0, x1)
+
+    def compute(self, source_tile, source_region, region):
+        return cv2.flip(source_tile, self.flip_code).reshape(source_tile.shape)
+
+
+class CropStage(TileStage):
+    name = 'random_crop'
+
+    def __init__(self, input_shape, crop_box):
+        super().__init__(input_shape)
+        self.y, self.x, height, width = crop_box
+        self.shape = (height, width) + tuple(input_shape[2:])
+
+    def source_region(self, region):
+        y0, y1, x0, x1 = region
+        return (self.y + y0, self.y + y1, self.x + x0, self.x + x1)
+
+
+class BlurStage(TileStage):
+    """
+        Gaussian blur of tiles read with a halo of half the kernel on each side. Halos that fall outside
+        of the image are mirrored like the default border of cv2.GaussianBlur, so tiles match the whole image blur
+    """
+    name = 'gaussian_blur'
+    img_augmentator = ImageAugmentation()
+
+    def __init__(self, input_shape, kernel):
+        super().__init__(input_shape)
+        self.kernel = kernel
+        self.halo_x, self.halo_y = kernel[0] // 2, kernel[1] // 2
+
+    def source_region(self, region):
+        y0, y1, x0, x1 = region
+        return (max(y0 - self.halo_y, 0), min(y1 + self.halo_y, self.input_shape[0]),
+                max(x0 - self.halo_x, 0), min(x1 + self.halo_x, self.input_shape[1]))
+
+    def compute(self, source_tile, source_region, region):
+        y0, y1, x0, x1 = region
+        sy0, sy1, sx0, sx1 = source_region
+        top, bottom = self.halo_y - (y0 - sy0), self.halo_y - (sy1 - y1)
+        left, right = self.halo_x - (x0 - sx0), self.halo_x - (sx1 - x1)
+        padded = cv2.copyMakeBorder(source_tile, top, bottom, left, right, cv2.BORDER_REFLECT_101)
+        blurred = self.img_augmentator.gaussian_blur(padded, kernel=self.kernel)
+        return blurred[self.halo_y:self.halo_y + y1 - y0, self.halo_x:self.halo_x + x1 - x0].reshape(
+            (y1 - y0, x1 - x0) + tuple(self.shape[2:]))
+
+
+class TiledAugmentation:
+
+    MIN_TILE_SIZE = 16
+    MAX_TILE_SIZE = 8192
+
+    def __init__(self, config, memory_limit=256 * 1024 * 1024, tile_size=None, seed=None, stats=DISABLED_STATS):
+        """
+            Parameters
+            ----------
+                config : str, dict or AugmentationPlan
+                    path of the JSON configuration file, the loaded config or its compiled plan
+                memory_limit : int
+                    bytes of the tiles of a pass (input region, transformed copy, output tile and
+                    temporary arrays), the tile size is chosen for every pass to fit in it
+                tile_size : int
+                    fixed tile size in pixels instead of the one chosen from memory_limit
+                seed : int
+                    global seed of the random methods, a random one is drawn when not given
+                stats : RunStats
+                    records the time of every stage ('op:<methods>') and of every entry ('entry:<key>')
+        """
+        if isinstance(config, AugmentationPlan):
+            self.plan = config
+        else:
+            if not isinstance(config, dict):
+                with open(config, 'r', encoding='utf8') as json_file:
+                    config = json.load(json_file)
+            self.plan = AugmentationPlan.from_config(config)
+        for entry in self.plan.entries:
+            ops = entry.ops
+            if entry.policy is not None:
+                ops += tuple(policy_op.make(policy_op.magnitude_range[0]) if policy_op.magnitude_range else policy_op.op
+                             for policy_op in entry.policy.ops)
+            for op in ops:
+                if not self.is_tiled(op):
+                    raise ValueError("entry '{}': method '{}' with these parameters has no tiled version".format(
+                        entry.key, op.method_name))
+        if tile_size is not None and tile_size < 1:
+            raise ValueError('tile size must be a positive number of pixels, got {}'.format(tile_size))
+        self.memory_limit = memory_limit
+        self.tile_size = tile_size
+        self.seed = seed if seed is not None else np.random.SeedSequence().entropy
+        self.stats = stats
+        self.img_augmentator = ImageAugmentation()
+
+    @staticmethod
+    def is_tiled(op):
+        if op.fusion_kind == 'geometric' or isinstance(op, (RandomCropOp, GaussianBlurOp, RandomBrightnessOp)):
+            return True
+        # other pointwise ops have to be lookup tables, their random values (if any) couldn't be drawn once per image
+        return op.fusion_kind == 'photometric' and op.table() is not None
+
+    @staticmethod
+    def open_image(file_path):
+        """
+            NpyImage of a .npy file, InMemoryImage of any other image file, None when it can't be read as an image
+        """
+        if file_path.lower().endswith('.npy'):
+            return NpyImage(file_path)
+        image = cv2.imread(file_path)
+        return InMemoryImage(image) if image is not None else None
+
+    def pointwise_functions(self, ops, rng):
+        functions = []
+        for step, value in PhotometricChainOp.compiler.compile_chain(ops):
+            if(step == 'lut'):
+                functions.append(('lut', lambda tile, table=value: cv2.LUT(tile, table, dst=tile)))
+            else: # random brightness, drawn once for the whole image
+                rand_val = ImageAugmentation.random_brightness_value(value.brightness_range, rng)
+                functions.append((value.method_name, lambda tile, rand_val=rand_val: self.img_augmentator.bright_image(
+                    tile, rand_val, channel_order='BGR', out=tile)))
+        return functions
+
+    def entry_stages(self, entry, image_shape, rng):
+        """
+            Stages of an entry for an image of the given shape, drawing the random values of its ops from rng
+        """
+        stages = []
+        shape = image_shape
+        for step in entry.steps:
+            if isinstance(step, PhotometricChainOp) or step.fusion_kind == 'photometric':
+                if not stages:
+                    stages.append(TileStage(shape))
+                stages[-1].pointwise.extend(self.pointwise_functions(step.ops if isinstance(step, PhotometricChainOp) else (step,), rng))
+                continue
+            if isinstance(step, FlipOp):
+                stage = FlipStage(shape, step.flip_code)
+            elif isinstance(step, ShearOp): # same destination -> source matrix as ShearOp.apply
+                stage = WarpStage(shape, (step,), ImageAugmentation.shear_matrix(step.shear_angle))
+            elif isinstance(step, GeometricChainOp) or step.fusion_kind == 'geometric':
+                stage = WarpStage(shape, step.ops if isinstance(step, GeometricChainOp) else (step,))
+            elif isinstance(step, RandomCropOp):
+                stage = CropStage(shape, ImageAugmentation.random_crop_box(shape, step.height_range, step.width_range, rng))
+            else:
+                stage = BlurStage(shape, step.kernel)
+            stages.append(stage)
+            shape = stage.shape
+        return stages
+
+    def stage_tile_size(self, stage):
+        if self.tile_size is not None:
+            tile_size = self.tile_size
+        else:
+            tile_size = self.MAX_TILE_SIZE
+            while tile_size > self.MIN_TILE_SIZE and stage.tile_bytes(tile_size) > self.memory_limit:
+                tile_size //= 2
+        # tiles of any size hold the same pixels, the ones a stage can't compute are split further
+        # (zooming out by 0.2 maps a tile of 8192 pixels to a source region of 40960)
+        while tile_size > 1 and not stage.fits(tile_size):
+            tile_size //= 2
+        return tile_size
+
+    def augment_image(self, image, source_id, output_dir_path, image_name=None):
+        """
+            Apply every entry of the config to one image, tile by tile
+            Parameters
+            ----------
+                image : NpyImage or InMemoryImage
+                    input image, never modified
+                source_id : str
+                    file name of the image, the random methods are seeded from it
+                output_dir_path : str
+                    directory the augmented .npy images are written to
+                image_name : str
+                    prefix of the output file names, the source id without its extension by default
+            Returns
+            -------
+                list of the paths of the written images
+        """
+        image_name = image_name if image_name is not None else os.path.splitext(str(source_id))[0]
+        rng_factory = lambda sample_key: image_rng(self.seed, source_id, sample_key)
+        output_paths = []
+        for entry in self.plan.sample_entries(rng_factory):
+            entry_start = self.stats.start()
+            stages = self.entry_stages(entry, image.shape, rng_factory(entry.sample_key))
+            sample_name = [] if entry.sample is None else ['s{}'.format(entry.sample)]
+            output_path = os.path.join(output_dir_path, '_'.join(str(value) for value in [image_name, entry.key] + sample_name + entry.method_names) + '.npy')
+            source = image
+            destinations = [] # open images written by the stages, in the order of temporary_paths then the output
+            temporary_paths = []
+            try:
+                for stage_index, stage in enumerate(stages):
+                    if stage_index == len(stages) - 1:
+                        destination = NpyImage.create(output_path, stage.shape)
+                    else:
+                        file_descriptor, temporary_path = tempfile.mkstemp(suffix='.npy', dir=output_dir_path)
+                        os.close(file_descriptor)
+                        temporary_paths.append(temporary_path)
+                        destination = NpyImage.create(temporary_path, stage.shape)
+                    destinations.append(destination)
+                    start = self.stats.start()
+                    stage.run(source, destination, self.stage_tile_size(stage))
+                    self.stats.stop('op:' + '+'.join(stage.names), start)
+                    if len(temporary_paths) > 1: # the input of this stage is no longer needed
+                        destinations.pop(0).close() # Windows can't remove open files
+                        os.remove(temporary_paths.pop(0))
+                    source = destination
+            finally:
+                for destination in destinations:
+                    destination.close()
+                for temporary_path in temporary_paths:
+                    os.remove(temporary_path)
+            self.stats.stop('entry:' + entry.key, entry_start)
+            output_paths.append(output_path)
+            print(source_id, '---', entry.key, *sample_name, entry.method_names)
+        return output_paths
+
+    def augment_file(self, file_path, output_dir_path, source_id=None):
+        """
+            Apply every entry of the config to one image file, see augment_image. The random methods are
+            seeded from source_id, the file name by default: give the name of the original image (for
+            example 'cat.png' for 'cat.npy') to draw the same values as a regular run on that image
+        """
+        image = self.open_image(file_path)
+        if image is None:
+            print(file_path, '--- skipped, can not be read as an image', file=sys.stderr)
+            return []
+        try:
+            os.makedirs(output_dir_path, exist_ok=True)
+            return self.augment_image(image, source_id if source_id is not None else os.path.basename(file_path), output_dir_path)
+        finally:
+            image.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Augment very large images tile by tile, with a bounded memory use')
+    parser.add_argument('--config', required=True, help='path of the JSON configuration file')
+    parser.add_argument('--input', required=True, help='image file or directory of images (.npy files are read tile by tile)')
+    parser.add_argument('--output', required=True, help='directory of the augmented .npy images')
+    parser.add_argument('--memory-mb', type=int, default=256, help='memory for the tiles of a pass (default: 256)')
+    parser.add_argument('--tile-size', type=int, default=None, help='fixed tile size in pixels (default: chosen from --memory-mb)')
+    parser.add_argument('--seed', type=int, default=None, help='global seed of the random methods (default: a random seed)')
+    parser.add_argument('--source-extension', default=None, metavar='EXT',
+                        help='seed the random methods as if the inputs had this extension, for example .png for .npy files '
+                             'converted from PNG images, so that they match a regular run on the original files '
+                             '(default: the random methods are seeded from the input file names)')
+    args = parser.parse_args(argv)
+    try:
+        tiled_augmentation = TiledAugmentation(args.config, memory_limit=args.memory_mb * 1024 * 1024,
+                                               tile_size=args.tile_size, seed=args.seed)
+    except ValueError as error: # ConfigError included
+        print('invalid config {}: {}'.format(args.config, error), file=sys.stderr)
+        return 2
+    if os.path.isdir(args.input):
+        file_paths = sorted(entry.path for entry in os.scandir(args.input) if entry.is_file())
+    else:
+        file_paths = [args.input]
+    for file_path in file_paths:
+        source_id = None
+        if args.source_extension is not None:
+            source_id = os.path.splitext(os.path.basename(file_path))[0] + args.source_extension
+        tiled_augmentation.augment_file(file_path, args.output, source_id)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
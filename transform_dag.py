@@ -0,0 +1,144 @@
+from run_stats import DISABLED_STATS
+
+
+class TransformNode:
+    """
+        One compiled step of the prefix tree, shared by every entry whose steps start with the
+        same steps as the path from the root to this node
+    """
+
+    def __init__(self, step, entry_key=None):
+        self.step = step
+        # sample key of the only entry this node belongs to, None for nodes shared between entries
+        self.entry_key = entry_key
+        self.children = []
+        self.entries = [] # entries whose last step is this node
+
+
+class TransformDag:
+    """
+        Prefix tree of the compiled steps of every entry of a plan. Deterministic steps that
+        start several entries are computed once per image and their result is reused by all
+        the entries that share them. Random steps draw from the generator of their own entry,
+        so from the first random step on, the path of an entry is never shared
+
+        Intermediate results are kept in memory only while more than one consumer still needs
+        them and only within memory_limit bytes per image. Past the limit an intermediate is
+        dropped and recomputed from the closest kept ancestor for its next consumers
+    """
+
+    def __init__(self, plan, memory_limit=512 * 1024 * 1024):
+        self.memory_limit = memory_limit
+        self.root = TransformNode(None)
+        self.naive_op_count = 0 # ops of one image when every entry is computed on its own
+        for entry in plan.entries:
+            node = self.root
+            for step in entry.steps:
+                node = self.child_node(node, step, entry.sample_key)
+                self.naive_op_count += step.op_count
+            node.entries.append(entry)
+        self.retained_bytes = 0
+        self.executed_op_count = 0
+        self.buffers = None
+
+    def child_node(self, node, step, entry_key):
+        # deterministic steps below shared nodes can be shared, the nodes of a single entry
+        # (from its first random step on) never are
+        if node.entry_key is None and not step.is_random:
+            for child in node.children:
+                if child.entry_key is None and child.step == step:
+                    return child
+            entry_key = None
+        child = TransformNode(step, entry_key)
+        node.children.append(child)
+        return child
+
+    @property
+    def op_count(self):
+        """
+            ops of one image when shared prefixes are computed once
+        """
+        def subtree_op_count(node):
+            return sum(child.step.op_count + subtree_op_count(child) for child in node.children)
+        return subtree_op_count(self.root)
+
+    def run(self, image, rng_factory, on_result, stats=DISABLED_STATS, buffers=None):
+        """
+            Apply every entry of the plan to the given image
+            Parameters
+            ----------
+                image : ndim np.array
+                    decoded input image, never modified
+                rng_factory : callable
+                    entry sample key -> np.random.Generator of the (image, entry sample) pair
+                on_result : callable
+                    called with (entry, transformed image) for every entry of the plan
+                stats : RunStats
+                    records the time of every step ('op:<name>') and of every entry ('entry:<key>')
+                buffers : BufferPool
+                    when given, the steps that can write into an out buffer write into pooled buffers
+            Returns
+            -------
+                number of ops saved by reusing shared intermediate results
+        """
+        self.executed_op_count = 0
+        self.retained_bytes = 0
+        self.buffers = buffers
+        # the decoded image is kept by the caller, it is always available as the root result
+        path = [[self.root, image, None]]
+        for child in self.root.children:
+            self.run_node(path, child, [image], None, rng_factory, on_result, stats, 0.0)
+        return self.naive_op_count - self.executed_op_count
+
+    def run_node(self, path, node, input_holder, rng, rng_factory, on_result, stats, path_seconds):
+        # the input is handed over in a list so that no frame keeps a reference to it once consumed.
+        # path_seconds: time of the steps from the root to this node, the cost of the entries ending here
+        if rng is None and node.entry_key is not None:
+            rng = rng_factory(node.entry_key)
+        start = stats.start()
+        image = self.apply_step(node.step, input_holder.pop(), rng)
+        if stats.enabled:
+            path_seconds += stats.stop('op:' + node.step.name, start)
+            for entry in node.entries:
+                stats.add('entry:' + entry.key, path_seconds)
+        self.executed_op_count += node.step.op_count
+        for entry in node.entries:
+            on_result(entry, image)
+        if not node.children:
+            return
+        retain = len(node.children) > 1 and self.retained_bytes + image.nbytes <= self.memory_limit
+        if retain:
+            self.retained_bytes += image.nbytes
+        path.append([node, image if retain else None, rng])
+        for child_index, child in enumerate(node.children):
+            if child_index == 0:
+                child_input, image = image, None
+            elif retain:
+                child_input = path[-1][1]
+            else:
+                child_input = self.recompute(path, stats)
+            input_holder = [child_input]
+            del child_input
+            self.run_node(path, child, input_holder, rng, rng_factory, on_result, stats, path_seconds)
+        if retain:
+            self.retained_bytes -= path[-1][1].nbytes
+        path.pop()
+
+    def apply_step(self, step, image, rng):
+        if self.buffers is not None and step.writes_out:
+            return step.apply(image, rng=rng, out=self.buffers.acquire(image.shape, image.dtype))
+        return step.apply(image, rng=rng)
+
+    def recompute(self, path, stats=DISABLED_STATS):
+        """
+            Result of the last node of the path, recomputed from its closest kept ancestor.
+            Only shared (deterministic) nodes branch, so the recomputed steps never draw random values
+        """
+        kept_index = max(index for index, (_, image, _) in enumerate(path) if image is not None)
+        image = path[kept_index][1]
+        for node, _, rng in path[kept_index + 1:]:
+            start = stats.start()
+            image = self.apply_step(node.step, image, rng)
+            stats.stop('op:' + node.step.name, start)
+            self.executed_op_count += node.step.op_count
+        return image